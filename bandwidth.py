@@ -0,0 +1,175 @@
+import heapq
+import itertools
+import re
+import threading
+import time
+from typing import Callable, Optional
+
+HIGH = "high"
+NORMAL = "normal"
+LOW = "low"
+PRIORITIES = (HIGH, NORMAL, LOW)  # highest first
+WAIT_SLICE = 0.25  # seconds, how often waiting downloads check whether they were cancelled
+MIN_BURST = 256 * 1024  # bytes
+RATE_PATTERN = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([kmg]?)i?b?(?:/s)?\s*$", re.IGNORECASE)
+RATE_UNITS = {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+
+
+def parse_rate(rate: Optional[str | int | float]) -> Optional[int]:
+    """Returns a rate like 500K, 2M or 2.5MB/s (or a plain number) in bytes per second, None for no limit."""
+    if rate is None or rate == "" or rate == 0:
+        return None
+    if isinstance(rate, (int, float)):
+        return int(rate)
+    match = RATE_PATTERN.match(rate)
+    if not match:
+        raise ValueError(f"Invalid rate '{rate}', expected e.g. 500K or 2M")
+    return int(float(match[1]) * RATE_UNITS[match[2].lower()]) or None
+
+
+class TokenBucket:
+    """Token bucket of rate bytes per second, holding at most a quarter second's worth of tokens.
+
+    Tokens may go into debt by one chunk, so chunks larger than the bucket still pass, and the next consumer waits
+    for the debt to be paid back.
+    """
+
+    def __init__(self, rate: Optional[int] = None) -> None:
+        self.rate = rate
+        self._tokens = 0.0
+        self._updated = time.monotonic()
+
+    @property
+    def burst(self) -> float:
+        return max(MIN_BURST, self.rate / 4)
+
+    def refill(self) -> float:
+        """Adds the tokens earned since the last refill, returns the tokens available."""
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        return self._tokens
+
+    def take(self, count: int) -> None:
+        self._tokens -= count
+
+    def wait_time(self) -> float:
+        """Seconds until the bucket is out of debt."""
+        return max(0.0, -self._tokens / self.rate)
+
+
+class JobShare:
+    """A job's place in the scheduler: its priority class, its own rate limit and a cancellation check that is
+    called while its downloads wait for bandwidth, and raises to stop the waiting download."""
+
+    def __init__(self, job_id: int, priority: str = NORMAL, rate: Optional[int] = None,
+                 check_cancelled: Optional[Callable[[], None]] = None) -> None:
+        self.job_id = job_id
+        self.priority = priority
+        self.bucket = TokenBucket(rate)
+        self.check_cancelled = check_cancelled or (lambda: None)
+        self._lock = threading.Lock()
+
+    @property
+    def rank(self) -> int:
+        return PRIORITIES.index(self.priority)
+
+
+class BandwidthScheduler:
+    """Shares download bandwidth between jobs, with token buckets for a global rate cap and per-job caps.
+
+    Download threads call acquire() with every chunk they received, before writing it. When the global cap is
+    reached, waiting chunks are let through strictly by priority class, in arrival order within a class, so a high
+    priority job gets all the bandwidth it can use and lower classes get the rest. Without any cap, acquire()
+    returns at once without taking a lock.
+    """
+
+    def __init__(self, rate: Optional[int] = None) -> None:
+        self.bucket = TokenBucket(rate)
+        self._condition = threading.Condition()
+        self._waiting = []  # heap of [rank, arrival, share] entries
+        self._arrivals = itertools.count()
+        self._shares = {}  # job id -> JobShare
+
+    @property
+    def rate(self) -> Optional[int]:
+        return self.bucket.rate
+
+    def set_rate(self, rate: Optional[int]) -> None:
+        """Changes the global cap, None for no cap."""
+        with self._condition:
+            self.bucket.rate = rate
+            self._condition.notify_all()
+
+    def register(self, job_id: int, priority: str = NORMAL, rate: Optional[int] = None,
+                 check_cancelled: Optional[Callable[[], None]] = None) -> JobShare:
+        share = JobShare(job_id, priority, rate, check_cancelled)
+        with self._condition:
+            self._shares[job_id] = share
+        return share
+
+    def unregister(self, job_id: int) -> None:
+        with self._condition:
+            self._shares.pop(job_id, None)
+
+    def set_priority(self, job_id: int, priority: str) -> None:
+        """Moves a running job to another priority class, including the chunks it has waiting."""
+        if priority not in PRIORITIES:
+            raise ValueError(f"Invalid priority '{priority}'")
+        with self._condition:
+            share = self._shares.get(job_id)
+            if share is None:
+                return
+            share.priority = priority
+            for entry in self._waiting:
+                if entry[2] is share:
+                    entry[0] = share.rank
+            heapq.heapify(self._waiting)
+            self._condition.notify_all()
+
+    def set_job_rate(self, job_id: int, rate: Optional[int]) -> None:
+        """Changes the rate cap of a running job, None for no cap."""
+        with self._condition:
+            share = self._shares.get(job_id)
+        if share is not None:
+            with share._lock:
+                share.bucket.rate = rate
+
+    def acquire(self, share: JobShare, count: int) -> None:
+        """Blocks until count bytes of the job may be written, within its own cap and the global cap."""
+        if share.bucket.rate is not None:
+            self._acquire_job(share, count)
+        if self.bucket.rate is not None:
+            self._acquire_global(share, count)
+
+    def _acquire_job(self, share: JobShare, count: int) -> None:
+        with share._lock:
+            if share.bucket.rate is None:
+                return
+            share.bucket.refill()
+            share.bucket.take(count)
+            delay = share.bucket.wait_time()
+        while delay > 0:
+            share.check_cancelled()
+            time.sleep(min(delay, WAIT_SLICE))
+            delay -= WAIT_SLICE
+
+    def _acquire_global(self, share: JobShare, count: int) -> None:
+        entry = [share.rank, next(self._arrivals), share]
+        with self._condition:
+            heapq.heappush(self._waiting, entry)
+            try:
+                while True:
+                    if self.bucket.rate is None:
+                        return
+                    self.bucket.refill()
+                    if self._waiting[0] is entry and self.bucket.wait_time() == 0:
+                        self.bucket.take(count)
+                        return
+                    timeout = self.bucket.wait_time() if self._waiting[0] is entry else WAIT_SLICE
+                    self._condition.wait(min(timeout, WAIT_SLICE))
+                    share.check_cancelled()
+            finally:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                self._condition.notify_all()
@@ -0,0 +1,47 @@
+import re
+from datetime import date
+from typing import Callable, Iterable, Iterator, Optional
+
+from pytube import Channel, Playlist, YouTube, extract
+
+PLAYLIST_URL_PATTERN = re.compile(r"youtube\.com/playlist\?(.*&)?list=")
+CHANNEL_URL_PATTERN = re.compile(r"youtube\.com/(c|channel|u|user)/")
+
+
+def is_playlist_url(url: str) -> bool:
+    return bool(PLAYLIST_URL_PATTERN.search(url))
+
+
+def is_channel_url(url: str) -> bool:
+    return bool(CHANNEL_URL_PATTERN.search(url))
+
+
+def is_batch_url(url: str) -> bool:
+    return is_playlist_url(url) or is_channel_url(url)
+
+
+def iter_video_urls(url: str) -> Iterator[str]:
+    """Lazily yields the video urls of a playlist or channel, fetching one page of entries at a time."""
+    batch = Channel(url) if is_channel_url(url) else Playlist(url)
+    return batch.url_generator()
+
+
+def filter_video_urls(urls: Iterable[str], max_count: Optional[int] = None, after: Optional[date] = None,
+                      before: Optional[date] = None, skip: Optional[Callable[[str], bool]] = None) -> Iterator[str]:
+    """Lazily filters video urls.
+
+    skip gets the video id and returns whether to leave the video out, e.g. because it is already downloaded.
+    The date range is inclusive, and costs a watch page request per video to get its publish date.
+    """
+    count = 0
+    for url in urls:
+        if max_count is not None and count >= max_count:
+            return
+        if skip and skip(extract.video_id(url)):
+            continue
+        if after or before:
+            published = YouTube(url).publish_date
+            if published is None or (after and published.date() < after) or (before and published.date() > before):
+                continue
+        count += 1
+        yield url
@@ -0,0 +1,41 @@
+"""Compares two benchmark results files written by benchmarks/run.py, metric by metric:
+
+    python -m benchmarks.compare benchmarks/results/old.json benchmarks/results/new.json
+"""
+import argparse
+import json
+import sys
+
+
+def flatten(results: dict, prefix: str = "") -> dict:
+    """Returns the numeric metrics of a results dict as {"benchmark.metric": value}."""
+    metrics = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            metrics.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            metrics[prefix + key] = value
+    return metrics
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare two benchmark results files.")
+    parser.add_argument("old")
+    parser.add_argument("new")
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+    with open(args.old, "r") as infile:
+        old = json.load(infile)
+    with open(args.new, "r") as infile:
+        new = json.load(infile)
+    print(f"{'metric':<60} {old.get('commit') or 'old':>12} {new.get('commit') or 'new':>12} {'change':>8}")
+    old_metrics, new_metrics = flatten(old["benchmarks"]), flatten(new["benchmarks"])
+    for name in sorted(old_metrics.keys() | new_metrics.keys()):
+        old_value, new_value = old_metrics.get(name), new_metrics.get(name)
+        change = f"{(new_value / old_value - 1) * 100:+.1f}%" if old_value and new_value is not None else ""
+        print(f"{name:<60} {'-' if old_value is None else old_value:>12} {'-' if new_value is None else new_value:>12}"
+              f" {change:>8}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
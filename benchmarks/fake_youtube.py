@@ -0,0 +1,229 @@
+import json
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from pytube import request
+
+PLAYER_VERSION = "bench0001"
+PLAYER_JS_PATH = f"/s/player/{PLAYER_VERSION}/player_ias.vflset/en_US/base.js"
+YOUTUBE_URL_PATTERN = re.compile(r"^https://(?:www\.)?youtube\.com")
+WRITE_CHUNK_SIZE = 16 * 1024
+URL_LIFETIME = 6 * 60 * 60  # seconds
+
+# The smallest base.js pytube can parse: a signature transform (reverse, then drop 2 characters) and an n parameter
+# throttling function, found by the same regexes as in the real player.
+PLAYER_JS = ('var Xy={rv:function(a){a.reverse()}, sp:function(a,b){a.splice(0,b)}};\n'
+             'Ab=function(a){a=a.split("");Xy.rv(a,1);Xy.sp(a,2);return a.join("")};\n'
+             'var Bpa=[Nf];\n'
+             'g=function(a){a.C&&(b=a.get("n"))&&(b=Bpa[0](b),a.set("n",b))};\n'
+             'Nf=function(a){var b=a.split(""),c=[function(d){d.reverse()},b,null];try{c[0](c[1])}catch(e){return"x"+a}'
+             'return b.join("")};\n'
+             'h=function(c,d,b){c&&d.set(b,encodeURIComponent(Ab(b)))};\n')
+
+# itag -> (mimeType, fps, share of media_size), one progressive stream per resolution pytube falls back on,
+# and a video-only and audio-only stream to mux
+STREAM_FORMATS = {
+    18: ('video/mp4; codecs="avc1.42001E, mp4a.40.2"', 30, 1 / 4),
+    22: ('video/mp4; codecs="avc1.64001F, mp4a.40.2"', 30, 1 / 2),
+    137: ('video/mp4; codecs="avc1.640028"', 30, 1),
+    140: ('audio/mp4; codecs="mp4a.40.2"', None, 1 / 8),
+}
+ADAPTIVE_ITAGS = (137, 140)
+
+
+class FakeYouTube:
+    """Local stand-in for YouTube and its CDN, serving watch pages, a player base.js, innertube player responses and
+    range-capable media files for any video id.
+
+    Stream urls are signature ciphered and carry an n parameter, so resolving goes through the same decipher code
+    as for the real site. Every new connection is delayed by handshake seconds (standing in for the TCP and TLS
+    setup a real connection pays), every response by latency seconds, media responses are sent at most at
+    throttle bytes/s per connection, and error_rate of the media requests fail, half with a 503 and half by
+    dropping the connection halfway through the body. Requests are counted by kind in requests.
+    """
+
+    def __init__(self, media_size: int = 16 * 1024 * 1024, latency: float = 0.0, throttle: Optional[int] = None,
+                 error_rate: float = 0.0, handshake: float = 0.0, seed: int = 0) -> None:
+        self.media = random.Random(seed).randbytes(media_size)
+        self.latency = latency
+        self.handshake = handshake
+        self.throttle = throttle
+        self.error_rate = error_rate
+        self.requests = {"connections": 0, "watch": 0, "player_js": 0, "innertube": 0, "media": 0, "media_errors": 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def watch_url(self, video_id: str) -> str:
+        """The url of a video as a user would paste it, served by this server once redirect_pytube() is active."""
+        return f"https://www.youtube.com/watch?v={video_id}"
+
+    def start(self) -> "FakeYouTube":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-youtube", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeYouTube":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def _count(self, kind: str) -> None:
+        with self._lock:
+            self.requests[kind] += 1
+
+    def _failure(self) -> Optional[str]:
+        """Picks how a media request fails: None, "status" or "drop"."""
+        with self._lock:
+            if self._random.random() >= self.error_rate:
+                return None
+            return self._random.choice(("status", "drop"))
+
+    def player_response(self, video_id: str) -> dict:
+        expire = int(time.time()) + URL_LIFETIME
+        formats = []
+        for itag, (mime_type, fps, share) in STREAM_FORMATS.items():
+            size = int(len(self.media) * share)
+            url = f"{self.base_url}/videoplayback?" + urlencode({"id": video_id, "itag": itag, "clen": size,
+                                                                  "expire": expire, "n": "abcdefgh"})
+            stream = {"itag": itag, "mimeType": mime_type, "bitrate": size * 8 // 60, "contentLength": str(size),
+                      "signatureCipher": urlencode({"s": f"{video_id}..sig", "sp": "sig", "url": url})}
+            if fps:
+                stream["fps"] = fps
+            formats.append(stream)
+        return {
+            "playabilityStatus": {"status": "OK"},
+            "videoDetails": {"videoId": video_id, "title": f"Benchmark video {video_id}", "lengthSeconds": "60"},
+            "streamingData": {"formats": [stream for stream in formats if stream["itag"] not in ADAPTIVE_ITAGS],
+                              "adaptiveFormats": [stream for stream in formats if stream["itag"] in ADAPTIVE_ITAGS]},
+        }
+
+    def watch_html(self, video_id: str) -> str:
+        player_response = {"playabilityStatus": {"status": "OK"}, "videoDetails": {"videoId": video_id}}
+        return (f'<html><head><script src="{PLAYER_JS_PATH}"></script></head><body><script>'
+                f'var ytInitialPlayerResponse = {json.dumps(player_response)};</script></body></html>')
+
+    def _handler_class(self) -> type:
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True  # as real servers do, else kept-alive connections stall on delayed acks
+
+            def log_message(self, *args) -> None:
+                pass
+
+            def handle(self) -> None:
+                try:
+                    super().handle()
+                except (ConnectionResetError, BrokenPipeError):  # the client gave up on a download
+                    pass
+
+            def setup(self) -> None:
+                super().setup()
+                fake._count("connections")
+                time.sleep(fake.handshake)
+
+            def do_GET(self) -> None:
+                time.sleep(fake.latency)
+                url = urlparse(self.path)
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                if url.path == "/watch":
+                    fake._count("watch")
+                    self.send_body(fake.watch_html(query.get("v", "")).encode(), "text/html")
+                elif url.path == PLAYER_JS_PATH:
+                    fake._count("player_js")
+                    self.send_body(PLAYER_JS.encode(), "text/javascript")
+                elif url.path == "/videoplayback":
+                    self.send_media(int(query.get("clen", len(fake.media))))
+                else:
+                    self.send_error(404)
+
+            def do_POST(self) -> None:
+                time.sleep(fake.latency)
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))  # the innertube client context
+                url = urlparse(self.path)
+                if url.path == "/youtubei/v1/player":
+                    fake._count("innertube")
+                    video_id = parse_qs(url.query).get("videoId", [""])[0]
+                    self.send_body(json.dumps(fake.player_response(video_id)).encode(), "application/json")
+                else:
+                    self.send_error(404)
+
+            def send_body(self, body: bytes, content_type: str) -> None:
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def send_media(self, size: int) -> None:
+                fake._count("media")
+                failure = fake._failure()
+                if failure == "status":
+                    fake._count("media_errors")
+                    self.send_error(503)
+                    return
+                start, end = 0, size - 1
+                match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+                if match:
+                    start, end = int(match[1]), min(int(match[2]) if match[2] else end, end)
+                    self.send_response(206)
+                    self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+                else:
+                    self.send_response(200)
+                self.send_header("Content-Type", "video/mp4")
+                self.send_header("Content-Length", str(end - start + 1))
+                self.end_headers()
+                if failure == "drop":
+                    fake._count("media_errors")
+                    end = start + (end - start) // 2
+                    self.close_connection = True
+                self.send_throttled(fake.media[start:end + 1])
+
+            def send_throttled(self, body: bytes) -> None:
+                started = time.perf_counter()
+                for offset in range(0, len(body), WRITE_CHUNK_SIZE):
+                    if fake.throttle:
+                        delay = offset / fake.throttle - (time.perf_counter() - started)
+                        if delay > 0:
+                            time.sleep(delay)
+                    try:
+                        self.wfile.write(body[offset:offset + WRITE_CHUNK_SIZE])
+                    except (BrokenPipeError, ConnectionResetError):  # the client gave up on the download
+                        self.close_connection = True
+                        return
+
+        return Handler
+
+
+@contextmanager
+def redirect_pytube(base_url: str):
+    """Sends every request pytube makes to youtube.com (watch page, base.js, innertube) to base_url instead."""
+    execute_request = request._execute_request
+
+    def redirected_request(url, *args, **kwargs):
+        return execute_request(YOUTUBE_URL_PATTERN.sub(base_url, url, count=1), *args, **kwargs)
+
+    request._execute_request = redirected_request
+    try:
+        yield
+    finally:
+        request._execute_request = execute_request
@@ -0,0 +1,374 @@
+"""Offline benchmarks of the download pipeline against a local fake YouTube (see fake_youtube.py).
+
+Every benchmark runs in its own process, so its peak RSS is its own. Results are written as JSON to
+benchmarks/results/, compare two runs with benchmarks/compare.py. Run from the repository root:
+
+    python -m benchmarks.run [--only resolve ttfb ...]
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Optional
+
+import engine as engine_module
+from bandwidth import BandwidthScheduler
+import http_pool
+from benchmarks.fake_youtube import FakeYouTube, redirect_pytube
+from config import Config
+from download_queue import DONE, FAILED, Job
+from engine import Engine
+from metadata_cache import video_entry
+from metrics import JobMetrics
+from progress_channel import ProgressChannel
+from resources import MAX_PROGRESSIVE
+from segmented import download_segmented
+from spool import JobSpool
+
+http_pool.install()  # before redirect_pytube(), which wraps the pooled requests
+
+RESULTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+MB = 1024 * 1024
+VIDEO_ITAG = 137
+STARTUP_TARGET_MS = 300
+SPOOL_PROCESS_COUNTS = (1, 2, 4)
+SPOOL_WORKER_THREADS = 2
+REPOSITORY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def video_id(number: int) -> str:
+    return f"bench{number:06d}"
+
+
+def make_engine(workdir: str, on_change: Optional[Callable[[Job], None]] = None, **settings) -> Engine:
+    """Returns an engine whose caches, index and downloads all live in workdir."""
+    engine_module.PLAYER_CACHE_PATH = os.path.join(workdir, "cache", "player")
+    engine_module.METADATA_CACHE_PATH = os.path.join(workdir, "cache", "metadata")
+    engine_module.DOWNLOAD_INDEX_PATH = os.path.join(workdir, "download_index.sqlite3")
+    engine_module.METRICS_LOG_PATH = os.path.join(workdir, "metrics", "jobs.jsonl")
+    engine_module.METRICS_PROMETHEUS_PATH = os.path.join(workdir, "metrics", "ytdl.prom")
+    download_path = os.path.join(workdir, "downloads")
+    os.makedirs(download_path, exist_ok=True)
+    config = Config(os.path.join(workdir, "config.json"))
+    for key, value in settings.items():
+        config.set(key, value)
+    return Engine(config, on_change=on_change, download_path=download_path, skip_downloaded=False)
+
+
+def timed(function: Callable, *args, **kwargs) -> tuple[float, object]:
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def milliseconds(seconds: float) -> float:
+    return round(seconds * 1000, 3)
+
+
+def resolve(engine: Engine, url: str):
+    video = engine.get_video(url)
+    video.streams
+    return video
+
+
+def bench_resolve(workdir: str, args: argparse.Namespace) -> dict:
+    """Time from a url to its stream list: with nothing cached, with the player cached on disk only (as after a
+    restart), with the player cached in memory, and from the metadata cache."""
+    with FakeYouTube(media_size=MB, latency=args.latency, handshake=args.handshake) as fake, \
+            redirect_pytube(fake.base_url):
+        engine = make_engine(workdir)
+        cold, video = timed(resolve, engine, fake.watch_url(video_id(0)))
+        engine.metadata_cache.put(video.video_id, video_entry(video))
+        engine = make_engine(workdir)
+        disk, _ = timed(resolve, engine, fake.watch_url(video_id(1)))
+        warm = [timed(resolve, engine, fake.watch_url(video_id(i)))[0] for i in range(2, 2 + args.repeat)]
+        cached = [timed(resolve, engine, fake.watch_url(video_id(0)))[0] for _ in range(args.repeat)]
+        return {"cold_ms": milliseconds(cold), "player_on_disk_ms": milliseconds(disk),
+                "player_in_memory_ms": milliseconds(statistics.median(warm)),
+                "metadata_cached_ms": milliseconds(statistics.median(cached)), "latency_ms": milliseconds(args.latency),
+                "handshake_ms": milliseconds(args.handshake), "requests": fake.requests}
+
+
+def download_stream(engine: Engine, stream, segment_count: int, on_progress: Optional[Callable] = None,
+                    throttle: Optional[Callable[[int], None]] = None) -> str:
+    file_path = download_segmented(stream, engine.download_path, segment_count=segment_count, on_progress=on_progress,
+                                   video_id="benchmark", throttle=throttle)
+    os.remove(file_path)
+    return file_path
+
+
+def bench_ttfb(workdir: str, args: argparse.Namespace) -> dict:
+    """Time from starting the download of a resolved stream to its first progress callback."""
+    with FakeYouTube(media_size=args.media_size, latency=args.latency, handshake=args.handshake) as fake, \
+            redirect_pytube(fake.base_url):
+        engine = make_engine(workdir)
+        stream = resolve(engine, fake.watch_url(video_id(0))).streams.get_by_itag(VIDEO_ITAG)
+        times = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            first_byte = []
+
+            def on_progress(stream, chunk, bytes_remaining):
+                if not first_byte:
+                    first_byte.append(time.perf_counter() - start)
+
+            download_stream(engine, stream, engine.config.get("segment_count", 4), on_progress)
+            times.append(first_byte[0])
+        return {"ttfb_ms": milliseconds(statistics.median(times)), "ttfb_max_ms": milliseconds(max(times)),
+                "latency_ms": milliseconds(args.latency)}
+
+
+def bench_throughput(workdir: str, args: argparse.Namespace) -> dict:
+    """Sustained download rate in MB/s of one stream, through a per-connection throttle and unthrottled, with
+    one and with several segments, and the CPU time per MB of the unthrottled downloads (the fake server's
+    included). Throttled downloads run once, their time is set by the throttle."""
+    results = {"media_size_mb": round(args.media_size / MB, 3), "throttle_mb_s": round(args.throttle / MB, 3)}
+    for throttle in (args.throttle, None):
+        with FakeYouTube(media_size=args.media_size, throttle=throttle) as fake, redirect_pytube(fake.base_url):
+            engine = make_engine(workdir)
+            stream = resolve(engine, fake.watch_url(video_id(0))).streams.get_by_itag(VIDEO_ITAG)
+            for segment_count in (1, args.segments):
+                repeat = 1 if throttle else args.repeat
+                name = f"{'throttled' if throttle else 'unthrottled'}_{segment_count}_segments"
+                elapsed = cpu_time = float("inf")
+                for _ in range(repeat):
+                    cpu_start = time.process_time()
+                    elapsed = min(elapsed, timed(download_stream, engine, stream, segment_count)[0])
+                    cpu_time = min(cpu_time, time.process_time() - cpu_start)
+                results[name + "_mb_s"] = round(stream.filesize / elapsed / MB, 3)
+                if not throttle:
+                    results[name + "_cpu_ms_per_mb"] = milliseconds(cpu_time / (stream.filesize / MB))
+    return results
+
+
+def bench_progress_callback(workdir: str, args: argparse.Namespace) -> dict:
+    """Cost of the progress callbacks the GUI gets: per call, and as the CPU time a whole download takes with and
+    without them."""
+    channel = ProgressChannel()
+    with FakeYouTube(media_size=args.media_size) as fake, redirect_pytube(fake.base_url):
+        engine = make_engine(workdir, on_change=lambda job: channel.publish(job.id, job))
+        stream = resolve(engine, fake.watch_url(video_id(0))).streams.get_by_itag(VIDEO_ITAG)
+        job = engine.queue.create(fake.watch_url(video_id(0)), "mp4", MAX_PROGRESSIVE)
+        job.metrics = JobMetrics(job.id, job.url, job.format_type)
+        calls = 100_000
+        chunk = b"\0" * 64 * 1024
+        start = time.perf_counter()
+        for i in range(calls):
+            engine.on_progress(job, stream, chunk, stream.filesize - i % stream.filesize)
+        per_call = (time.perf_counter() - start) / calls
+
+        def cpu_time(on_progress: Optional[Callable]) -> float:
+            start = time.process_time()
+            download_stream(engine, stream, args.segments, on_progress)
+            return time.process_time() - start
+
+        def job_progress(stream, chunk, bytes_remaining):
+            engine.on_progress(job, stream, chunk, bytes_remaining)
+
+        without_callback = min(cpu_time(None) for _ in range(args.repeat))
+        with_callback = min(cpu_time(job_progress) for _ in range(args.repeat))
+        return {"per_call_us": round(per_call * 1e6, 3), "download_cpu_ms": milliseconds(without_callback),
+                "download_with_callbacks_cpu_ms": milliseconds(with_callback),
+                "callback_overhead_percent": round((with_callback / without_callback - 1) * 100, 1)}
+
+
+def bench_bandwidth(workdir: str, args: argparse.Namespace) -> dict:
+    """CPU cost of the bandwidth scheduler on an unthrottled download, with no cap and with a cap far above the
+    transfer rate, and the rate a download gets under a global cap of --throttle."""
+    with FakeYouTube(media_size=args.media_size) as fake, redirect_pytube(fake.base_url):
+        engine = make_engine(workdir)
+        stream = resolve(engine, fake.watch_url(video_id(0))).streams.get_by_itag(VIDEO_ITAG)
+
+        def cpu_time(scheduler: Optional[BandwidthScheduler]) -> float:
+            throttle = None
+            if scheduler:
+                share = scheduler.register(0)
+                throttle = lambda count: scheduler.acquire(share, count)
+            start = time.process_time()
+            download_stream(engine, stream, args.segments, throttle=throttle)
+            return time.process_time() - start
+
+        without_scheduler = min(cpu_time(None) for _ in range(args.repeat))
+        uncapped = min(cpu_time(BandwidthScheduler()) for _ in range(args.repeat))
+        capped = min(cpu_time(BandwidthScheduler(1024 ** 4)) for _ in range(args.repeat))
+        scheduler = BandwidthScheduler(args.throttle)
+        share = scheduler.register(0)
+        elapsed, _ = timed(download_stream, engine, stream, args.segments,
+                           throttle=lambda count: scheduler.acquire(share, count))
+        return {"download_cpu_ms": milliseconds(without_scheduler),
+                "uncapped_overhead_percent": round((uncapped / without_scheduler - 1) * 100, 1),
+                "capped_overhead_percent": round((capped / without_scheduler - 1) * 100, 1),
+                "cap_mb_s": round(args.throttle / MB, 3), "capped_rate_mb_s": round(stream.filesize / elapsed / MB, 3)}
+
+
+def bench_errors(workdir: str, args: argparse.Namespace) -> dict:
+    """Whole jobs, from url to file, through the queue while error_rate of the media requests fail, and how many
+    times they were retried."""
+    finished = {}
+
+    def on_change(job: Job) -> None:
+        if job.state in (DONE, FAILED):
+            finished[job.id] = job.state, job.metrics.retries if job.metrics else 0
+
+    with FakeYouTube(media_size=args.media_size // 4, latency=args.latency, handshake=args.handshake,
+                     error_rate=args.error_rate) as fake, \
+            redirect_pytube(fake.base_url):
+        engine = make_engine(workdir, on_change=on_change)
+        start = time.perf_counter()
+        for i in range(args.jobs):
+            engine.submit(fake.watch_url(video_id(i)), "mp4", MAX_PROGRESSIVE)
+        engine.join()
+        elapsed = time.perf_counter() - start
+        done = [state for state, _ in finished.values()].count(DONE)
+        return {"jobs": args.jobs, "done": done, "failed": args.jobs - done, "error_rate": args.error_rate,
+                "retries": sum(retries for _, retries in finished.values()), "elapsed_s": round(elapsed, 3),
+                "requests": fake.requests}
+
+
+def bench_spool(workdir: str, args: argparse.Namespace) -> dict:
+    """Whole jobs through a job spool (see spool.py) with 1, 2 and 4 worker processes of 2 download workers each:
+    jobs per second, and how close each count of processes gets to scaling linearly."""
+    results = {"jobs": args.jobs, "threads_per_process": SPOOL_WORKER_THREADS}
+    with FakeYouTube(media_size=args.media_size // 4, latency=args.latency, handshake=args.handshake,
+                     throttle=args.throttle) as fake:
+        for process_count in SPOOL_PROCESS_COUNTS:
+            spool_path = os.path.join(workdir, f"spool-{process_count}.sqlite3")
+            spool = JobSpool(spool_path)
+            for i in range(args.jobs):
+                spool.submit(fake.watch_url(video_id(process_count * args.jobs + i)), "mp4", MAX_PROGRESSIVE)
+            start = time.perf_counter()
+            children = [subprocess.Popen([sys.executable, "-m", "benchmarks.spool_worker", fake.base_url, spool_path,
+                                          os.path.join(workdir, f"worker-{process_count}-{i}"),
+                                          str(SPOOL_WORKER_THREADS)], cwd=REPOSITORY_PATH)
+                        for i in range(process_count)]
+            for child in children:
+                child.wait()
+            elapsed = time.perf_counter() - start
+            results[f"processes_{process_count}"] = {"elapsed_s": round(elapsed, 3),
+                                                     "jobs_per_s": round(args.jobs / elapsed, 3),
+                                                     "done": spool.counts().get(DONE, 0)}
+            spool.close()
+    single = results[f"processes_{SPOOL_PROCESS_COUNTS[0]}"]["jobs_per_s"]
+    for process_count in SPOOL_PROCESS_COUNTS[1:]:
+        run = results[f"processes_{process_count}"]
+        run["scaling_efficiency"] = round(run["jobs_per_s"] / (single * process_count), 3)
+    return results
+
+
+def bench_startup(workdir: str, args: argparse.Namespace) -> dict:
+    """Cold start of the GUI in a new interpreter: milliseconds from starting the process to the first paint of the
+    window, and to the download engine being ready, see startup.py. Needs a display."""
+    with open(os.path.join(workdir, "config.json"), "w") as outfile:
+        json.dump({"download_path": workdir}, outfile)
+    runs = []
+    for _ in range(args.repeat):
+        spawn_time = time.time()
+        child = subprocess.run([sys.executable, "-m", "benchmarks.startup", str(spawn_time), workdir],
+                               capture_output=True, text=True, cwd=REPOSITORY_PATH)
+        if child.returncode != 0:
+            return {"skipped": child.stderr.strip().splitlines()[-1:]}  # e.g. no display
+        runs.append(json.loads(child.stdout))
+    results = {"target_first_paint_ms": STARTUP_TARGET_MS}
+    for name in ("first_paint_ms", "engine_ready_ms"):
+        results[name] = min(run[name] for run in runs)
+        results[name.replace("_ms", "_median_ms")] = round(statistics.median(run[name] for run in runs), 3)
+    return results
+
+
+BENCHMARKS = {
+    "resolve": bench_resolve,
+    "ttfb": bench_ttfb,
+    "throughput": bench_throughput,
+    "progress_callback": bench_progress_callback,
+    "bandwidth": bench_bandwidth,
+    "errors": bench_errors,
+    "spool": bench_spool,
+    "startup": bench_startup,
+}
+
+
+def peak_rss() -> Optional[int]:
+    """Peak resident set size of this process in bytes, None where the resource module doesn't exist (Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss * 1024  # bytes on macOS, kilobytes elsewhere
+
+
+def run_benchmark(name: str, args: argparse.Namespace) -> dict:
+    with tempfile.TemporaryDirectory(prefix=f"benchmark-{name}-") as workdir:
+        result = BENCHMARKS[name](workdir, args)
+    result["connection_pool"] = http_pool.POOL.stats()
+    result["peak_rss_mb"] = round(peak_rss() / MB, 3) if peak_rss() else None
+    return result
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run the offline download benchmarks.")
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, help="benchmarks to run (default: all)")
+    parser.add_argument("-o", "--output", help="results file (default: benchmarks/results/<time>.json)")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per measurement (default: 5)")
+    parser.add_argument("--media-size", type=float, default=16, help="video stream size in MB (default: 16)")
+    parser.add_argument("--latency", type=float, default=0.02, help="server response delay in seconds (default: 0.02)")
+    parser.add_argument("--handshake", type=float, default=0.03,
+                        help="delay of every new connection in seconds, for TCP/TLS setup (default: 0.03)")
+    parser.add_argument("--throttle", type=float, default=4,
+                        help="per-connection server limit, and the bandwidth benchmark's cap, in MB/s (default: 4)")
+    parser.add_argument("--segments", type=int, default=4, help="segments for segmented downloads (default: 4)")
+    parser.add_argument("--error-rate", type=float, default=0.1,
+                        help="share of failing media requests in the errors benchmark (default: 0.1)")
+    parser.add_argument("--jobs", type=int, default=20, help="jobs in the errors and spool benchmarks (default: 20)")
+    parser.add_argument("--child", help=argparse.SUPPRESS)  # runs one benchmark and prints its result
+    args = parser.parse_args(argv)
+    args.media_size = int(args.media_size * MB)
+    args.throttle = int(args.throttle * MB)
+    return args
+
+
+def main(argv: list[str] = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    args = parse_args(argv)
+    if args.child:
+        print(json.dumps(run_benchmark(args.child, args)))
+        return 0
+
+    results = {"time": datetime.now().isoformat(timespec="seconds"), "commit": git_commit(),
+               "python": platform.python_version(), "platform": platform.platform(), "arguments": argv,
+               "benchmarks": {}}
+    for name in args.only or BENCHMARKS:
+        print(f"Running {name}...", file=sys.stderr)
+        child = subprocess.run([sys.executable, "-m", "benchmarks.run", *argv, "--child", name],
+                               capture_output=True, text=True)
+        if child.returncode != 0:
+            print(child.stderr, file=sys.stderr)
+            results["benchmarks"][name] = {"error": child.stderr.strip().splitlines()[-1:]}
+            continue
+        results["benchmarks"][name] = json.loads(child.stdout)
+        print(json.dumps(results["benchmarks"][name], indent=3), file=sys.stderr)
+
+    output = args.output or os.path.join(RESULTS_PATH, datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as outfile:
+        json.dump(results, outfile, indent=3)
+    print(f"Results written to {output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,24 @@
+"""One worker process of the spool benchmark in benchmarks/run.py, against the fake YouTube of the benchmark:
+
+    python -m benchmarks.spool_worker BASE_URL SPOOL WORKDIR THREADS
+
+Runs the jobs of SPOOL on THREADS workers until none are left, with its caches and downloads in WORKDIR.
+"""
+import sys
+
+from benchmarks.fake_youtube import redirect_pytube
+from benchmarks.run import make_engine
+from spool import JobSpool, SpoolWorker
+
+
+def main(argv: list[str]) -> int:
+    base_url, spool_path, workdir, threads = argv[0], argv[1], argv[2], int(argv[3])
+    spool = JobSpool(spool_path)
+    worker = SpoolWorker(spool)
+    with redirect_pytube(base_url):
+        worker.run(make_engine(workdir, on_change=worker, worker_count=threads), until_idle=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
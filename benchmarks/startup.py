@@ -0,0 +1,33 @@
+"""One cold start of the GUI, run by the startup benchmark in benchmarks/run.py in a new interpreter each time:
+
+    python -m benchmarks.startup SPAWN_TIME WORKDIR
+
+SPAWN_TIME is the time.time() at which the benchmark started this process. Prints the milliseconds from then to
+the window's first paint, and to the download engine being ready, as JSON.
+"""
+import json
+import os
+import sys
+import time
+
+
+def main(argv: list[str]) -> int:
+    spawn_time, workdir = float(argv[0]), argv[1]
+    import resources
+    resources.CONFIG_JSON_PATH = os.path.join(workdir, "config.json")  # has a download_path, so no folder dialog
+    import main as gui  # builds the window, and paints it before returning
+    first_paint = time.time() - spawn_time
+    import engine as engine_module
+    for name in ("PLAYER_CACHE_PATH", "METADATA_CACHE_PATH", "DOWNLOAD_INDEX_PATH", "METRICS_LOG_PATH",
+                 "METRICS_PROMETHEUS_PATH"):
+        setattr(engine_module, name, os.path.join(workdir, name.lower()))
+    gui.get_engine()
+    engine_ready = time.time() - spawn_time
+    gui.root.destroy()
+    print(json.dumps({"first_paint_ms": round(first_paint * 1000, 3),
+                      "engine_ready_ms": round(engine_ready * 1000, 3)}))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
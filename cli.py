@@ -0,0 +1,147 @@
+import argparse
+import sys
+from datetime import date
+
+from bandwidth import NORMAL, PRIORITIES, parse_rate
+from config import Config
+from download_queue import Job, FAILED, FINISHED_STATES
+from resources import CONFIG_JSON_PATH, FORMATS, RESOLUTIONS
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Download YouTube videos as mp4/mp3 without the GUI.")
+    parser.add_argument("urls", nargs="*", help="video, playlist or channel urls to download")
+    parser.add_argument("-i", "--input", help="file with one url per line to download, '-' for stdin")
+    parser.add_argument("-f", "--format", choices=FORMATS, default="mp4", help="download format (default: mp4)")
+    parser.add_argument("-r", "--resolution", default=RESOLUTIONS[0],
+                        help=f"mp4 resolution, e.g. 720p, or a stream profile from the config "
+                             f"(default: {RESOLUTIONS[0]})")
+    parser.add_argument("-o", "--output", help="download folder (default: download_path in the config)")
+    parser.add_argument("-j", "--jobs", type=int, help="number of concurrent downloads (default: worker_count)")
+    parser.add_argument("--limit-rate", type=parse_rate,
+                        help="total download speed limit, e.g. 500K or 2M (default: max_download_rate in the config)")
+    parser.add_argument("--priority", choices=PRIORITIES, default=NORMAL,
+                        help="priority of the downloads, for their share of a speed limit (default: normal)")
+    parser.add_argument("--max-count", type=int, help="download at most this many videos per playlist/channel")
+    parser.add_argument("--after", type=date.fromisoformat,
+                        help="only playlist/channel videos published on or after this date (YYYY-MM-DD)")
+    parser.add_argument("--before", type=date.fromisoformat,
+                        help="only playlist/channel videos published on or before this date (YYYY-MM-DD)")
+    parser.add_argument("--no-skip-downloaded", dest="skip_downloaded", action="store_false",
+                        help="download videos again even if they were downloaded before")
+    parser.add_argument("--rescan", action="store_true",
+                        help="update the download index with the files in the download folder, then download any urls")
+    parser.add_argument("--daemon", action="store_true",
+                        help="queue the urls on the running daemon (see daemon.py) and exit, instead of downloading "
+                             "them here")
+    parser.add_argument("--spool", help="queue the urls on this job spool (see spool.py) and exit, instead of "
+                                        "downloading them here")
+    return parser.parse_args(argv)
+
+
+def read_urls(args: argparse.Namespace) -> list[str]:
+    urls = list(args.urls)
+    if args.input:
+        infile = sys.stdin if args.input == "-" else open(args.input, "r")
+        with infile:
+            urls.extend(line.strip() for line in infile if line.strip() and not line.startswith("#"))
+    return urls
+
+
+class JobPrinter:
+    """Prints job state changes, skipping the per-chunk progress updates, and counts the failed jobs.
+    Finished jobs are forgotten, so long playlists don't keep every job in memory."""
+
+    def __init__(self) -> None:
+        self.engine = None
+        self.failed = 0
+        self._printed_states = {}  # job id -> last printed state
+
+    def __call__(self, job: Job) -> None:
+        if job.state in FINISHED_STATES:
+            self._printed_states.pop(job.id, None)
+            self.failed += job.state == FAILED
+            if self.engine:
+                self.engine.queue.forget(job.id)
+        elif self._printed_states.get(job.id) == job.state:
+            return
+        else:
+            self._printed_states[job.id] = job.state
+        print(f"[{job.id}] {job.state}: {job.message}", file=sys.stderr)
+
+
+def submit_to_daemon(args: argparse.Namespace, urls: list[str], config: Config) -> int:
+    """Queues the urls on the running daemon, printing the id of each job, and sets its speed limit if given."""
+    from daemon import find_daemon, DaemonError, DEFAULT_DAEMON_PORT
+    if args.output or args.jobs or args.rescan:
+        print("--output, --jobs and --rescan can't be used with --daemon", file=sys.stderr)
+        return 2
+    client = find_daemon(config.get("daemon_port", DEFAULT_DAEMON_PORT))
+    if client is None:
+        print("No daemon running, start one with: python daemon.py", file=sys.stderr)
+        return 2
+    try:
+        if args.limit_rate:
+            client.set_total_rate(args.limit_rate)
+        resolution = args.resolution if args.format == "mp4" else ""
+        for url in urls:
+            job = client.submit(url, args.format, resolution, args.priority, max_count=args.max_count,
+                                after=args.after, before=args.before, skip_downloaded=args.skip_downloaded)
+            print(f"[{job['id']}] {job['state']}: {job['url']}")
+    except DaemonError as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+
+def submit_to_spool(args: argparse.Namespace, urls: list[str]) -> int:
+    """Queues the urls on a job spool for its workers, printing the id of each job."""
+    from spool import JobSpool
+    if args.output or args.jobs or args.rescan or args.limit_rate:
+        print("--output, --jobs, --rescan and --limit-rate are set per worker, not with --spool", file=sys.stderr)
+        return 2
+    spool = JobSpool(args.spool)
+    resolution = args.resolution if args.format == "mp4" else ""
+    for url in urls:
+        job_id = spool.submit(url, args.format, resolution, args.priority, max_count=args.max_count,
+                              after=args.after and args.after.isoformat(),
+                              before=args.before and args.before.isoformat(), skip_downloaded=args.skip_downloaded)
+        print(f"[{job_id}] queued: {url}")
+    spool.close()
+    return 0
+
+
+def main(argv: list[str] = None) -> int:
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    urls = read_urls(args)
+    if not (urls or args.rescan):
+        print("No urls given", file=sys.stderr)
+        return 2
+    config = Config(CONFIG_JSON_PATH)
+    if args.daemon:
+        return submit_to_daemon(args, urls, config)
+    if args.spool:
+        return submit_to_spool(args, urls)
+    if not (args.output or config.get("download_path")):
+        print("No download folder, use --output or set one in the GUI", file=sys.stderr)
+        return 2
+    from engine import Engine  # not needed to queue on a daemon
+    printer = JobPrinter()
+    engine = Engine(config, on_change=printer, download_path=args.output, worker_count=args.jobs,
+                    skip_downloaded=args.skip_downloaded)
+    printer.engine = engine
+    if args.limit_rate:
+        engine.bandwidth.set_rate(args.limit_rate)
+    if args.rescan:
+        counts = engine.rescan()
+        print(", ".join(f"{count} {outcome}" for outcome, count in counts.items()), file=sys.stderr)
+    resolution = args.resolution if args.format == "mp4" else ""
+    for url in urls:
+        engine.submit(url, args.format, resolution, args.priority, max_count=args.max_count, after=args.after,
+                      before=args.before, skip_downloaded=args.skip_downloaded)
+    engine.join()
+    return 1 if printer.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
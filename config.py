@@ -0,0 +1,57 @@
+import json
+import os
+import threading
+from typing import Any
+
+DEFAULT_FLUSH_DELAY = 1.0  # seconds
+
+
+class Config:
+    """Settings from a .json file, loaded once and served from memory.
+
+    Changes are written behind: set() only updates memory and schedules a flush, which batches every change made
+    within flush_delay seconds into one write. Flushing writes a temporary file and renames it over the config file,
+    so a crash never leaves a truncated config behind.
+    """
+
+    def __init__(self, path: str, flush_delay: float = DEFAULT_FLUSH_DELAY) -> None:
+        self.path = path
+        self.flush_delay = flush_delay
+        self._lock = threading.Lock()
+        self._timer = None
+        self._dirty = False
+        try:
+            with open(path, "r") as infile:
+                self._data = json.load(infile)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self._data = {}
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self._data.get(key, default)
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            if self._data.get(key) == value:
+                return
+            self._data[key] = value
+            self._dirty = True
+            if self._timer is None:
+                self._timer = threading.Timer(self.flush_delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self) -> None:
+        """Writes pending changes to disk atomically."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._dirty:
+                return
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "w") as outfile:
+                json.dump(self._data, outfile, indent=3)
+                outfile.flush()
+                os.fsync(outfile.fileno())
+            os.replace(temp_path, self.path)
+            self._dirty = False
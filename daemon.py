@@ -0,0 +1,357 @@
+"""Background service that owns one download engine, and its worker pool, caches and download index, for any number
+of clients on this machine, through a JSON API over HTTP on localhost:
+
+    python daemon.py [--port 8765]
+
+    GET  /health                       {"pid": ...}
+    GET  /jobs                         every tracked job, see Job.to_dict()
+    GET  /jobs/<id>                    one job
+    POST /jobs                         {"url", "format", "resolution", "priority", "max_count", "after", "before",
+                                        "skip_downloaded"}, only url is required, returns the new job
+    POST /jobs/<id>/cancel|pause|resume
+    POST /jobs/<id>/priority           {"priority": "high"}
+    POST /jobs/<id>/rate_limit         {"rate": "2M"}, null for no limit
+    POST /rate_limit                   {"rate": "2M"}, the limit of all downloads together
+    POST /prefetch                     {"url": ...}, see Engine.prefetch()
+    POST /download_path                {"path": ...}
+    GET  /partial_downloads            interrupted downloads that can be resumed
+    GET  /stats                        connection pool stats
+    GET  /events                       a stream of JSON lines: {"type": "job", "job": ...} for every job change
+                                       (the latest per job, at most EVENT_FPS times a second, starting with every
+                                       tracked job), and {"type": "prefetch", "url": ..., "result": ...}
+
+POST bodies must be sent as application/json, which a web page can't do cross-origin without a preflight request,
+so the API can't be driven from a browser. DaemonClient is the client side, used by the GUI and cli.py --daemon.
+"""
+import argparse
+import collections
+import json
+import os
+import re
+import sys
+import threading
+import time
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Iterator, Optional
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+from bandwidth import NORMAL, parse_rate
+from download_queue import FINISHED_STATES
+from progress_channel import ProgressChannel
+from resources import CONFIG_JSON_PATH, RESOLUTIONS
+
+DAEMON_HOST = "127.0.0.1"
+DEFAULT_DAEMON_PORT = 8765
+EVENT_FPS = 15  # how often per second event streams send the changes since the last send
+EVENT_KEEPALIVE = 10  # seconds, an idle event stream sends an empty line this often, to notice closed clients
+FINISHED_JOBS_KEPT = 1000  # finished jobs the daemon keeps listing before forgetting the oldest
+CONNECT_TIMEOUT = 0.5  # seconds, for finding out whether a daemon is running
+REQUEST_TIMEOUT = 5  # seconds, for any other request
+JOB_PATH = re.compile(r"^/jobs/(\d+)(?:/(cancel|pause|resume|priority|rate_limit))?$")
+
+
+class DaemonError(Exception):
+    """Raised by DaemonClient when the daemon answers with an error."""
+
+
+class DaemonUnavailable(DaemonError):
+    """Raised by DaemonClient when the daemon can't be reached, e.g. because it has stopped."""
+
+
+class Daemon:
+    """Runs an engine for the API server: passes its job changes and prefetch results to every event stream, and
+    forgets the oldest finished jobs once more than FINISHED_JOBS_KEPT have finished."""
+
+    def __init__(self, config, worker_count: Optional[int] = None) -> None:
+        from engine import Engine
+        self._lock = threading.Lock()
+        self._subscribers = []  # ProgressChannel per event stream
+        self._finished = collections.deque()  # ids of the finished jobs, oldest first
+        self.engine = Engine(config, on_change=self._on_job_change, worker_count=worker_count,
+                             on_prefetch=self._on_prefetch)
+
+    def subscribe(self) -> ProgressChannel:
+        channel = ProgressChannel()
+        with self._lock:
+            self._subscribers.append(channel)
+        for job in self.engine.queue.jobs:
+            channel.publish(("job", job.id), {"type": "job", "job": job.to_dict()})
+        return channel
+
+    def unsubscribe(self, channel: ProgressChannel) -> None:
+        with self._lock:
+            self._subscribers.remove(channel)
+
+    def _publish(self, key: tuple, event_source: Callable[[], dict]) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers)
+        if subscribers:
+            event = event_source()
+            for channel in subscribers:
+                channel.publish(key, event)
+
+    def _on_job_change(self, job) -> None:
+        self._publish(("job", job.id), lambda: {"type": "job", "job": job.to_dict()})
+        if job.state in FINISHED_STATES and job.id not in self._finished:
+            with self._lock:
+                self._finished.append(job.id)
+                forget = self._finished.popleft() if len(self._finished) > FINISHED_JOBS_KEPT else None
+            if forget is not None:
+                self.engine.queue.forget(forget)
+
+    def _on_prefetch(self, url: str, result: dict) -> None:
+        self._publish(("prefetch", url), lambda: {"type": "prefetch", "url": url, "result": result})
+
+
+class DaemonRequestHandler(BaseHTTPRequestHandler):
+    server: "DaemonServer"
+
+    def log_message(self, format: str, *args) -> None:
+        pass  # no line per request, the event streams alone would flood the console
+
+    def do_GET(self) -> None:
+        if not self._check_host():
+            return
+        engine = self.server.daemon.engine
+        if self.path == "/health":
+            self._send_json({"pid": os.getpid()})
+        elif self.path == "/jobs":
+            self._send_json(engine.list_jobs())
+        elif self.path == "/partial_downloads":
+            self._send_json(engine.partial_downloads())
+        elif self.path == "/stats":
+            self._send_json(engine.connection_stats())
+        elif self.path == "/events":
+            self._stream_events()
+        elif (match := JOB_PATH.match(self.path)) and not match[2]:
+            job = engine.queue.get(int(match[1]))
+            self._send_json(job.to_dict()) if job else self._send_error(404, "No such job")
+        else:
+            self._send_error(404, "Not found")
+
+    def do_POST(self) -> None:
+        if not self._check_host():
+            return
+        if self.headers.get_content_type() != "application/json":
+            self._send_error(415, "Send the request body as application/json")
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+            self._post(body)
+        except (ValueError, TypeError, KeyError) as e:
+            self._send_error(400, f"Invalid request, {e}")
+
+    def _post(self, body: dict) -> None:
+        engine = self.server.daemon.engine
+        if self.path == "/jobs":
+            for key in ("after", "before"):
+                if body.get(key):
+                    body[key] = date.fromisoformat(body[key])
+            job = engine.submit(body["url"], body.get("format", "mp4"), body.get("resolution", RESOLUTIONS[0]),
+                                body.get("priority", NORMAL), max_count=body.get("max_count"),
+                                after=body.get("after"), before=body.get("before"),
+                                skip_downloaded=body.get("skip_downloaded"))
+            self._send_json(job.to_dict(), 201)
+        elif self.path == "/rate_limit":
+            engine.set_total_rate(parse_rate(body.get("rate")))
+            self._send_json({"rate": engine.bandwidth.rate})
+        elif self.path == "/prefetch":
+            engine.prefetch(body.get("url"))
+            self._send_json({})
+        elif self.path == "/download_path":
+            engine.set_download_path(body["path"])
+            self._send_json({"path": engine.download_path})
+        elif (match := JOB_PATH.match(self.path)) and match[2]:
+            job_id, action = int(match[1]), match[2]
+            if engine.queue.get(job_id) is None:
+                self._send_error(404, "No such job")
+                return
+            if action == "priority":
+                engine.set_priority(job_id, body["priority"])
+            elif action == "rate_limit":
+                engine.set_rate_limit(job_id, parse_rate(body.get("rate")))
+            else:
+                getattr(engine, action)(job_id)
+            self._send_json(engine.queue.get(job_id).to_dict())
+        else:
+            self._send_error(404, "Not found")
+
+    def _stream_events(self) -> None:
+        """Sends job changes and prefetch results as JSON lines until the client disconnects."""
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        channel = self.server.daemon.subscribe()
+        last_send = time.monotonic()
+        try:
+            while not self.server.stopping.is_set():
+                events = channel.drain().values()
+                if events or time.monotonic() - last_send >= EVENT_KEEPALIVE:
+                    self.wfile.write(b"".join(json.dumps(event).encode() + b"\n" for event in events) or b"\n")
+                    self.wfile.flush()
+                    last_send = time.monotonic()
+                time.sleep(1 / EVENT_FPS)
+        except (ConnectionResetError, BrokenPipeError, ConnectionAbortedError):
+            pass
+        finally:
+            self.server.daemon.unsubscribe(channel)
+
+    def _check_host(self) -> bool:
+        """Refuses requests for any other host name, so a web page can't reach the API through DNS rebinding."""
+        host = (self.headers.get("Host") or "").rsplit(":", 1)[0]
+        if host not in ("localhost", "127.0.0.1", "[::1]"):
+            self._send_error(403, "Forbidden")
+            return False
+        return True
+
+    def _send_json(self, data, status: int = 200) -> None:
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status: int, message: str) -> None:
+        self._send_json({"error": message}, status)
+
+
+class DaemonServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, daemon: Daemon, port: int = DEFAULT_DAEMON_PORT) -> None:
+        super().__init__((DAEMON_HOST, port), DaemonRequestHandler)
+        self.daemon = daemon
+        self.stopping = threading.Event()
+
+    def shutdown(self) -> None:
+        self.stopping.set()
+        super().shutdown()
+
+
+class DaemonClient:
+    """Client of a running daemon, with the same job methods as Engine. on_event, if given, gets every event of the
+    daemon's event stream (see /events) on a background thread."""
+
+    def __init__(self, port: int = DEFAULT_DAEMON_PORT,
+                 on_event: Optional[Callable[[dict], None]] = None) -> None:
+        self.base_url = f"http://{DAEMON_HOST}:{port}"
+        if on_event:
+            threading.Thread(target=self._follow_events, args=(on_event,), name="daemon-events", daemon=True).start()
+
+    def _request(self, method: str, path: str, body: Optional[dict] = None, timeout: float = REQUEST_TIMEOUT):
+        data = json.dumps(body).encode() if body is not None else None
+        request = Request(self.base_url + path, data=data, method=method,
+                          headers={"Content-Type": "application/json"} if data is not None else {})
+        try:
+            with urlopen(request, timeout=timeout) as response:  # nosec, only ever localhost
+                return json.load(response)
+        except HTTPError as e:
+            raise DaemonError(json.load(e).get("error", e.reason)) from e
+        except OSError as e:  # URLError, or the connection dropped or timed out while reading the answer
+            raise DaemonUnavailable(f"Daemon not reachable, {getattr(e, 'reason', e)}") from e
+
+    def health(self, timeout: float = REQUEST_TIMEOUT) -> dict:
+        return self._request("GET", "/health", timeout=timeout)
+
+    def submit(self, url: str, format_type: str, resolution: str, priority: str = NORMAL,
+               **batch_filters) -> dict:
+        for key in ("after", "before"):
+            if batch_filters.get(key):
+                batch_filters[key] = batch_filters[key].isoformat()
+        return self._request("POST", "/jobs", {"url": url, "format": format_type, "resolution": resolution,
+                                               "priority": priority, **batch_filters})
+
+    def list_jobs(self) -> list[dict]:
+        return self._request("GET", "/jobs")
+
+    def get_job(self, job_id: int) -> dict:
+        return self._request("GET", f"/jobs/{job_id}")
+
+    def cancel(self, job_id: int) -> None:
+        self._request("POST", f"/jobs/{job_id}/cancel", {})
+
+    def pause(self, job_id: int) -> None:
+        self._request("POST", f"/jobs/{job_id}/pause", {})
+
+    def resume(self, job_id: int) -> None:
+        self._request("POST", f"/jobs/{job_id}/resume", {})
+
+    def set_priority(self, job_id: int, priority: str) -> None:
+        self._request("POST", f"/jobs/{job_id}/priority", {"priority": priority})
+
+    def set_rate_limit(self, job_id: int, rate: Optional[int]) -> None:
+        self._request("POST", f"/jobs/{job_id}/rate_limit", {"rate": rate})
+
+    def set_total_rate(self, rate: Optional[int]) -> None:
+        self._request("POST", "/rate_limit", {"rate": rate})
+
+    def set_download_path(self, path: str) -> None:
+        self._request("POST", "/download_path", {"path": path})
+
+    def prefetch(self, url: Optional[str]) -> None:
+        self._request("POST", "/prefetch", {"url": url})
+
+    def partial_downloads(self) -> list[dict]:
+        return self._request("GET", "/partial_downloads")
+
+    def connection_stats(self) -> dict:
+        return self._request("GET", "/stats")
+
+    def events(self) -> Iterator[dict]:
+        """Yields the events of the daemon's event stream until it closes."""
+        with urlopen(self.base_url + "/events") as response:  # nosec, only ever localhost
+            for line in response:
+                if line.strip():
+                    yield json.loads(line)
+
+    def _follow_events(self, on_event: Callable[[dict], None]) -> None:
+        try:
+            for event in self.events():
+                on_event(event)
+        except (URLError, OSError):
+            pass  # the daemon stopped
+
+
+def find_daemon(port: int = DEFAULT_DAEMON_PORT, on_event: Optional[Callable[[dict], None]] = None,
+                ) -> Optional[DaemonClient]:
+    """Returns a client of the daemon running on port, or None if there is none."""
+    client = DaemonClient(port)
+    try:
+        client.health(timeout=CONNECT_TIMEOUT)
+    except DaemonError:
+        return None
+    return DaemonClient(port, on_event) if on_event else client
+
+
+def main(argv: list[str] = None) -> int:
+    from config import Config
+    parser = argparse.ArgumentParser(description="Run the download engine as a background service for the GUI and "
+                                                 "scripts, with a JSON API on localhost.")
+    parser.add_argument("--port", type=int, help=f"port to listen on (default: daemon_port in the config, or "
+                                                  f"{DEFAULT_DAEMON_PORT})")
+    parser.add_argument("-j", "--jobs", type=int, help="number of concurrent downloads (default: worker_count)")
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+    config = Config(CONFIG_JSON_PATH)
+    port = args.port or config.get("daemon_port", DEFAULT_DAEMON_PORT)
+    if not config.get("download_path"):
+        print("No download folder, set download_path in the config or in the GUI", file=sys.stderr)
+        return 2
+    server = DaemonServer(Daemon(config, args.jobs), port)
+    print(f"Listening on http://{DAEMON_HOST}:{port}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stopping.set()
+        server.server_close()
+        config.flush()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class DownloadIndex:
+    """SQLite index of completed downloads, keyed by video id, format and requested quality (the resolution or stream
+    profile asked for, empty for mp3), with the output path, size, mtime and sha256 checksum of every downloaded file.
+
+    Only the index knows which video a file is, so rescan() can follow files it has recorded but can't add files
+    downloaded before the index was lost.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            columns = [row[1] for row in self._connection.execute("PRAGMA table_info(downloads)")]
+            if columns and "quality" not in columns:
+                # indexed before the quality was part of the key, kept as mp3 downloads or mp4 of no known quality
+                self._connection.execute("ALTER TABLE downloads RENAME TO downloads_unkeyed")
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS downloads (
+                    video_id TEXT NOT NULL,
+                    format TEXT NOT NULL,
+                    quality TEXT NOT NULL,
+                    itag INTEGER,
+                    path TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime REAL NOT NULL,
+                    checksum TEXT NOT NULL,
+                    completed_at REAL NOT NULL,
+                    PRIMARY KEY (video_id, format, quality)
+                )""")
+            if columns and "quality" not in columns:
+                self._connection.execute("INSERT INTO downloads SELECT video_id, format, '', itag, path, size, mtime, "
+                                         "checksum, completed_at FROM downloads_unkeyed")
+                self._connection.execute("DROP TABLE downloads_unkeyed")
+
+    def get(self, video_id: str, format_type: str, quality: str) -> Optional[dict]:
+        with self._lock:
+            row = self._connection.execute("SELECT path, itag, size, mtime, checksum, completed_at FROM downloads "
+                                           "WHERE video_id = ? AND format = ? AND quality = ?",
+                                           (video_id, format_type, quality)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("path", "itag", "size", "mtime", "checksum", "completed_at"), row))
+
+    def __contains__(self, item: tuple[str, str, str]) -> bool:
+        """Whether a (video id, format, quality) was downloaded and its file is still there."""
+        entry = self.get(*item)
+        return entry is not None and os.path.isfile(entry["path"])
+
+    def add(self, video_id: str, format_type: str, quality: str, path: str, itag: Optional[int] = None) -> None:
+        """Records a completed download, hashing its file."""
+        stat = os.stat(path)
+        checksum = file_checksum(path)
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO downloads VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                     (video_id, format_type, quality, itag, os.path.abspath(path), stat.st_size,
+                                      stat.st_mtime, checksum, time.time()))
+
+    def rescan(self, folder: str) -> dict:
+        """Brings the index up to date with the files in a download folder.
+
+        Files whose size and mtime haven't changed are trusted without hashing. Changed files are hashed again.
+        Indexed files that are gone are looked for among the unindexed files of the same size in folder (to follow
+        renames and moves) by checksum, and dropped from the index if not found. Returns counts of each outcome.
+        """
+        counts = {"unchanged": 0, "updated": 0, "moved": 0, "removed": 0}
+        with self._lock:
+            rows = self._connection.execute("SELECT video_id, format, quality, path, size, mtime, checksum "
+                                            "FROM downloads").fetchall()
+        indexed_paths = {os.path.normcase(row[3]) for row in rows}
+        unindexed_by_size = {}
+        for entry in os.scandir(folder):
+            if entry.is_file() and os.path.normcase(entry.path) not in indexed_paths:
+                unindexed_by_size.setdefault(entry.stat().st_size, []).append(entry.path)
+
+        updates, removals = [], []
+        for video_id, format_type, quality, path, size, mtime, checksum in rows:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                moved_path = self._find_moved(unindexed_by_size.get(size, []), checksum)
+                if moved_path is None:
+                    removals.append((video_id, format_type, quality))
+                    counts["removed"] += 1
+                else:
+                    unindexed_by_size[size].remove(moved_path)
+                    updates.append((os.path.abspath(moved_path), size, os.stat(moved_path).st_mtime, checksum,
+                                    video_id, format_type, quality))
+                    counts["moved"] += 1
+                continue
+            if stat.st_size == size and stat.st_mtime == mtime:
+                counts["unchanged"] += 1
+                continue
+            updates.append((path, stat.st_size, stat.st_mtime, file_checksum(path), video_id, format_type, quality))
+            counts["updated"] += 1
+
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "UPDATE downloads SET path = ?, size = ?, mtime = ?, checksum = ? "
+                "WHERE video_id = ? AND format = ? AND quality = ?", updates)
+            self._connection.executemany("DELETE FROM downloads WHERE video_id = ? AND format = ? AND quality = ?",
+                                         removals)
+        return counts
+
+    @staticmethod
+    def _find_moved(candidates: list[str], checksum: str) -> Optional[str]:
+        for candidate in candidates:
+            if file_checksum(candidate) == checksum:
+                return candidate
+        return None
+
+
+def file_checksum(path: str) -> str:
+    """Returns the sha256 hex digest of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as infile:
+        while chunk := infile.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,253 @@
+import itertools
+import queue
+import threading
+from typing import Callable, Optional
+
+from bandwidth import NORMAL, PRIORITIES
+
+QUEUED = "queued"
+RESOLVING = "resolving"
+DOWNLOADING = "downloading"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+PAUSED = "paused"
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+DEFAULT_WORKER_COUNT = 3
+
+
+class JobCancelled(Exception):
+    """Raised inside a worker thread when its job has been cancelled."""
+
+
+class JobPaused(JobCancelled):
+    """Raised inside a worker thread when its job has been paused, it stops like a cancelled job but keeps its
+    partial download for when it's resumed."""
+
+
+class Job:
+    """A single queued download and its current state. skip_downloaded tells whether a video that is already in the
+    download index is skipped."""
+
+    def __init__(self, job_id: int, url: str, format_type: str, resolution: str, priority: str = NORMAL,
+                 skip_downloaded: bool = True) -> None:
+        self.id = job_id
+        self.url = url
+        self.format_type = format_type
+        self.resolution = resolution
+        self.priority = priority
+        self.skip_downloaded = skip_downloaded
+        self.rate_limit = None  # bytes per second, None for no limit of its own
+        self.state = QUEUED
+        self.message = "Queued"
+        self.title = None
+        self.percent = 0
+        self.metrics = None  # JobMetrics, once a worker runs the job
+        self._cancel_event = threading.Event()
+        self._pause_event = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    @property
+    def paused(self) -> bool:
+        return self._pause_event.is_set()
+
+    def cancel(self) -> None:
+        self._cancel_event.set()
+
+    def pause(self) -> None:
+        self._pause_event.set()
+
+    def resume(self) -> None:
+        self._pause_event.clear()
+
+    def check_cancelled(self) -> None:
+        """Raises JobCancelled if the job has been cancelled, or JobPaused if it has been paused, used as a
+        checkpoint by the worker."""
+        if self.cancelled:
+            raise JobCancelled()
+        if self.paused:
+            raise JobPaused()
+
+    def to_dict(self) -> dict:
+        """The job's current state as plain data, for clients of the daemon."""
+        metrics = {**self.metrics.to_dict(), "phase": self.metrics.phase_name} if self.metrics else None
+        return {"id": self.id, "url": self.url, "format": self.format_type, "resolution": self.resolution,
+                "priority": self.priority, "skip_downloaded": self.skip_downloaded, "rate_limit": self.rate_limit,
+                "state": self.state, "message": self.message, "title": self.title, "percent": self.percent,
+                "metrics": metrics}
+
+
+class DownloadQueue:
+    """Runs queued download jobs on a fixed pool of worker threads, higher priority jobs first.
+
+    The handler is called on a worker thread with the job to download, and reports its progress through
+    set_state(). Every state change is passed to on_change.
+    """
+
+    def __init__(self, handler: Callable[[Job], None], worker_count: int = DEFAULT_WORKER_COUNT,
+                 on_change: Optional[Callable[[Job], None]] = None) -> None:
+        self.handler = handler
+        self.on_change = on_change
+        self._queue = queue.PriorityQueue()  # (priority rank, order, job), a job can be in it more than once
+        self._jobs = {}
+        self._ids = itertools.count(1)
+        self._order = itertools.count()
+        self._started = set()  # ids of the jobs a worker has taken
+        self._submitted = set()  # ids of the jobs in the queue, as opposed to the ones only created
+        self._lock = threading.Lock()
+        self._workers = []
+        for i in range(max(1, worker_count)):
+            worker = threading.Thread(target=self._work, name=f"download-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    @property
+    def jobs(self) -> list[Job]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def get(self, job_id: int) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    @property
+    def pending(self) -> int:
+        """Number of jobs waiting for a worker (about, reprioritized jobs count twice until a worker skips them)."""
+        return self._queue.qsize()
+
+    def create(self, url: str, format_type: str, resolution: str, priority: str = NORMAL,
+               skip_downloaded: bool = True) -> Job:
+        """Registers a new job without queueing it, for work that runs outside the worker pool but should be
+        tracked and cancellable like the queued jobs, such as listing a playlist."""
+        if priority not in PRIORITIES:
+            raise ValueError(f"Invalid priority '{priority}'")
+        with self._lock:
+            job = Job(next(self._ids), url, format_type, resolution, priority, skip_downloaded)
+            self._jobs[job.id] = job
+        self._notify(job)
+        return job
+
+    def submit(self, url: str, format_type: str, resolution: str, priority: str = NORMAL,
+               skip_downloaded: bool = True) -> Job:
+        """Adds a new job to the queue, after the jobs of the same or a higher priority."""
+        job = self.create(url, format_type, resolution, priority, skip_downloaded)
+        with self._lock:
+            self._submitted.add(job.id)
+        self._put(job)
+        return job
+
+    def _put(self, job: Job) -> None:
+        self._queue.put((PRIORITIES.index(job.priority), next(self._order), job))
+
+    def set_priority(self, job_id: int, priority: str) -> None:
+        """Changes a job's priority. A queued job moves to its place for the new priority."""
+        if priority not in PRIORITIES:
+            raise ValueError(f"Invalid priority '{priority}'")
+        job = self.get(job_id)
+        if job is None or job.priority == priority:
+            return
+        with self._lock:
+            job.priority = priority
+            requeue = job.id not in self._started and job.state == QUEUED
+        if requeue:
+            self._put(job)  # the old entry is skipped, since its priority no longer matches
+        self._notify(job)
+
+    def forget(self, job_id: int) -> None:
+        """Stops tracking a finished job, so long batches don't keep every job in memory."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job.state in FINISHED_STATES:
+                del self._jobs[job_id]
+                self._started.discard(job_id)
+                self._submitted.discard(job_id)
+
+    def cancel(self, job_id: int) -> None:
+        """Cancels a job. Queued jobs are dropped, running jobs stop at their next checkpoint."""
+        job = self.get(job_id)
+        if job is None or job.state in FINISHED_STATES:
+            return
+        job.cancel()
+        if job.state in (QUEUED, PAUSED):
+            self.set_state(job, CANCELLED, "Cancelled")
+
+    def pause(self, job_id: int) -> None:
+        """Pauses a queued job, which keeps its place, or a running one, which stops at its next checkpoint and keeps
+        its partial download. Only jobs in the queue can be paused, not ones that were only created."""
+        job = self.get(job_id)
+        if job is None or job.state in FINISHED_STATES or job.state == PAUSED:
+            return
+        with self._lock:
+            if job.id not in self._submitted:
+                return
+            job.pause()
+            waiting = job.state == QUEUED and job.id not in self._started
+        if waiting:
+            self.set_state(job, PAUSED, "Paused")
+
+    def resume(self, job_id: int) -> None:
+        """Queues a paused job again, in its place for its priority."""
+        job = self.get(job_id)
+        if job is None or not job.paused:
+            return
+        with self._lock:
+            job.resume()
+            if job.state != PAUSED:
+                return  # paused while running, and resumed before it got to a checkpoint
+            self._started.discard(job.id)
+        self.set_state(job, QUEUED, "Queued")
+        self._put(job)
+
+    def join(self) -> None:
+        """Blocks until every submitted job has finished."""
+        self._queue.join()
+
+    def set_state(self, job: Job, state: str, message: Optional[str] = None, percent: Optional[int] = None) -> None:
+        job.state = state
+        if message is not None:
+            job.message = message
+        if percent is not None:
+            job.percent = percent
+        self._notify(job)
+
+    def _notify(self, job: Job) -> None:
+        if self.on_change:
+            self.on_change(job)
+
+    def _work(self) -> None:
+        while True:
+            rank, _, job = self._queue.get()
+            try:
+                with self._lock:
+                    # skip cancelled and paused jobs, and the entries of jobs that were started or reprioritized since
+                    if (job.cancelled or job.paused or job.state != QUEUED or job.id in self._started
+                            or rank != PRIORITIES.index(job.priority)):
+                        continue
+                    self._started.add(job.id)
+                self._run(job)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job: Job) -> None:
+        try:
+            self.handler(job)
+        except JobPaused:
+            with self._lock:  # resume() checks the state under the lock, so it's set here before releasing it
+                resumed = not job.paused  # resumed again before it got to stop
+                job.state = QUEUED if resumed else PAUSED
+                if resumed:
+                    self._started.discard(job.id)
+            self.set_state(job, job.state, "Queued" if resumed else "Paused")
+            if resumed:
+                self._put(job)
+        except JobCancelled:
+            self.set_state(job, CANCELLED, "Cancelled")
+        except Exception as e:
+            self.set_state(job, FAILED, f"Download failed, {e}")
+        else:
+            if job.state not in FINISHED_STATES:
+                self.set_state(job, DONE, percent=100)
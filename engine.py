@@ -0,0 +1,488 @@
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from typing import Callable, Optional
+from urllib.parse import urlsplit
+
+from pytube import YouTube, exceptions, extract, Stream
+
+from bandwidth import BandwidthScheduler, NORMAL, parse_rate
+from batch import filter_video_urls, is_batch_url, iter_video_urls
+from config import Config
+from download_index import DownloadIndex
+from http_pool import POOL, DEFAULT_MAX_PER_HOST, install as install_connection_pool
+from download_queue import DownloadQueue, Job, JobCancelled, JobPaused, RESOLVING, DOWNLOADING, DONE, FAILED, \
+    CANCELLED, PAUSED, FINISHED_STATES, DEFAULT_WORKER_COUNT
+from metadata_cache import MetadataCache, CachedVideo, video_entry, DEFAULT_MAX_CACHE_SIZE
+from metrics import JobMetrics, MetricsLog
+from mux import find_ffmpeg, mux
+from player_cache import PlayerCache
+from prefetch import Prefetcher
+from retry import CircuitBreaker, RetryPolicy, classify_error, error_message, sleep_unless_cancelled, EXPIRED, \
+    PERMANENT, DEFAULT_RETRY_ATTEMPTS
+from resources import get_absolute_path
+from segmented import download_segmented, discard_partial, find_partial_downloads, PartClaim, DEFAULT_SEGMENT_COUNT
+from selection import StreamIndex, build_profiles, builtin_profile, stream_size
+from transcode import transcode_to_mp3, DEFAULT_MP3_BITRATE
+
+METADATA_CACHE_PATH = get_absolute_path("data/cache/metadata")
+PLAYER_CACHE_PATH = get_absolute_path("data/cache/player")
+DOWNLOAD_INDEX_PATH = get_absolute_path("data/download_index.sqlite3")
+METRICS_LOG_PATH = get_absolute_path("data/metrics/jobs.jsonl")
+METRICS_PROMETHEUS_PATH = get_absolute_path("data/metrics/ytdl.prom")
+BATCH_PENDING_PER_WORKER = 2  # playlist listing pauses while more jobs than this per worker are waiting
+BATCH_POLL_INTERVAL = 0.5  # seconds
+YOUTUBE_HOST = "www.youtube.com"  # of the watch page, player and innertube requests that resolve a video
+
+
+class Engine:
+    """Resolves, selects and downloads videos on a queue of worker threads, without any UI.
+
+    Every job change is passed to on_change on the worker thread that made it. download_path and worker_count
+    override the config, e.g. for a single command line run. Videos already in the download index in the same format
+    and quality are skipped before being resolved, unless skip_downloaded is False or submit() is told not to for a
+    url. The phase timings of every finished job are exported by metrics_log. Download bandwidth is shared out by
+    priority and rate limits through bandwidth. prefetch() resolves a url before it's submitted, passing what it
+    found to on_prefetch. Failed attempts at a job are retried by retry_policy, and requests to a host that is rate
+    limiting wait for its circuit in breaker.
+    """
+
+    def __init__(self, config: Config, on_change: Optional[Callable[[Job], None]] = None,
+                 download_path: Optional[str] = None, worker_count: Optional[int] = None,
+                 skip_downloaded: bool = True, on_prefetch: Optional[Callable[[str, dict], None]] = None) -> None:
+        self.config = config
+        self._download_path = download_path
+        self.skip_downloaded = skip_downloaded
+        POOL.max_per_host = config.get("max_connections_per_host", DEFAULT_MAX_PER_HOST)
+        install_connection_pool()
+        self.connection_pool = POOL
+        self.breaker = POOL.breaker = CircuitBreaker()
+        self.retry_policy = RetryPolicy(config.get("retry_attempts", DEFAULT_RETRY_ATTEMPTS))
+        PlayerCache(PLAYER_CACHE_PATH).install()
+        self.metadata_cache = MetadataCache(METADATA_CACHE_PATH,
+                                            config.get("metadata_cache_size", DEFAULT_MAX_CACHE_SIZE))
+        self.index = DownloadIndex(DOWNLOAD_INDEX_PATH)
+        self.metrics_log = MetricsLog(config.get("metrics_log_path", METRICS_LOG_PATH),
+                                      config.get("metrics_prometheus_path", METRICS_PROMETHEUS_PATH), POOL)
+        self.bandwidth = BandwidthScheduler(parse_rate(config.get("max_download_rate")))
+        self.profiles = build_profiles(config.get("stream_profiles"))
+        self.ffmpeg = find_ffmpeg()
+        self.worker_count = worker_count or config.get("worker_count", DEFAULT_WORKER_COUNT)
+        self.on_change = on_change
+        self.queue = DownloadQueue(self.download_video_stream, self.worker_count, on_change=self._on_job_change)
+        self.prefetcher = Prefetcher(self._prefetch_video, on_prefetch)
+        self._batch_threads = []
+        self._downloads = {}  # job id -> (path, temporary) of the files it downloads into, kept while it's paused
+
+    @property
+    def download_path(self) -> str:
+        return self._download_path or self.config.get("download_path")
+
+    def set_download_path(self, path: str) -> None:
+        """Downloads new jobs to path, and saves it in the config."""
+        self._download_path = None
+        self.config.set("download_path", path)
+
+    def submit(self, url: str, format_type: str, resolution: str, priority: str = NORMAL,
+               skip_downloaded: Optional[bool] = None, **batch_filters) -> Job:
+        """Queues a video url, or lists a playlist or channel url with submit_batch(). skip_downloaded overrides
+        the engine's skip_downloaded for this url."""
+        if is_batch_url(url):
+            return self.submit_batch(url, format_type, resolution, priority, skip_downloaded=skip_downloaded,
+                                     **batch_filters)
+        return self.queue.submit(url, format_type, resolution, priority,
+                                 self.skip_downloaded if skip_downloaded is None else skip_downloaded)
+
+    def submit_batch(self, url: str, format_type: str, resolution: str, priority: str = NORMAL,
+                     max_count: Optional[int] = None, after: Optional[date] = None, before: Optional[date] = None,
+                     skip_downloaded: Optional[bool] = None,
+                     submit_video: Optional[Callable[[str], None]] = None) -> Job:
+        """Lists a playlist or channel on a background thread, queueing every video as soon as it is found.
+
+        The returned job tracks the listing itself. Listing pauses while the queue is full enough, so memory stays
+        flat however long the playlist is. The videos are queued with the listing job's priority at the time, or
+        passed to submit_video instead if given, e.g. to queue them on a job spool. See batch.filter_video_urls() for
+        the filters.
+        """
+        job = self.queue.create(url, format_type, resolution, priority,
+                                self.skip_downloaded if skip_downloaded is None else skip_downloaded)
+        thread = threading.Thread(target=self._list_batch, args=(job, max_count, after, before, submit_video),
+                                  daemon=True)
+        self._batch_threads = [thread for thread in self._batch_threads if thread.is_alive()] + [thread]
+        thread.start()
+        return job
+
+    def _list_batch(self, job: Job, max_count: Optional[int], after: Optional[date], before: Optional[date],
+                    submit_video: Optional[Callable[[str], None]]) -> None:
+        skip = ((lambda video_id: (video_id, job.format_type, index_quality(job)) in self.index) if job.skip_downloaded
+                else None)
+        self.queue.set_state(job, RESOLVING, "Listing videos...")
+        count = 0
+        try:
+            for url in filter_video_urls(iter_video_urls(job.url), max_count, after, before, skip):
+                while submit_video is None and self.queue.pending >= self.worker_count * BATCH_PENDING_PER_WORKER:
+                    job.check_cancelled()
+                    time.sleep(BATCH_POLL_INTERVAL)
+                job.check_cancelled()
+                if submit_video is None:
+                    self.queue.submit(url, job.format_type, job.resolution, job.priority, job.skip_downloaded)
+                else:
+                    submit_video(url)
+                count += 1
+                self.queue.set_state(job, RESOLVING, f"Listing videos... {count} queued")
+        except JobCancelled:
+            self.queue.set_state(job, CANCELLED, f"Cancelled after queueing {count} videos")
+        except Exception as e:
+            self.queue.set_state(job, FAILED, f"Listing failed after queueing {count} videos, {e}")
+        else:
+            self.queue.set_state(job, DONE, f"Queued {count} videos", 100)
+
+    def join(self) -> None:
+        """Blocks until every playlist has been listed and every queued job has finished."""
+        for thread in self._batch_threads:
+            thread.join()
+        self.queue.join()
+
+    def cancel(self, job_id: int) -> None:
+        """Cancels a job, see DownloadQueue.cancel(). A running job removes its partial files when it stops, a
+        paused one here."""
+        job = self.queue.get(job_id)
+        paused = job is not None and job.state == PAUSED
+        self.queue.cancel(job_id)
+        if paused and job.state == CANCELLED:
+            self.discard_downloads(job_id)
+
+    def pause(self, job_id: int) -> None:
+        """Pauses a job, a downloading one keeps its partial download and resumes from it, except an mp3 encoded with
+        ffmpeg, which has no partial file and starts over. See DownloadQueue.pause()."""
+        self.queue.pause(job_id)
+
+    def resume(self, job_id: int) -> None:
+        self.queue.resume(job_id)
+
+    def list_jobs(self) -> list[dict]:
+        """Returns every tracked job as plain data, see Job.to_dict()."""
+        return [job.to_dict() for job in self.queue.jobs]
+
+    def connection_stats(self) -> dict:
+        return self.connection_pool.stats()
+
+    def set_priority(self, job_id: int, priority: str) -> None:
+        """Changes a job's priority, moving it in the queue, or in the bandwidth shares if it's downloading."""
+        self.queue.set_priority(job_id, priority)
+        self.bandwidth.set_priority(job_id, priority)
+
+    def set_rate_limit(self, job_id: int, rate: Optional[int]) -> None:
+        """Limits a job to rate bytes per second, None for no limit, also while it's downloading."""
+        job = self.queue.get(job_id)
+        if job is not None:
+            job.rate_limit = rate
+            self.bandwidth.set_job_rate(job_id, rate)
+
+    def set_total_rate(self, rate: Optional[int]) -> None:
+        """Limits all downloads together to rate bytes per second, None for no limit, and saves it in the config."""
+        self.bandwidth.set_rate(rate)
+        self.config.set("max_download_rate", rate)
+
+    def prefetch(self, url: Optional[str]) -> None:
+        """Starts resolving a video url in the background as it's being entered, see Prefetcher, so its download finds
+        the metadata cached. Anything that doesn't look like a video url only cancels the last prefetch."""
+        if url and not is_batch_url(url):
+            try:
+                extract.video_id(url)
+            except exceptions.RegexMatchError:
+                url = None
+        else:
+            url = None
+        self.prefetcher.request(url)
+
+    def _prefetch_video(self, url: str, check_current: Callable[[], None]) -> dict:
+        """Resolves a video into the metadata cache. Returns its title and the resolutions it can be downloaded in as
+        mp4, see resolution_options(), or an error message."""
+        try:
+            video = self.get_video(url)
+            if isinstance(video, YouTube):
+                video.vid_info  # the innertube request
+                check_current()
+                video.streams  # the player and deciphering the stream urls
+                check_current()
+                self.metadata_cache.put(video.video_id, video_entry(video))
+            index = StreamIndex(video.streams, can_mux=bool(self.ffmpeg))
+            return {"url": url, "title": video.title,
+                    "resolutions": resolution_options(index, self.profiles, self.ffmpeg)}
+        except exceptions.AgeRestrictedError:
+            return {"url": url, "error": "Video is age restricted"}
+        except exceptions.VideoUnavailable:
+            return {"url": url, "error": "Video is unavailable"}
+        except (exceptions.PytubeError, OSError):
+            return {"url": url, "error": "Error getting video"}
+
+    def _on_job_change(self, job: Job) -> None:
+        if job.state in FINISHED_STATES and job.metrics is not None and job.metrics.finish(job.state):
+            self.metrics_log.record(job.metrics)
+        if self.on_change:
+            self.on_change(job)
+
+    def rescan(self) -> dict:
+        """Brings the download index up to date with the download folder, see DownloadIndex.rescan()."""
+        return self.index.rescan(self.download_path)
+
+    def partial_downloads(self) -> list[dict]:
+        """Returns the sidecar data of the interrupted downloads in the download folder that can be resumed, leaving
+        out the ones of jobs that are still queued, running or paused."""
+        if not self.download_path:
+            return []
+        tracked = {(job.url, job.format_type, job.resolution) for job in self.queue.jobs
+                   if job.state not in FINISHED_STATES}
+        partials = {}
+        for partial in find_partial_downloads(self.download_path):
+            if "url" in partial:  # muxed downloads leave a partial video and audio file for the same job
+                key = partial["url"], partial["format_type"], partial["resolution"]
+                if key not in tracked:
+                    partials[key] = partial
+        return list(partials.values())
+
+    def download_video_stream(self, job: Job) -> None:
+        """Resolves and downloads a queued job, called on a download queue worker thread.
+
+        Failed attempts are retried with backoff if the error might go away (see retry.classify_error()), after
+        resolving the video again if its stream urls stopped working. Downloads resume from their partial file, so
+        a retry only fetches the bytes still missing, except mp3s encoded with ffmpeg (see transcode_to_mp3()), which
+        start over. A cancelled job removes its partial files, a paused one keeps them.
+        """
+        job.metrics = JobMetrics(job.id, job.url, job.format_type)
+        match job.format_type:
+            case "mp4":
+                file_type = "video"
+            case "mp3":
+                file_type = "audio"
+            case _:
+                self.queue.set_state(job, FAILED, "Invalid format")
+                return
+        if not self.download_path:
+            self.queue.set_state(job, FAILED, "No download folder chosen")
+            return
+        try:
+            video_id = extract.video_id(job.url)
+        except exceptions.RegexMatchError:
+            self.queue.set_state(job, FAILED, f"No video found")
+            return
+        downloaded = self.index.get(video_id, job.format_type, index_quality(job)) if job.skip_downloaded else None
+        if downloaded is not None and os.path.isfile(downloaded["path"]):
+            self.queue.set_state(job, DONE, f"Already downloaded '{os.path.basename(downloaded['path'])}'", 100)
+            return
+        downloads = self._downloads.setdefault(job.id, [])
+        try:
+            self.download_with_retries(job, video_id, file_type, downloads)
+        except JobPaused:
+            raise
+        except JobCancelled:
+            self.discard_downloads(job.id)
+            raise
+        self._downloads.pop(job.id, None)
+
+    def download_with_retries(self, job: Job, video_id: str, file_type: str, downloads: list[tuple[str, bool]]) -> None:
+        retry = 0
+        while True:
+            try:
+                self.attempt_download(job, video_id, file_type, downloads)
+                return
+            except JobCancelled:
+                raise
+            except Exception as e:
+                kind = classify_error(e)
+                if kind == PERMANENT or retry >= self.retry_policy.attempts:
+                    attempts = f" after {retry + 1} attempts" if retry else ""
+                    self.queue.set_state(job, FAILED, error_message(e) + attempts)
+                    return
+                retry += 1
+                if kind == EXPIRED:
+                    self.metadata_cache.discard(video_id)  # resolve the video again for new stream urls
+                job.metrics.add_retry()
+                delay = self.retry_policy.delay(retry, e)
+                self.queue.set_state(job, RESOLVING, f"Retrying in {delay:.0f}s ({retry}/{self.retry_policy.attempts})"
+                                                     f", {error_message(e)}")
+                sleep_unless_cancelled(delay, job.check_cancelled)
+
+    def discard_downloads(self, job_id: int) -> None:
+        """Removes the partial files of a cancelled job, so they aren't offered for resume."""
+        for file_path, temporary in self._downloads.pop(job_id, []):
+            discard_partial(file_path, with_file=temporary)
+
+    def attempt_download(self, job: Job, video_id: str, file_type: str, downloads: list[tuple[str, bool]]) -> None:
+        """One attempt at resolving and downloading a job. Raises the error it failed with, except for the problems
+        with the job itself that no retry can solve, which fail the job. The (path, temporary) of the files it
+        downloads into are added to downloads, temporary for the halves of a muxed download."""
+        self.breaker.wait(YOUTUBE_HOST, job.check_cancelled)
+        self.queue.set_state(job, RESOLVING, f"Getting {file_type}...")
+
+        def job_progress(stream, chunk, bytes_remaining):
+            self.on_progress(job, stream, chunk, bytes_remaining)
+
+        audio_stream = None
+        with job.metrics.phase("resolve"):
+            self.prefetcher.wait(job.url)  # a prefetch of the url that's under way leaves it in the metadata cache
+            video = self.get_video(job.url, on_progress_callback=job_progress)
+            video.streams  # resolving is lazy, so it's forced here to time it apart from the selection
+        with job.metrics.phase("select"):
+            index = StreamIndex(video.streams, can_mux=bool(self.ffmpeg))
+            if job.format_type == "mp4":
+                profile = self.profiles.get(job.resolution) or builtin_profile(job.resolution)
+                if profile is None:
+                    self.queue.set_state(job, FAILED, f"Unknown resolution or stream profile '{job.resolution}'")
+                    return
+                stream = index.select(profile)
+                if stream is not None and not stream.includes_audio_track and self.ffmpeg:
+                    audio_stream = index.audio
+            else:
+                stream = index.audio
+        if isinstance(video, YouTube):
+            self.metadata_cache.put(video.video_id, video_entry(video))
+        if stream is None:  # no stream gotten
+            self.queue.set_state(job, FAILED, f"No stream found in {job.resolution}")
+            return
+        job.title = stream.title
+        self.breaker.wait(urlsplit(stream.url).hostname, job.check_cancelled)
+        job.check_cancelled()
+        self.queue.set_state(job, DOWNLOADING, f"Downloading {stream.type}...")
+        job.metrics.start_download()
+        share = self.bandwidth.register(job.id, job.priority, job.rate_limit, job.check_cancelled)
+        throttle = functools.partial(self.bandwidth.acquire, share)
+        try:
+            if audio_stream is not None:
+                for filename in muxed_filenames(stream, audio_stream):
+                    downloads.append((os.path.join(self.download_path, filename), True))
+                file_path = self.download_muxed(job, video, stream, audio_stream, throttle)
+            elif job.format_type == "mp3" and self.ffmpeg:
+                file_path = transcode_to_mp3(stream, self.download_path, self.ffmpeg,
+                                             bitrate=self.config.get("mp3_bitrate", DEFAULT_MP3_BITRATE),
+                                             quality=self.config.get("mp3_quality"), on_progress=job_progress,
+                                             throttle=throttle)
+            else:
+                filename = stream.default_filename.replace("mp4", job.format_type)
+                downloads.append((os.path.join(self.download_path, filename), False))
+                file_path = self.download_stream(job, video, stream, filename, job_progress, throttle)
+        finally:
+            self.bandwidth.unregister(job.id)
+        self.index.add(video_id, job.format_type, index_quality(job), file_path, stream.itag)
+        self.on_complete(job, stream, muted=stream.type == "video" and not stream.includes_audio_track
+                         and audio_stream is None)
+
+    def download_stream(self, job: Job, video: YouTube | CachedVideo, stream: Stream, filename: str,
+                        on_progress: Callable, throttle: Optional[Callable[[int], None]] = None) -> str:
+        return download_segmented(stream, self.download_path, filename=filename,
+                                  segment_count=self.config.get("segment_count", DEFAULT_SEGMENT_COUNT),
+                                  on_progress=on_progress, video_id=video.video_id,
+                                  job_info={"url": job.url, "format_type": job.format_type,
+                                            "resolution": job.resolution}, throttle=throttle)
+
+    def download_muxed(self, job: Job, video: YouTube | CachedVideo, video_stream: Stream,
+                       audio_stream: Stream, throttle: Optional[Callable[[int], None]] = None) -> str:
+        """Downloads a video-only and an audio-only stream at the same time, then muxes them into one file as soon
+        as both are complete, so it takes about as long as the larger stream alone. Returns the muxed file's path."""
+        video_filename, audio_filename = muxed_filenames(video_stream, audio_stream)
+        total_size = video_stream.filesize + audio_stream.filesize
+        bytes_remaining = {video_stream.itag: video_stream.filesize, audio_stream.itag: audio_stream.filesize}
+
+        def muxed_progress(stream, chunk, stream_bytes_remaining):
+            bytes_remaining[stream.itag] = stream_bytes_remaining
+            job.metrics.add_bytes(len(chunk))
+            self.report_progress(job, "video and audio", total_size - sum(bytes_remaining.values()), total_size)
+
+        output_path = os.path.join(self.download_path, video_stream.default_filename)
+        with PartClaim(output_path):  # a second job for the same video waits, instead of muxing or removing with it
+            if os.path.isfile(output_path):  # muxed by the job that held the claim before
+                return output_path
+            with ThreadPoolExecutor(max_workers=2, thread_name_prefix="mux-download") as pool:
+                video_future = pool.submit(self.download_stream, job, video, video_stream, video_filename,
+                                           muxed_progress, throttle)
+                audio_future = pool.submit(self.download_stream, job, video, audio_stream, audio_filename,
+                                           muxed_progress, throttle)
+                video_path, audio_path = video_future.result(), audio_future.result()
+            self.queue.set_state(job, DOWNLOADING, "Muxing video and audio...")
+            try:
+                mux(video_path, audio_path, output_path, self.ffmpeg)
+            finally:
+                os.remove(video_path)
+                os.remove(audio_path)
+        return output_path
+
+    def get_video(self, url: str, on_progress_callback=None) -> YouTube | CachedVideo:
+        """Gets the video from the metadata cache if it's fresh there, else a new (not yet resolved) YouTube object."""
+        entry = self.metadata_cache.get(extract.video_id(url))
+        if entry:
+            return CachedVideo(entry, on_progress_callback)
+        return YouTube(url, on_progress_callback=on_progress_callback)
+
+    def on_progress(self, job: Job, stream, chunk, bytes_remaining) -> None:
+        """Function on download progress callback event in download_video_stream()."""
+        job.metrics.add_bytes(len(chunk))
+        self.report_progress(job, stream.type, stream.filesize - bytes_remaining, stream.filesize)
+
+    def report_progress(self, job: Job, label: str, bytes_downloaded: int, total_size: int) -> None:
+        """Updates the job's progress, and stops the download if the job was cancelled."""
+        job.check_cancelled()
+        percent = int(round(bytes_downloaded / total_size * 100, 0))
+        self.queue.set_state(job, DOWNLOADING, f"Downloading {label}... {percent}%", percent)
+
+    def on_complete(self, job: Job, stream, muted: bool = False) -> None:
+        """Function on download complete event in download_video_stream().
+        It sets the job's completion message, muted for a video saved without audio."""
+        self.queue.set_state(job, job.state, completion_message(stream, muted), 100)
+
+
+def resolution_options(index: StreamIndex, profiles: dict,
+                       ffmpeg: Optional[str]) -> list[tuple[str, str, Optional[int], bool]]:
+    """Returns what a video would be downloaded in as mp4 with each profile, as (profile name, actual resolution,
+    file size, whether it has audio) tuples. The size includes the audio stream muxed in with ffmpeg, and is None if
+    it isn't known. Without ffmpeg, a video-only stream is saved without audio."""
+    options = []
+    for name, profile in profiles.items():
+        stream = index.select(profile)
+        if stream is None or (name == f"{profile.max_height}p" and stream.resolution != name):
+            continue  # a resolution the video doesn't have, the profile fell back to another one
+        size = stream_size(stream)
+        muxed = not stream.includes_audio_track and bool(ffmpeg) and index.audio is not None
+        if muxed and size is not None:
+            audio_size = stream_size(index.audio)
+            size = size + audio_size if audio_size is not None else None
+        options.append((name, stream.resolution, size, stream.includes_audio_track or muxed))
+    return options
+
+
+def index_quality(job: Job) -> str:
+    """The quality a job's download is indexed under, the resolution asked for, or none for mp3, which is always
+    the best audio stream whatever resolution a client sent along."""
+    return "" if job.format_type == "mp3" else job.resolution
+
+
+def muxed_filenames(video_stream: Stream, audio_stream: Stream) -> tuple[str, str]:
+    """Returns the names of the temporary video and audio files a muxed download is made of."""
+    name, extension = os.path.splitext(video_stream.default_filename)
+    return f"{name}.video{extension}", f"{name}.audio.{audio_stream.subtype}"
+
+
+def completion_message(stream, muted: bool = False) -> str:
+    max_chars = 80
+    # max_chars = 68
+    title = stream.title
+    match stream.type:
+        case "video":
+            resolution = f"{stream.resolution} (muted)" if muted else stream.resolution
+            text = f"Downloaded '{title}.mp4' in {resolution}!"
+            if len(text) > max_chars:  # video title too long
+                chars = len(text) - max_chars - 4
+                text = f"Downloaded '{title[:chars]}... .mp4' in {resolution}!"
+        case "audio":
+            text = f"Downloaded '{title}.mp3' with bitrate {stream.bitrate}!"
+            if len(text) > max_chars:  # video title too long
+                chars = len(text) - max_chars - 4
+                text = f"Downloaded '{title[:chars]}... .mp3' with bitrate {stream.bitrate}!"
+        case _:
+            text = f"Downloaded '{title}'!"
+            if len(text) > max_chars:  # video title too long
+                text = text[:max_chars] + "..."
+    return text
@@ -0,0 +1,247 @@
+import http.client
+import io
+import json
+import socket
+import ssl
+import threading
+from typing import Optional
+from urllib.error import HTTPError, URLError
+from urllib.parse import urljoin, urlsplit
+from urllib.request import Request, getproxies, urlopen
+
+from pytube import request
+
+DEFAULT_MAX_PER_HOST = 8
+MAX_REDIRECTS = 10
+DEFAULT_HEADERS = {"User-Agent": "Mozilla/5.0", "accept-language": "en-US,en"}
+# errors of a kept-alive connection the server has closed in the meantime, the request is sent again on a new one
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError,
+                           ConnectionAbortedError)
+
+
+class PooledResponse:
+    """An http.client response that gives its connection back to the pool once its body has been read to the end,
+    or closes it if the response is closed before that.
+
+    Has the parts of urlopen()'s response pytube and the downloads use: status, read(), readinto(), info(),
+    getcode(), geturl(), and use as a context manager.
+    """
+
+    def __init__(self, pool: "ConnectionPool", key: tuple, connection: http.client.HTTPConnection,
+                 response: http.client.HTTPResponse, url: str) -> None:
+        self._pool = pool
+        self._key = key
+        self._connection = connection
+        self._response = response
+        self.url = url
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+        if response.length == 0:  # HEAD requests and empty bodies, nothing will ever be read from them
+            response.read()
+            self._release()
+
+    def read(self, amt: Optional[int] = None) -> bytes:
+        data = self._response.read(amt)
+        if self._response.isclosed():
+            self._release()
+        return data
+
+    def readinto(self, buffer) -> int:
+        count = self._response.readinto(buffer)
+        if self._response.isclosed():
+            self._release()
+        return count
+
+    def info(self) -> http.client.HTTPMessage:
+        return self.headers
+
+    def getcode(self) -> int:
+        return self.status
+
+    def geturl(self) -> str:
+        return self.url
+
+    def _release(self) -> None:
+        if self._connection is not None:
+            self._pool._release(self._key, self._connection, reusable=not self._response.will_close)
+            self._connection = None
+
+    def close(self) -> None:
+        """Closes the response. Its connection is reused if the body was read to the end, else closed."""
+        if self._connection is not None:
+            reusable = self._response.isclosed() and not self._response.will_close
+            self._response.close()
+            self._pool._release(self._key, self._connection, reusable=reusable)
+            self._connection = None
+
+    def __enter__(self) -> "PooledResponse":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __del__(self) -> None:
+        if getattr(self, "_connection", None) is not None:
+            self.close()
+
+
+class ConnectionPool:
+    """Process-wide pool of keep-alive HTTP(S) connections, reused across every request to the same host.
+
+    At most max_per_host connections per host are in use at once, further requests to that host wait for one to be
+    given back. Requests go through urlopen() instead when a proxy is configured for their scheme. stats() has the
+    request count, the share of requests that reused a connection and the open connections, to tune the limit.
+    """
+
+    def __init__(self, max_per_host: int = DEFAULT_MAX_PER_HOST) -> None:
+        self.max_per_host = max_per_host
+        self.proxies = getproxies()
+        self.breaker = None  # gets the status of every response by host, see retry.CircuitBreaker
+        self._ssl_context = None  # created with the first https connection, loading the CA certificates takes a while
+        self._lock = threading.Lock()
+        self._idle = {}  # (scheme, host, port) -> idle connections, most recently used last
+        self._slots = {}  # (scheme, host, port) -> semaphore of max_per_host
+        self._open = {}  # (scheme, host, port) -> open connection count
+        self._requests = 0
+        self._reused = 0
+        self._waits = 0
+
+    def request(self, method: str, url: str, headers: Optional[dict] = None, body: Optional[bytes] = None,
+                timeout=socket._GLOBAL_DEFAULT_TIMEOUT) -> PooledResponse:
+        """Sends a request like urlopen() does: redirects are followed, and HTTP error statuses raise HTTPError,
+        connection failures URLError."""
+        headers = {**DEFAULT_HEADERS, **(headers or {})}
+        for _ in range(MAX_REDIRECTS + 1):
+            if self.proxies.get(urlsplit(url).scheme):
+                return urlopen(Request(url, data=body, headers=headers, method=method), timeout=timeout)  # nosec
+            response = self._send(method, url, headers, body, timeout)
+            if self.breaker is not None:
+                self.breaker.record(urlsplit(url).hostname, response.status)
+            if response.status in (301, 302, 303, 307, 308) and response.headers.get("Location"):
+                response.read()
+                response.close()
+                url = urljoin(url, response.headers["Location"])
+                if response.status not in (307, 308) and method != "HEAD":
+                    method, body = "GET", None
+                    headers.pop("Content-Type", None)
+                continue
+            if response.status >= 400:
+                error_body = response.read()
+                response.close()
+                raise HTTPError(url, response.status, response.reason, response.headers, io.BytesIO(error_body))
+            return response
+        raise URLError(f"more than {MAX_REDIRECTS} redirects")
+
+    def _send(self, method: str, url: str, headers: dict, body: Optional[bytes], timeout) -> PooledResponse:
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise ValueError("Invalid URL")
+        key = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == "https" else 80))
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        if timeout is socket._GLOBAL_DEFAULT_TIMEOUT:
+            timeout = socket.getdefaulttimeout()
+        self._acquire(key)
+        try:
+            while True:
+                connection, reused = self._checkout(key)
+                connection.timeout = timeout
+                if connection.sock is not None:
+                    connection.sock.settimeout(timeout)
+                try:
+                    connection.request(method, path, body=body, headers=headers)
+                except OSError as e:
+                    self._discard(key, connection)
+                    if reused and isinstance(e, STALE_CONNECTION_ERRORS):
+                        continue
+                    raise URLError(e)  # like urlopen(), which the callers of pytube's request layer expect
+                try:
+                    response = connection.getresponse()
+                except BaseException as e:
+                    self._discard(key, connection)
+                    if reused and isinstance(e, STALE_CONNECTION_ERRORS):
+                        continue
+                    raise
+                with self._lock:
+                    self._requests += 1
+                    self._reused += reused
+                return PooledResponse(self, key, connection, response, url)
+        except BaseException:
+            self._slots[key].release()
+            raise
+
+    def _acquire(self, key: tuple) -> None:
+        with self._lock:
+            slots = self._slots.setdefault(key, threading.BoundedSemaphore(max(1, self.max_per_host)))
+        if not slots.acquire(blocking=False):
+            with self._lock:
+                self._waits += 1
+            slots.acquire()
+
+    def _checkout(self, key: tuple) -> tuple[http.client.HTTPConnection, bool]:
+        """Returns an idle connection to the host and True, or a new one and False."""
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+            self._open[key] = self._open.get(key, 0) + 1
+        scheme, host, port = key
+        if scheme == "https":
+            with self._lock:
+                if self._ssl_context is None:
+                    self._ssl_context = ssl.create_default_context()
+            return http.client.HTTPSConnection(host, port, context=self._ssl_context), False
+        return http.client.HTTPConnection(host, port), False
+
+    def _release(self, key: tuple, connection: http.client.HTTPConnection, reusable: bool) -> None:
+        if reusable:
+            with self._lock:
+                self._idle.setdefault(key, []).append(connection)
+            self._slots[key].release()
+        else:
+            self._discard(key, connection)
+            self._slots[key].release()
+
+    def _discard(self, key: tuple, connection: http.client.HTTPConnection) -> None:
+        connection.close()
+        with self._lock:
+            self._open[key] -= 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"requests": self._requests, "reused": self._reused,
+                    "hit_rate": self._reused / self._requests if self._requests else 0.0,
+                    "waits": self._waits, "open": sum(self._open.values()),
+                    "idle": sum(len(idle) for idle in self._idle.values()),
+                    "open_per_host": {host: count for (_, host, _), count in self._open.items() if count}}
+
+    def close(self) -> None:
+        """Closes every idle connection."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for key, connections in idle.items():
+            for connection in connections:
+                self._discard(key, connection)
+
+
+POOL = ConnectionPool()
+_installed = False
+
+
+def install(pool: ConnectionPool = POOL) -> None:
+    """Makes pytube send its requests (watch page, innertube, base.js, stream downloads) through the pool."""
+    global _installed
+    if _installed:
+        return
+
+    def execute_request(url, method=None, headers=None, data=None, timeout=socket._GLOBAL_DEFAULT_TIMEOUT):
+        if data and not isinstance(data, bytes):
+            data = json.dumps(data).encode("utf-8")
+        if not url.lower().startswith("http"):
+            raise ValueError("Invalid URL")
+        return pool.request(method or ("POST" if data else "GET"), url, headers=headers, body=data, timeout=timeout)
+
+    request._execute_request = execute_request
+    _installed = True
@@ -1,31 +1,75 @@
-import asyncio
-import json
-import os
+import atexit
 import sys
-import threading
 import tkinter as tk
-from tkinter import ttk, filedialog
+from tkinter import ttk, filedialog, messagebox, simpledialog
+from typing import Optional, TYPE_CHECKING
 
-from pytube import YouTube, exceptions, Stream
-
-
-def get_absolute_path(relative_path: str) -> str:
-    """Get absolute path to resource, works for dev and for PyInstaller """
-    base_path = getattr(sys, '_MEIPASS', os.path.dirname(os.path.abspath(__file__)))
-    return os.path.join(base_path, relative_path)
+from bandwidth import NORMAL, PRIORITIES, parse_rate
+from config import Config
+from download_queue import Job, DOWNLOADING, FINISHED_STATES, PAUSED
+from progress_channel import ProgressChannel
+from resources import get_absolute_path, CONFIG_JSON_PATH, FORMATS, MAX_PROGRESSIVE, RESOLUTIONS
 
+if TYPE_CHECKING:
+    from daemon import DaemonClient
+    from engine import Engine
 
 WINDOW_WIDTH = 285
-WINDOW_HEIGHT = 245
-CONFIG_JSON_PATH = get_absolute_path("data/config.json")
-FOLDER_IMAGE_PATH = get_absolute_path("data/folder.png")
+WINDOW_HEIGHT = 420
+FOLDER_IMAGE_PATH = get_absolute_path("data/folder_small.png")  # data/folder.png scaled down 35 times
 ICON_IMAGE_PATH = get_absolute_path("data/icon.ico")
-FOLDER_IMAGE_SUBSAMPLE = 35, 35
+THEME_PATH = get_absolute_path("data/Azure-ttk-theme-2.1.0/azure-dark.tcl")  # only the dark theme of azure.tcl
 DOWNLOAD_FOLDER_TITLE = "Select a Download Directory"
-
-
-async def set_result_label_async_message(message: str) -> None:
-    result_label.configure(text=message)
+PROGRESS_FPS = 15  # how often per second job progress is drawn
+CONNECTION_STATS_INTERVAL = 1000  # milliseconds between updates of the connection stats in the stats panel
+STATS_COLUMNS = ("job", "phase", "resolve", "select", "connect", "transfer", "post_process", "speed", "retries")
+
+
+def get_engine() -> "Engine | DaemonClient":
+    """Returns the download engine: a client of the daemon if one is running, so its jobs are shared with other
+    clients and keep running after the window is closed, or else an engine of its own. The download backend (pytube
+    and the rest) is imported on first use, so the window is drawn without waiting for it. It's started right after
+    the first paint, see offer_resume(). Only the methods Engine and DaemonClient share are used on it, through
+    call_engine()."""
+    global engine
+    if engine is None:
+        from daemon import find_daemon, DEFAULT_DAEMON_PORT
+        engine = find_daemon(config.get("daemon_port", DEFAULT_DAEMON_PORT), on_event=publish_daemon_event)
+    if engine is None:
+        from engine import Engine
+        engine = Engine(config, on_change=lambda job: progress_channel.publish(job.id, job),
+                        on_prefetch=lambda url, result: prefetch_channel.publish(url, result))
+    return engine
+
+
+def call_engine(method: str, *args):
+    """Calls a method of the engine and returns its result. If the daemon has stopped, the engine is replaced, by a
+    new daemon's client or else an engine of its own, and called again. If the daemon refused the call, shows why and
+    returns None."""
+    global engine
+    current = get_engine()
+    from daemon import DaemonError, DaemonUnavailable
+    try:
+        return getattr(current, method)(*args)
+    except DaemonUnavailable as e:
+        engine = None
+        progress_channel.drain()
+        queue_view.delete(*queue_view.get_children())  # the daemon's jobs, whose ids the new engine starts over
+        if stats_view is not None:
+            stats_view.delete(*stats_view.get_children())
+        result_label.configure(text=str(e))
+        return getattr(get_engine(), method)(*args)
+    except DaemonError as e:
+        result_label.configure(text=str(e))
+        return None
+
+
+def publish_daemon_event(event: dict) -> None:
+    """Passes a job change or prefetch result from the daemon's event stream to poll_progress()."""
+    if event["type"] == "job":
+        progress_channel.publish(event["job"]["id"], event["job"])
+    elif event["type"] == "prefetch":
+        prefetch_channel.publish(event["url"], event["result"])
 
 
 def download() -> None:
@@ -33,174 +77,249 @@ def download() -> None:
     if not url:
         result_label.configure(text="Invalid URL")
         return
+    resolution = resolution_choices.get(resolution_var.get(), resolution_var.get())
+    call_engine("submit", url, format_var.get(), resolution)
 
-    progress_bar.grid(column=col, row=8)
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-
-    # All this async code is to display "downloading..." status message as the download is processing.
-    async def download_task():
-        await set_result_label_async_message("Getting video...")
-        format_type = format_var.get()
-        resolution = resolution_var.get()
-        download_video_stream(url, format_type, resolution)
-
-    def start_download():
-        loop.run_until_complete(download_task())
-        loop.close()
-        progress_bar.pack_forget()
-
-    threading.Thread(target=start_download).start()
-
-
-def download_video_stream(url: str, format_type: str, resolution: str) -> None:
-    match format_type:
-        case "mp4":
-            file_type = "video"
-        case "mp3":
-            file_type = "audio"
-        case _:
-            result_label.configure(text="Invalid format")
-            return
-    result_label.configure(text=f"Getting {file_type}...")
-    try:
-        video = YouTube(url, on_progress_callback=on_progress, on_complete_callback=on_complete)
-    except exceptions.RegexMatchError:
-        result_label.configure(text=f"No video found")
-        return
-    except exceptions:
-        result_label.configure(text=f"Error getting video")
+
+def on_url_change(*args) -> None:
+    """Prefetches the video while the url is entered, and resets the resolutions found for an earlier url."""
+    if resolution_choices:
+        show_resolutions({})
+    call_engine("prefetch", url_var.get().strip())
+
+
+def render_prefetch(result: dict) -> None:
+    """Shows what the prefetch of the entered url found: the video title, and the resolutions it has with their
+    file sizes in the resolution combobox."""
+    if result["url"] != url_var.get().strip():
+        return  # the url was changed since
+    if "error" in result:
+        result_label.configure(text=result["error"])
         return
-    stream = None
+    result_label.configure(text=f"Found '{result['title']}'")
+    choices = {}
+    for quality, resolution, size, audio in result["resolutions"]:
+        name = quality if audio else f"{quality} (muted)"  # a video-only stream, with no ffmpeg to mux in the audio
+        details = [resolution] if resolution != quality else []
+        details += [f"{size / 1024 / 1024:.1f} MB"] if size is not None else []
+        choices[f"{name} - {', '.join(details)}" if details else name] = quality
+    show_resolutions(choices)
+
+
+def show_resolutions(choices: dict) -> None:
+    """Fills the resolution combobox with choices (label -> resolution option), or all resolution options if empty,
+    keeping the selected resolution if it's still there."""
+    selected = resolution_choices.get(resolution_var.get(), resolution_var.get())
+    resolution_choices.clear()
+    resolution_choices.update(choices)
+    labels = list(choices) or resolution_names()
+    resolution_combo.configure(values=labels)
+    if format_var.get() == "mp4":
+        resolution_var.set(next((label for label in labels if choices.get(label, label) == selected), labels[0]))
+
+
+def cancel_selected_jobs() -> None:
+    for iid in queue_view.selection():
+        call_engine("cancel", int(iid))
+
+
+def pause_selected_jobs() -> None:
+    for iid in queue_view.selection():
+        call_engine("pause", int(iid))
+
+
+def resume_selected_jobs() -> None:
+    for iid in queue_view.selection():
+        call_engine("resume", int(iid))
+
+
+def show_job_menu(event: tk.Event) -> None:
+    """Opens the queue view's context menu on the clicked job, selecting it first if it isn't selected."""
+    iid = queue_view.identify_row(event.y)
+    if iid and iid not in queue_view.selection():
+        queue_view.selection_set(iid)
+    job_menu.tk_popup(event.x_root, event.y_root)
+
+
+def set_selected_priority(priority: str) -> None:
+    for iid in queue_view.selection():
+        call_engine("set_priority", int(iid), priority)
+
+
+def ask_rate(title: str, prompt: str) -> tuple[bool, Optional[int]]:
+    """Asks for a rate like 500K or 2M, empty for no limit. Returns whether one was given, and the rate."""
+    answer = simpledialog.askstring(title, prompt + " (e.g. 500K, 2M, empty for no limit):", parent=root)
+    if answer is None:
+        return False, None
     try:
-        if format_type == "mp4":
-            stream = get_mp4_stream(video, resolution)
-        elif format_type == "mp3":
-            stream = video.streams.get_audio_only()
-        else:
-            result_label.configure(text="Invalid format")
-    except exceptions.AgeRestrictedError:
-        result_label.configure(text="Download failed, video is age restricted")
-        return
-    except exceptions.RegexMatchError:
-        result_label.configure(text="Download failed, unknown RegexMatchError")
-        return
-    except exceptions.VideoUnavailable:
-        result_label.configure(text="Download failed, video is unavailable")
-        return
-    if stream is None:  # no stream gotten
-        result_label.configure(text=f"No stream found in {resolution}")
-    else:
-        stream.download(DOWNLOAD_PATH, filename=stream.default_filename.replace("mp4", format_type))
+        return True, parse_rate(answer)
+    except ValueError as e:
+        messagebox.showerror(title, str(e))
+        return False, None
 
 
-def get_mp4_stream(video: YouTube, quality: str) -> Stream:
-    if quality == "Max (w/ audio)":
-        return video.streams.get_highest_resolution()
-    else:
-        return video.streams.get_by_resolution(quality)
+def limit_selected_jobs() -> None:
+    given, rate = ask_rate("Limit speed", "Speed limit of the selected downloads")
+    if given:
+        for iid in queue_view.selection():
+            call_engine("set_rate_limit", int(iid), rate)
+
+
+def limit_total_speed() -> None:
+    given, rate = ask_rate("Total speed limit", "Speed limit of all downloads together")
+    if given:
+        call_engine("set_total_rate", rate)
+
+
+def resolution_names() -> list[str]:
+    """Returns the resolution options, and the names of the stream profiles in the config."""
+    return RESOLUTIONS + list(config.get("stream_profiles") or {})
 
 
 def on_format_select(*args) -> None:
     selected_format = format_var.get()
     if selected_format == "mp4":
         resolution_combo.configure(state="readonly")
-        resolution_var.set("Max (w/ audio)")
+        resolution_var.set(next((label for label, quality in resolution_choices.items() if quality == MAX_PROGRESSIVE),
+                                MAX_PROGRESSIVE))
     else:
         resolution_combo.configure(state="disabled")
         resolution_var.set("")  # Clear the resolution selection
 
 
-def file_exists(filename: str) -> bool:
-    """Checks if a file exists."""
-    try:
-        with open(filename, "r"):
-            pass
-        return True
-    except FileNotFoundError:
-        return False
+def change_download_folder() -> None:
+    """Changes the download folder, in the config of the engine once there is one: the daemon keeps a config of
+    its own, which would be overwritten by this window's if both were set."""
+    filepath = filedialog.askdirectory(title=DOWNLOAD_FOLDER_TITLE)
+    if filepath:
+        if engine is not None:
+            call_engine("set_download_path", filepath)
+        else:
+            config.set("download_path", filepath)
 
 
-def get_json_data(key: str, file: str = CONFIG_JSON_PATH) -> str:
-    """Extracts string value from given datakey from a given .json filename. Defaults to discord_data.json"""
-    if not file_exists(file):
+def ask_download_folder() -> None:
+    """Asks for the download folder until one is chosen, or quits if the user gives up, since there is nowhere to
+    save downloads without one."""
+    while not config.get("download_path"):
         change_download_folder()
-    with open(file, "r") as infile:
-        data = json.load(infile)
-    return data[key]
+        if not config.get("download_path") and not messagebox.askretrycancel(
+                DOWNLOAD_FOLDER_TITLE, "Downloads need a folder to be saved in."):
+            root.destroy()
+            sys.exit()
 
 
-def set_json_data(key: str, value: str, file: str = CONFIG_JSON_PATH) -> None:
-    """Sets a key and value in a given .json filename. Defaults to discord_data.json"""
-    with open(file, "r") as infile:
-        data = json.load(infile)
-    data[key] = value
-    with open(file, "w") as outfile:
-        json.dump(data, outfile, indent=3)
+def offer_resume() -> None:
+    """Asks to resume the interrupted downloads left in the download folder, and queues them if so."""
+    partials = call_engine("partial_downloads")
+    if not partials:
+        return
+    if messagebox.askyesno("Resume downloads", f"Resume {len(partials)} interrupted download(s)?"):
+        for partial in partials:
+            call_engine("submit", partial["url"], partial["format_type"], partial["resolution"])
 
 
-def change_download_folder() -> None:
-    """Changes the download folder."""
-    filepath = filedialog.askdirectory(title=DOWNLOAD_FOLDER_TITLE)
-    if filepath:
-        set_json_data("download_path", filepath)
-
-
-def on_progress(stream, chunk, bytes_remaining) -> None:
-    """Function on download progress callback event in get_stream().
-    It updates result label and the progress bar."""
-    progress_bar.pack()
-    total_size = stream.filesize
-    bytes_downloaded = total_size - bytes_remaining
-    percent = int(round(bytes_downloaded / total_size * 100, 0))
-    result_label.configure(text=f"Downloading {stream.type}... {percent}%")
-    result_label.update()
-    progress_bar["value"] = float(percent)
-    progress_bar.update()
-
-
-def on_complete(stream, file_handle) -> None:
-    """Function on download complete callback event in get_stream().
-    It updates result label and hides the progress bar."""
-    max_chars = 80
-    # max_chars = 68
-    title = stream.title
-    match stream.type:
-        case "video":
-            text = f"Downloaded '{title}.mp4' in {stream.resolution}!"
-            if len(text) > max_chars:  # video title too long
-                chars = len(text) - max_chars - 4
-                text = f"Downloaded '{title[:chars]}... .mp4' in {stream.resolution}!"
-        case "audio":
-            text = f"Downloaded '{title}.mp3' with bitrate {stream.bitrate}!"
-            if len(text) > max_chars:  # video title too long
-                chars = len(text) - max_chars - 4
-                text = f"Downloaded '{title[:chars]}... .mp3' with bitrate {stream.bitrate}!"
-        case _:
-            text = f"Downloaded '{title}'!"
-            if len(text) > max_chars:  # video title too long
-                text = text[:max_chars] + "..."
-
-    result_label.configure(text=text)
-    progress_bar.pack_forget()
+def poll_progress() -> None:
+    """Renders the latest state of every job that changed since the last poll, then schedules the next poll.
+    Runs on the Tk main loop, so the download threads never touch the widgets themselves."""
+    try:
+        for job in progress_channel.drain().values():
+            # Jobs of an engine of its own, dicts of a daemon
+            render_job(job.to_dict() if isinstance(job, Job) else job)
+        for result in prefetch_channel.drain().values():
+            render_prefetch(result)
+    finally:
+        root.after(1000 // PROGRESS_FPS, poll_progress)
+
+
+def open_stats() -> None:
+    """Opens the live stats panel with the phase timings of every job, or raises it if it's already open."""
+    global stats_view
+    if stats_view is not None:
+        stats_view.winfo_toplevel().lift()
+        return
+    window = tk.Toplevel(root)
+    window.title("Download stats")
+    stats_view = ttk.Treeview(window, columns=STATS_COLUMNS, show="headings", height=12)
+    for column in STATS_COLUMNS:
+        stats_view.heading(column, text=column.replace("_", " ").capitalize())
+        stats_view.column(column, width=70, anchor="e")
+    stats_view.column("job", width=200, anchor="w")
+    stats_view.pack(fill="both", expand=True)
+    ttk.Label(window, name="connections").pack(anchor="w", padx=5, pady=2)
+    window.protocol("WM_DELETE_WINDOW", close_stats)
+    for job in call_engine("list_jobs") or []:
+        render_job_stats(job)
+    poll_connection_stats()
+
+
+def close_stats() -> None:
+    global stats_view
+    stats_view.winfo_toplevel().destroy()
+    stats_view = None
+    root.after_cancel(connection_stats_poll)
+
+
+def poll_connection_stats() -> None:
+    """Shows the connection pool stats in the stats panel while it's open, once every CONNECTION_STATS_INTERVAL,
+    which is much less often than progress is drawn, since a daemon is asked for them over HTTP."""
+    global connection_stats_poll
+    try:
+        render_connection_stats()
+    finally:
+        connection_stats_poll = root.after(CONNECTION_STATS_INTERVAL, poll_connection_stats)
+
+
+def render_connection_stats() -> None:
+    pool_stats = call_engine("connection_stats")
+    if pool_stats is None or stats_view is None:
+        return
+    stats_view.winfo_toplevel().nametowidget("connections").configure(
+        text=f"Connections: {pool_stats['open']} open, {pool_stats['idle']} idle, "
+             f"{pool_stats['hit_rate']:.0%} of {pool_stats['requests']} requests reused one")
+
+
+def render_job_stats(job: dict) -> None:
+    """Updates the job's row in the stats panel, from Job.to_dict()."""
+    metrics = job["metrics"]
+    if metrics is None:
+        return
+    values = (job["title"] or job["url"], metrics["phase"] or metrics["state"] or "",
+              *(f"{metrics['phases'][phase]:.2f}s" for phase in STATS_COLUMNS[2:7]),
+              f"{metrics['bytes_per_second'] / 1024 / 1024:.1f} MB/s", metrics["retries"])
+    if stats_view.exists(job["id"]):
+        stats_view.item(job["id"], values=values)
+    else:
+        stats_view.insert("", "end", iid=job["id"], values=values)
+
+
+def render_job(job: dict) -> None:
+    """Updates the job's row in the queue view, the result label and the progress bar, from Job.to_dict()."""
+    state = f"{job['state']} {job['percent']}%" if job["state"] == DOWNLOADING else job["state"]
+    if job["priority"] != NORMAL and job["state"] not in FINISHED_STATES:
+        state += f" ({job['priority']})"
+    values = (job["title"] or job["url"], state)
+    if queue_view.exists(job["id"]):
+        queue_view.item(job["id"], values=values)
+    else:
+        queue_view.insert("", "end", iid=job["id"], values=values)
+    result_label.configure(text=job["message"])
+    if job["state"] == DOWNLOADING:
+        progress_bar.grid(column=col, row=8)
+        progress_bar["value"] = float(job["percent"])
+    elif job["state"] in FINISHED_STATES or job["state"] == PAUSED:
+        progress_bar.grid_remove()
+    if stats_view is not None:
+        render_job_stats(job)
 
 
 root = tk.Tk()
-root.tk.call("source", get_absolute_path("data\\Azure-ttk-theme-2.1.0\\azure.tcl"))
+root.tk.call("source", THEME_PATH)
 root.tk.call("set_theme", "dark")
 root.resizable(False, False)
 root.title("YouTube Downloader")
 root.iconbitmap(ICON_IMAGE_PATH)
 
-# Check if download path is set, if not, ask for it
-if file_exists(CONFIG_JSON_PATH):
-    with open(CONFIG_JSON_PATH, "r") as f:
-        DOWNLOAD_PATH = get_json_data("download_path")
-else:
-    DOWNLOAD_PATH = filedialog.askdirectory(title=DOWNLOAD_FOLDER_TITLE)
-    with open(CONFIG_JSON_PATH, "w") as f:
-        json.dump({"download_path": DOWNLOAD_PATH}, f)
-
 # Styling
 style = ttk.Style().configure(
         "Red.TLabel", foreground="red", font=("Arial", 10, "bold")
@@ -219,7 +338,9 @@ col = 0
 url_label = ttk.Label(root, text="URL:")
 url_label.grid(column=col, row=0)
 
-url_entry = ttk.Entry(root, width=35)
+url_var = tk.StringVar()
+url_var.trace_add("write", on_url_change)
+url_entry = ttk.Entry(root, width=35, textvariable=url_var)
 url_entry.grid(column=col, row=1, padx=10)
 
 # Format selection
@@ -228,7 +349,7 @@ format_label.grid(column=col, row=2)
 
 format_var = tk.StringVar()
 format_var.set("mp4")
-format_combo = ttk.Combobox(root, textvariable=format_var, values=["mp4", "mp3"], state="readonly")
+format_combo = ttk.Combobox(root, textvariable=format_var, values=FORMATS, state="readonly")
 format_combo.grid(column=col, row=3)
 
 format_var.trace("w", on_format_select)
@@ -238,9 +359,9 @@ resolution_label = ttk.Label(root, text="Resolution:")
 resolution_label.grid(column=col, row=4)
 
 resolution_var = tk.StringVar()
-resolution_var.set("Max (w/ audio)")
-resolution_combo = ttk.Combobox(root, textvariable=resolution_var,
-                                values=["Max (w/ audio)", "1080p (muted)", "720p", "480p", "360p"])
+resolution_var.set(MAX_PROGRESSIVE)
+resolution_choices = {}  # combobox label -> resolution option, for the resolutions the entered video has
+resolution_combo = ttk.Combobox(root, textvariable=resolution_var, values=RESOLUTIONS)
 resolution_combo.grid(column=col, row=5, pady=5)
 
 # Download button
@@ -252,16 +373,58 @@ result_label.grid(column=col, row=7)
 
 # Download progress bar
 progress_bar = ttk.Progressbar(root, orient="horizontal", length=WINDOW_WIDTH * 0.8)
-# dont pack yet
+# dont grid yet
+
+# Download queue view
+queue_view = ttk.Treeview(root, columns=("title", "state"), show="headings", height=6)
+queue_view.heading("title", text="Video")
+queue_view.heading("state", text="Status")
+queue_view.column("title", width=int(WINDOW_WIDTH * 0.6))
+queue_view.column("state", width=int(WINDOW_WIDTH * 0.3))
+queue_view.grid(column=col, row=9, pady=5)
+queue_view.bind("<Button-3>", show_job_menu)
+
+job_menu = tk.Menu(root, tearoff=False)
+priority_menu = tk.Menu(job_menu, tearoff=False)
+for priority in PRIORITIES:
+    priority_menu.add_command(label=priority.capitalize(), command=lambda p=priority: set_selected_priority(p))
+job_menu.add_cascade(label="Priority", menu=priority_menu)
+job_menu.add_command(label="Limit speed...", command=limit_selected_jobs)
+job_menu.add_command(label="Total speed limit...", command=limit_total_speed)
+job_menu.add_separator()
+job_menu.add_command(label="Pause", command=pause_selected_jobs)
+job_menu.add_command(label="Resume", command=resume_selected_jobs)
+job_menu.add_command(label="Cancel", command=cancel_selected_jobs)
+
+cancel_button = ttk.Button(root, text="Cancel selected", command=cancel_selected_jobs)
+cancel_button.grid(column=col, row=10)
+
+stats_button = ttk.Button(root, text="Stats", command=open_stats)
+stats_button.grid(column=col, row=10, sticky="e", padx=10)
+stats_view = None  # the stats panel's Treeview, while it's open
+connection_stats_poll = None  # the after() id of the next poll_connection_stats(), while the stats panel is open
 
 # Initialize resolution combo box state
 resolution_combo.configure(state="readonly")
 
 # Change download folder button
-folder_photo_image = tk.PhotoImage(file=FOLDER_IMAGE_PATH).subsample(FOLDER_IMAGE_SUBSAMPLE[0],
-                                                                     FOLDER_IMAGE_SUBSAMPLE[1])
+folder_photo_image = tk.PhotoImage(file=FOLDER_IMAGE_PATH)
 folder_button = ttk.Button(root, image=folder_photo_image, command=change_download_folder)
 folder_button.grid(column=col, row=6, sticky="e", padx=48)
+
+progress_channel = ProgressChannel()
+prefetch_channel = ProgressChannel()  # what prefetches of the entered url found, by url
+engine = None  # see get_engine()
+root.update()  # first paint, before any config or file system work
+
+# Check if download path is set, if not, ask for it
+config = Config(CONFIG_JSON_PATH)
+atexit.register(config.flush)
+ask_download_folder()
+resolution_combo.configure(values=resolution_names())
+
+poll_progress()
+root.after_idle(offer_resume)
 if __name__ == "__main__":
     root.mainloop()
 
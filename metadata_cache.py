@@ -0,0 +1,119 @@
+import json
+import os
+import threading
+import time
+from typing import Callable, Optional
+from urllib.parse import parse_qs, urlsplit
+
+from pytube import YouTube, Stream, StreamQuery, extract
+from pytube.monostate import Monostate
+
+DEFAULT_MAX_CACHE_SIZE = 16 * 1024 * 1024  # bytes
+URL_EXPIRY_MARGIN = 10 * 60  # seconds, entries expire this long before their signed urls do
+DEFAULT_TTL = 60 * 60  # seconds, for entries whose urls have no expire parameter
+STREAM_KEYS = ("url", "itag", "mimeType", "is_otf", "bitrate", "contentLength", "fps", "qualityLabel")
+
+
+class MetadataCache:
+    """Disk-backed cache of video titles and stream manifests (with signed urls), keyed by video id.
+
+    Every entry is a json file in folder. Entries expire shortly before their signed urls do, and the least
+    recently used entries are evicted when the folder grows past max_size bytes.
+    """
+
+    def __init__(self, folder: str, max_size: int = DEFAULT_MAX_CACHE_SIZE) -> None:
+        self.folder = folder
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    def _path(self, video_id: str) -> str:
+        return os.path.join(self.folder, f"{video_id}.json")
+
+    def get(self, video_id: str) -> Optional[dict]:
+        """Returns the fresh cache entry of a video, or None."""
+        path = self._path(video_id)
+        try:
+            with open(path, "r") as infile:
+                entry = json.load(infile)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if entry.get("expires", 0) <= time.time():
+            self._remove(path)
+            return None
+        try:
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:
+            pass
+        return entry
+
+    def put(self, video_id: str, entry: dict) -> None:
+        path = self._path(video_id)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w") as outfile:
+            json.dump(entry, outfile)
+        os.replace(temp_path, path)
+        self._evict()
+
+    def discard(self, video_id: str) -> None:
+        """Drops a video's entry, e.g. when its stream urls stopped working before they were due to expire."""
+        self._remove(self._path(video_id))
+
+    def _evict(self) -> None:
+        """Removes the least recently used entries until the cache fits in max_size."""
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.folder):
+                if name.endswith(".json"):
+                    try:
+                        stat = os.stat(os.path.join(self.folder, name))
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, name))
+            total_size = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total_size <= self.max_size:
+                    break
+                self._remove(os.path.join(self.folder, name))
+                total_size -= size
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class CachedVideo:
+    """Stands in for a pytube YouTube object, built from a metadata cache entry without any network round trip."""
+
+    def __init__(self, entry: dict, on_progress_callback: Optional[Callable] = None,
+                 on_complete_callback: Optional[Callable] = None) -> None:
+        self.video_id = entry["video_id"]
+        self.title = entry["title"]
+        self.length = entry["length"]
+        self.stream_monostate = Monostate(on_progress=on_progress_callback, on_complete=on_complete_callback,
+                                          title=self.title, duration=self.length)
+        self.streams = StreamQuery([Stream(stream=stream, monostate=self.stream_monostate)
+                                    for stream in entry["streams"]])
+
+
+def video_entry(video: YouTube) -> dict:
+    """Builds a metadata cache entry from a resolved video. Resolves the stream manifest if it isn't yet."""
+    video.streams  # makes pytube decipher the signed urls of the streaming data
+    streams = [{key: stream[key] for key in STREAM_KEYS if key in stream}
+               for stream in extract.apply_descrambler(video.streaming_data)]
+    return {
+        "video_id": video.video_id,
+        "title": video.title,
+        "length": video.length,
+        "streams": streams,
+        "expires": min((url_expiry(stream["url"]) for stream in streams), default=time.time()) - URL_EXPIRY_MARGIN,
+    }
+
+
+def url_expiry(url: str) -> float:
+    """Returns the unix time a signed stream url expires at."""
+    expire = parse_qs(urlsplit(url).query).get("expire")
+    return float(expire[0]) if expire else time.time() + DEFAULT_TTL
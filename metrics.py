@@ -0,0 +1,160 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from http_pool import ConnectionPool
+
+PHASES = ("resolve", "select", "connect", "transfer", "post_process")
+METRIC_PREFIX = "ytdl"
+
+
+class JobMetrics:
+    """Timings of the phases of one download job, and the bytes it transferred.
+
+    resolve and select are timed with phase(). The download phases are derived from when bytes arrive: connect runs
+    from start_download() to the first byte, transfer from the first to the last byte, and post_process from the
+    last byte to finish() (muxing, the end of mp3 encoding, indexing).
+    """
+
+    def __init__(self, job_id: int, url: str, format_type: str) -> None:
+        self.job_id = job_id
+        self.url = url
+        self.format_type = format_type
+        self.started = time.time()
+        self.phases = dict.fromkeys(PHASES, 0.0)  # phase -> seconds
+        self.phase_name = None  # the phase the job is in now
+        self.bytes = 0
+        self.retries = 0
+        self.state = None
+        self._download_start = None
+        self._first_byte = None
+        self._last_byte = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str):
+        self.phase_name = name
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] += time.perf_counter() - start
+
+    def start_download(self) -> None:
+        self.phase_name = "connect" if self._first_byte is None else "transfer"
+        if self._download_start is None:  # a retried download is timed from its first attempt
+            self._download_start = time.perf_counter()
+
+    def add_bytes(self, count: int) -> None:
+        """Counts downloaded bytes, called from the progress callbacks of every download thread of the job."""
+        now = time.perf_counter()
+        with self._lock:
+            if self._first_byte is None:
+                self._first_byte = now
+                self.phase_name = "transfer"
+            self._last_byte = now
+            self.bytes += count
+
+    def add_retry(self) -> None:
+        with self._lock:
+            self.retries += 1
+
+    @property
+    def bytes_per_second(self) -> float:
+        """Transfer rate from the first to the last byte so far."""
+        if self._first_byte is None or self._last_byte == self._first_byte:
+            return 0.0
+        return self.bytes / (self._last_byte - self._first_byte)
+
+    def finish(self, state: str) -> bool:
+        """Closes the download phases with the job's final state. Returns False if the job was already finished."""
+        with self._lock:
+            if self.state is not None:
+                return False
+            self.state = state
+            self.phase_name = None
+            if self._download_start is not None:
+                now = time.perf_counter()
+                first_byte = self._first_byte or now
+                last_byte = self._last_byte or now
+                self.phases["connect"] = first_byte - self._download_start
+                self.phases["transfer"] = last_byte - first_byte
+                self.phases["post_process"] = now - last_byte
+            return True
+
+    def to_dict(self) -> dict:
+        return {"job_id": self.job_id, "url": self.url, "format": self.format_type, "state": self.state,
+                "started": self.started, "phases": {name: round(seconds, 6) for name, seconds in self.phases.items()},
+                "bytes": self.bytes, "bytes_per_second": round(self.bytes_per_second, 1), "retries": self.retries}
+
+
+class MetricsLog:
+    """Exports the metrics of finished jobs, as one JSON line per job appended to jsonl_path, and as totals in the
+    Prometheus text format in prometheus_path (rewritten atomically, for node_exporter's textfile collector), along
+    with the stats of connection_pool. Either path may be None to skip that export."""
+
+    def __init__(self, jsonl_path: Optional[str], prometheus_path: Optional[str],
+                 connection_pool: Optional[ConnectionPool] = None) -> None:
+        self.jsonl_path = jsonl_path
+        self.prometheus_path = prometheus_path
+        self.connection_pool = connection_pool
+        self._lock = threading.Lock()
+        self._jobs = {}  # state -> count
+        self._phase_seconds = dict.fromkeys(PHASES, 0.0)
+        self._bytes = 0
+        self._retries = 0
+        for path in (jsonl_path, prometheus_path):
+            if path:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def record(self, metrics: JobMetrics) -> None:
+        with self._lock:
+            self._jobs[metrics.state] = self._jobs.get(metrics.state, 0) + 1
+            for name, seconds in metrics.phases.items():
+                self._phase_seconds[name] += seconds
+            self._bytes += metrics.bytes
+            self._retries += metrics.retries
+            if self.jsonl_path:
+                with open(self.jsonl_path, "a") as outfile:
+                    outfile.write(json.dumps(metrics.to_dict()) + "\n")
+            if self.prometheus_path:
+                self._write_prometheus()
+
+    def _write_prometheus(self) -> None:
+        job_count = sum(self._jobs.values())
+        lines = [f"# HELP {METRIC_PREFIX}_jobs_total Finished download jobs by final state.",
+                 f"# TYPE {METRIC_PREFIX}_jobs_total counter"]
+        lines += [f'{METRIC_PREFIX}_jobs_total{{state="{state}"}} {count}' for state, count in self._jobs.items()]
+        lines += [f"# HELP {METRIC_PREFIX}_job_phase_seconds Time download jobs spent in each phase.",
+                  f"# TYPE {METRIC_PREFIX}_job_phase_seconds summary"]
+        for name, seconds in self._phase_seconds.items():
+            lines.append(f'{METRIC_PREFIX}_job_phase_seconds_sum{{phase="{name}"}} {seconds}')
+            lines.append(f'{METRIC_PREFIX}_job_phase_seconds_count{{phase="{name}"}} {job_count}')
+        lines += [f"# HELP {METRIC_PREFIX}_downloaded_bytes_total Bytes downloaded by finished jobs.",
+                  f"# TYPE {METRIC_PREFIX}_downloaded_bytes_total counter",
+                  f"{METRIC_PREFIX}_downloaded_bytes_total {self._bytes}",
+                  f"# HELP {METRIC_PREFIX}_retries_total Retried requests of finished jobs.",
+                  f"# TYPE {METRIC_PREFIX}_retries_total counter",
+                  f"{METRIC_PREFIX}_retries_total {self._retries}"]
+        if self.connection_pool:
+            pool_stats = self.connection_pool.stats()
+            lines += [f"# HELP {METRIC_PREFIX}_http_requests_total HTTP requests sent through the connection pool.",
+                      f"# TYPE {METRIC_PREFIX}_http_requests_total counter",
+                      f"{METRIC_PREFIX}_http_requests_total {pool_stats['requests']}",
+                      f"# HELP {METRIC_PREFIX}_http_reused_connections_total Requests sent on a kept-alive connection.",
+                      f"# TYPE {METRIC_PREFIX}_http_reused_connections_total counter",
+                      f"{METRIC_PREFIX}_http_reused_connections_total {pool_stats['reused']}",
+                      f"# HELP {METRIC_PREFIX}_http_pool_waits_total Requests that waited for the per-host limit.",
+                      f"# TYPE {METRIC_PREFIX}_http_pool_waits_total counter",
+                      f"{METRIC_PREFIX}_http_pool_waits_total {pool_stats['waits']}",
+                      f"# HELP {METRIC_PREFIX}_http_open_connections Open connections by host.",
+                      f"# TYPE {METRIC_PREFIX}_http_open_connections gauge"]
+            lines += [f'{METRIC_PREFIX}_http_open_connections{{host="{host}"}} {count}'
+                      for host, count in pool_stats["open_per_host"].items()]
+        temp_path = self.prometheus_path + ".tmp"
+        with open(temp_path, "w") as outfile:
+            outfile.write("\n".join(lines) + "\n")
+        os.replace(temp_path, self.prometheus_path)
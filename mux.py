@@ -0,0 +1,26 @@
+import os
+import shutil
+import subprocess
+from typing import Optional
+
+
+class MuxError(Exception):
+    """Raised when ffmpeg fails to mux a video and audio stream."""
+
+
+def find_ffmpeg() -> Optional[str]:
+    return shutil.which("ffmpeg")
+
+
+def mux(video_path: str, audio_path: str, output_path: str, ffmpeg: Optional[str] = None) -> None:
+    """Muxes a video-only and an audio-only file into output_path by copying both streams, without re-encoding."""
+    ffmpeg = ffmpeg or find_ffmpeg()
+    if ffmpeg is None:
+        raise MuxError("ffmpeg not found")
+    command = [ffmpeg, "-y", "-loglevel", "error", "-i", video_path, "-i", audio_path,
+               "-map", "0:v:0", "-map", "1:a:0", "-c", "copy", output_path]
+    result = subprocess.run(command, stdin=subprocess.DEVNULL, capture_output=True, text=True)
+    if result.returncode != 0:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise MuxError(result.stderr.strip() or f"ffmpeg exited with code {result.returncode}")
@@ -0,0 +1,132 @@
+import glob
+import json
+import os
+import pickle
+import re
+import threading
+import time
+from typing import Optional
+
+import pytube
+from pytube import YouTube, extract, request
+from pytube.cipher import Cipher
+
+PLAYER_VERSION_PATTERN = re.compile(r"/s/player/([\w-]+)/")
+PARSE_TIMES_FILENAME = "parse_times.jsonl"
+
+
+class PlayerCache:
+    """Disk cache of the player base.js and the decipher/throttling transforms pytube parses out of it,
+    keyed by player version.
+
+    The parsed Cipher is pickled, so the regex parsing of base.js runs once per player version instead of once per
+    YouTube object, and survives restarts. Seeing a new player version removes the files of the old ones. Every parse
+    is timed and appended to parse_times.jsonl, so regressions in the parsing show up.
+    """
+
+    def __init__(self, folder: str) -> None:
+        self.folder = folder
+        self._js_versions = {}  # js source -> player version
+        self._ciphers = {}  # player version -> pickled Cipher
+        self._lock = threading.Lock()
+        self._fetch_locks = {}  # player version -> lock held while its base.js is read or fetched
+        os.makedirs(folder, exist_ok=True)
+
+    def _path(self, version: str, extension: str) -> str:
+        return os.path.join(self.folder, f"{version}.{extension}")
+
+    def load_js(self, js_url: str) -> str:
+        """Returns the base.js source of a player, from disk if this player version has been seen before.
+
+        Workers loading the same new version at once wait for the first one's fetch instead of each fetching it.
+        """
+        version = player_version(js_url)
+        with self._lock:
+            fetch_lock = self._fetch_locks.setdefault(version, threading.Lock())
+        with fetch_lock:
+            js = self._read_js(version)
+            if js is None:
+                js = request.get(js_url)
+                self._prune(keep=version)
+                with open(self._path(version, "js"), "w", encoding="utf-8") as outfile:
+                    outfile.write(js)
+            with self._lock:
+                self._js_versions[js] = version
+        return js
+
+    def _read_js(self, version: str) -> Optional[str]:
+        with self._lock:
+            for js, js_version in self._js_versions.items():
+                if js_version == version:
+                    return js
+        try:
+            with open(self._path(version, "js"), "r", encoding="utf-8") as infile:
+                return infile.read()
+        except FileNotFoundError:
+            return None
+
+    def cipher(self, js: str) -> Cipher:
+        """Returns a new Cipher for a base.js source, unpickled from the cache when its player version is known.
+
+        A new instance is returned every time, since pytube's Cipher keeps per-video state.
+        """
+        with self._lock:
+            version = self._js_versions.get(js)
+            if version is None:  # not loaded through load_js, so there is no version to cache it by
+                return Cipher(js=js)
+            if version not in self._ciphers:
+                self._ciphers[version] = self._read_cipher(version) or self._parse_cipher(version, js)
+            return pickle.loads(self._ciphers[version])
+
+    def _read_cipher(self, version: str) -> Optional[bytes]:
+        try:
+            with open(self._path(version, "cipher"), "rb") as infile:
+                pickled = infile.read()
+            pickle.loads(pickled)  # pickled by another pytube version, if this fails
+        except FileNotFoundError:
+            return None
+        except Exception:
+            os.remove(self._path(version, "cipher"))
+            return None
+        return pickled
+
+    def _parse_cipher(self, version: str, js: str) -> bytes:
+        start = time.perf_counter()
+        pickled = pickle.dumps(Cipher(js=js))
+        parse_time = time.perf_counter() - start
+        with open(self._path(version, "cipher"), "wb") as outfile:
+            outfile.write(pickled)
+        with open(os.path.join(self.folder, PARSE_TIMES_FILENAME), "a") as outfile:
+            outfile.write(json.dumps({"version": version, "parse_time": parse_time, "time": time.time()}) + "\n")
+        return pickled
+
+    def _prune(self, keep: str) -> None:
+        """Removes the cached files and transforms of every player version except keep."""
+        with self._lock:
+            for path in glob.glob(os.path.join(glob.escape(self.folder), "*.js")) + \
+                    glob.glob(os.path.join(glob.escape(self.folder), "*.cipher")):
+                if os.path.splitext(os.path.basename(path))[0] != keep:
+                    os.remove(path)
+            self._ciphers = {version: cipher for version, cipher in self._ciphers.items() if version == keep}
+            self._js_versions = {js: version for js, version in self._js_versions.items() if version == keep}
+            self._fetch_locks = {version: lock for version, lock in self._fetch_locks.items() if version == keep}
+
+    def install(self) -> None:
+        """Makes pytube load base.js and build its Cipher through this cache."""
+        cache = self
+
+        def js(video: YouTube) -> str:
+            if not video._js:
+                video._js = cache.load_js(video.js_url)
+                pytube.__js__ = video._js
+                pytube.__js_url__ = video.js_url
+            return video._js
+
+        YouTube.js = property(js)
+        extract.Cipher = self.cipher
+
+
+def player_version(js_url: str) -> str:
+    """Returns the player version of a base.js url, e.g. '/s/player/4248d311/player_ias.vflset/en_US/base.js'."""
+    match = PLAYER_VERSION_PATTERN.search(js_url)
+    return match.group(1) if match else re.sub(r"\W", "_", js_url)
@@ -0,0 +1,69 @@
+import threading
+from typing import Callable, Optional
+
+PREFETCH_DELAY = 0.4  # seconds a url must stay unchanged before it's resolved, so typing doesn't resolve every key
+
+
+class PrefetchSuperseded(Exception):
+    """Raised inside a prefetch that a newer one has replaced, to stop it at its next step."""
+
+
+class Prefetcher:
+    """Resolves the url asked for last in the background, ahead of its download.
+
+    request() waits for the url to stay the same for delay seconds before resolving it, and every request
+    supersedes the ones before it. resolve(url, check_current) does the work in steps, calling check_current() between
+    them, which raises PrefetchSuperseded once the prefetch is stale. Only the result of a prefetch that is still
+    current is passed to on_done(url, result), on the prefetch's thread.
+    """
+
+    def __init__(self, resolve: Callable[[str, Callable[[], None]], dict],
+                 on_done: Optional[Callable[[str, dict], None]] = None, delay: float = PREFETCH_DELAY) -> None:
+        self.resolve = resolve
+        self.on_done = on_done
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._timer = None
+        self._running = {}  # url -> event set when its prefetch is finished
+
+    def request(self, url: Optional[str]) -> None:
+        """Prefetches url after the delay, or only cancels the current prefetch if url is None."""
+        with self._lock:
+            self._generation += 1
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if url:
+                self._timer = threading.Timer(self.delay, self._prefetch, (url, self._generation))
+                self._timer.daemon = True
+                self._timer.start()
+
+    def wait(self, url: str, timeout: Optional[float] = None) -> None:
+        """Waits for a running prefetch of url to finish, so its result is cached before it's resolved again."""
+        with self._lock:
+            finished = self._running.get(url)
+        if finished is not None:
+            finished.wait(timeout)
+
+    def _check_current(self, generation: int) -> None:
+        if generation != self._generation:
+            raise PrefetchSuperseded()
+
+    def _prefetch(self, url: str, generation: int) -> None:
+        finished = threading.Event()
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._running[url] = finished
+        try:
+            result = self.resolve(url, lambda: self._check_current(generation))
+        except PrefetchSuperseded:
+            return
+        finally:
+            with self._lock:
+                if self._running.get(url) is finished:
+                    del self._running[url]
+            finished.set()
+        if self.on_done and generation == self._generation:
+            self.on_done(url, result)
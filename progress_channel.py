@@ -0,0 +1,25 @@
+import threading
+from typing import Any, Hashable
+
+
+class ProgressChannel:
+    """Thread-safe channel for progress events from download threads to the UI thread.
+
+    Publishing never blocks on the UI, and events are coalesced per key, so draining returns only the latest event
+    published for each key since the last drain.
+    """
+
+    def __init__(self) -> None:
+        self._latest = {}
+        self._lock = threading.Lock()
+
+    def publish(self, key: Hashable, event: Any) -> None:
+        with self._lock:
+            self._latest.pop(key, None)  # move the key to the end, to keep the publishing order
+            self._latest[key] = event
+
+    def drain(self) -> dict:
+        """Returns the latest event of every key published since the last drain, in publishing order."""
+        with self._lock:
+            latest, self._latest = self._latest, {}
+        return latest
@@ -0,0 +1,16 @@
+import os
+import sys
+
+
+def get_absolute_path(relative_path: str) -> str:
+    """Get absolute path to resource, works for dev and for PyInstaller """
+    base_path = getattr(sys, '_MEIPASS', os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(base_path, relative_path)
+
+
+# kept apart from engine.py, so the GUI can draw its window before importing the download backend
+CONFIG_JSON_PATH = get_absolute_path("data/config.json")
+FORMATS = ["mp4", "mp3"]
+MAX_PROGRESSIVE = "Max (w/ audio)"  # highest resolution with video and audio in one stream, at most 720p
+BEST_QUALITY = "Best quality"  # highest resolution video stream, with the best audio stream muxed in
+RESOLUTIONS = [MAX_PROGRESSIVE, BEST_QUALITY, "2160p", "1440p", "1080p", "720p", "480p", "360p"]
@@ -0,0 +1,158 @@
+import http.client
+import random
+import socket
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Callable, Optional
+from urllib.error import HTTPError, URLError
+
+from pytube import exceptions
+
+from segmented import DiskSpaceError, RangeNotSupportedError, SegmentError
+
+RETRYABLE = "retryable"  # may work as it is after a while: dropped connections, timeouts, server errors
+EXPIRED = "expired"  # may work once the video is resolved again: the signed stream urls expired or were refused
+PERMANENT = "permanent"  # won't work however often it's tried
+
+RETRYABLE_STATUSES = (408, 425, 429, 500, 502, 503, 504)
+EXPIRED_STATUSES = (403, 410)
+RATE_LIMIT_STATUSES = (429, 503)
+DEFAULT_RETRY_ATTEMPTS = 5  # attempts after the first one
+RETRY_BASE_DELAY = 1.0  # seconds, the backoff of the first retry, doubling with every retry after it
+RETRY_MAX_DELAY = 60.0
+CIRCUIT_THRESHOLD = 3  # rate limited responses in a row that open a host's circuit
+CIRCUIT_COOLDOWN = 5.0  # seconds a host's circuit first stays open, doubling every time it opens again in a row
+CIRCUIT_MAX_COOLDOWN = 120.0
+WAIT_STEP = 0.2  # seconds between cancellation checks while waiting
+
+
+def classify_error(error: BaseException) -> str:
+    """Returns whether a failed attempt at a job is worth retrying: RETRYABLE, EXPIRED or PERMANENT."""
+    if isinstance(error, HTTPError):
+        if error.code in RETRYABLE_STATUSES:
+            return RETRYABLE
+        return EXPIRED if error.code in EXPIRED_STATUSES else PERMANENT
+    if isinstance(error, (exceptions.VideoUnavailable, exceptions.RegexMatchError, DiskSpaceError,
+                          RangeNotSupportedError)):
+        return PERMANENT  # unavailable includes age restricted, private, members only and region blocked videos
+    if isinstance(error, exceptions.PytubeError):
+        return EXPIRED  # unexpected watch page or player data
+    if isinstance(error, (URLError, ConnectionError, socket.timeout, http.client.HTTPException, SegmentError)):
+        return RETRYABLE  # URLError covers the failed connections of the pool and pytube's requests
+    return PERMANENT
+
+
+def error_message(error: BaseException) -> str:
+    """Describes why a job failed, for its message."""
+    if isinstance(error, exceptions.AgeRestrictedError):
+        return "Download failed, video is age restricted"
+    if isinstance(error, exceptions.VideoUnavailable):
+        return "Download failed, video is unavailable"
+    if isinstance(error, exceptions.RegexMatchError):
+        return "No video found"
+    if isinstance(error, HTTPError):
+        return f"Download failed, HTTP error {error.code} {error.reason}"
+    return f"Download failed, {error or type(error).__name__}"
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Returns the seconds a rate limited response asked to wait with its Retry-After header, if it did."""
+    value = error.headers.get("Retry-After") if isinstance(error, HTTPError) and error.headers else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter: the nth retry waits a random time of up to base_delay * 2 ** (n - 1)
+    seconds, at most max_delay, so jobs failing at the same moment don't retry at the same moment too."""
+
+    def __init__(self, attempts: int = DEFAULT_RETRY_ATTEMPTS, base_delay: float = RETRY_BASE_DELAY,
+                 max_delay: float = RETRY_MAX_DELAY) -> None:
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, retry: int, error: Optional[BaseException] = None) -> float:
+        """Seconds to wait before the retry-th retry (from 1) after error, at least as long as it asked for."""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (retry - 1)))
+        return min(self.max_delay, max(delay, retry_after(error) or 0.0))
+
+
+class CircuitBreaker:
+    """Per host circuit breaker, that holds back every worker's requests to a host that started rate limiting.
+
+    The connection pool passes it the status of every response. CIRCUIT_THRESHOLD rate limited responses in a row
+    open the host's circuit for a cooldown, during which wait() blocks. After the cooldown one caller is let through
+    to probe the host, the others wait another cooldown: the next success closes the circuit, and the next rate limited
+    response opens it again for twice as long.
+    """
+
+    def __init__(self, threshold: int = CIRCUIT_THRESHOLD, cooldown: float = CIRCUIT_COOLDOWN,
+                 max_cooldown: float = CIRCUIT_MAX_COOLDOWN) -> None:
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._lock = threading.Lock()
+        self._hosts = {}  # host -> _Circuit
+
+    def record(self, host: str, status: int) -> None:
+        if status in RATE_LIMIT_STATUSES:
+            with self._lock:
+                circuit = self._hosts.setdefault(host, _Circuit(self.cooldown))
+                circuit.failures += 1
+                now = time.monotonic()
+                if circuit.failures >= self.threshold and now >= circuit.open_until:  # not while it's open already
+                    circuit.open_until = now + circuit.cooldown
+                    circuit.probe_until = 0.0
+                    circuit.cooldown = min(self.max_cooldown, circuit.cooldown * 2)
+        elif status < 400 and host in self._hosts:
+            with self._lock:
+                self._hosts.pop(host, None)
+
+    def retry_in(self, host: str) -> float:
+        """Returns how long requests to host should wait, 0 if they can go ahead. Letting a request through to probe
+        the host holds the others back for another cooldown."""
+        with self._lock:
+            circuit = self._hosts.get(host)
+            if circuit is None or circuit.failures < self.threshold:
+                return 0.0
+            now = time.monotonic()
+            if now < max(circuit.open_until, circuit.probe_until):
+                return max(circuit.open_until, circuit.probe_until) - now
+            circuit.probe_until = now + circuit.cooldown / 2  # as long as the last opening, for the probe to finish
+            return 0.0
+
+    def wait(self, host: Optional[str], check_cancelled: Optional[Callable[[], None]] = None) -> float:
+        """Blocks while host's circuit is open, calling check_cancelled regularly. Returns the seconds waited."""
+        start = time.monotonic()
+        while host and (delay := self.retry_in(host)) > 0:
+            if check_cancelled:
+                check_cancelled()
+            time.sleep(min(delay, WAIT_STEP))
+        return time.monotonic() - start
+
+
+class _Circuit:
+    def __init__(self, cooldown: float) -> None:
+        self.failures = 0  # rate limited responses in a row
+        self.open_until = 0.0
+        self.probe_until = 0.0
+        self.cooldown = cooldown  # of the next opening
+
+
+def sleep_unless_cancelled(seconds: float, check_cancelled: Callable[[], None]) -> None:
+    """Sleeps, calling check_cancelled every WAIT_STEP seconds so a cancelled job stops waiting."""
+    deadline = time.monotonic() + seconds
+    while (remaining := deadline - time.monotonic()) > 0:
+        check_cancelled()
+        time.sleep(min(remaining, WAIT_STEP))
+    check_cancelled()
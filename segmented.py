@@ -0,0 +1,454 @@
+import errno
+import glob
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, Optional
+from pytube import Stream
+
+from http_pool import POOL
+
+DEFAULT_SEGMENT_COUNT = 4
+MIN_SEGMENT_SIZE = 1024 * 1024  # don't split files into segments smaller than 1MB
+CHUNK_SIZE = 64 * 1024  # the first read size of a range, reads then grow or shrink with the throughput
+MIN_CHUNK_SIZE = 16 * 1024
+MAX_CHUNK_SIZE = 1024 * 1024
+CHUNK_READ_TIME = 0.05  # seconds a read should take, so progress and cancellation stay responsive on slow links
+REQUEST_TIMEOUT = 30
+PART_EXTENSION = ".part"
+SIDECAR_EXTENSION = ".part.json"
+SIDECAR_FLUSH_INTERVAL = 1  # seconds
+LOCK_EXTENSION = ".part.lock"
+LOCK_STALE_AFTER = 120  # seconds without a sidecar flush after which a lock of a lost process is taken over
+
+
+class SegmentError(Exception):
+    """Raised when a byte range could not be fetched as requested."""
+
+
+class RangeNotSupportedError(SegmentError):
+    """Raised when a server answers a byte range request with the whole file, which no retry changes."""
+
+
+class PartInUseError(SegmentError):
+    """Raised when another download, of this process or another one, is writing the same .part file."""
+
+
+class DiskSpaceError(Exception):
+    """Raised when the download folder doesn't have room for a download, before it starts."""
+
+
+class AdaptiveChunkSize:
+    """Read size that follows the throughput of a connection: it doubles while reads take less than half of
+    CHUNK_READ_TIME, and halves when they take more than twice that, between MIN_CHUNK_SIZE and MAX_CHUNK_SIZE.
+
+    Fast links get few large reads, so less time goes to per-read overhead and progress callbacks, slow links
+    small reads, so progress, throttling and cancellation still react within about CHUNK_READ_TIME.
+    """
+
+    def __init__(self, size: int = CHUNK_SIZE) -> None:
+        self.size = size
+
+    def update(self, count: int, seconds: float) -> None:
+        """Adjusts the size after a read of count bytes that took seconds."""
+        if count < self.size:  # the end of the range, or a short read, says nothing about the throughput
+            return
+        if seconds < CHUNK_READ_TIME / 2:
+            self.size = min(self.size * 2, MAX_CHUNK_SIZE)
+        elif seconds > CHUNK_READ_TIME * 2:
+            self.size = max(self.size // 2, MIN_CHUNK_SIZE)
+
+
+if hasattr(os, "pwrite"):
+    pwrite = os.pwrite
+else:  # Windows has no positional writes, seek and write under a lock instead
+    _seek_lock = threading.Lock()
+
+    def pwrite(fd: int, data: memoryview, offset: int) -> int:
+        with _seek_lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            return os.write(fd, data)
+
+
+def write_at(fd: int, data: memoryview, offset: int) -> None:
+    """Writes all of data at offset in the file, without a shared file position, so segments can write at once."""
+    while data:
+        written = pwrite(fd, data, offset)
+        data = data[written:]
+        offset += written
+
+
+def preallocate(path: str, size: int) -> None:
+    """Creates the file at path with size bytes allocated on disk, in one extent where the file system allows, or
+    raises DiskSpaceError if the disk is too full for it."""
+    free = shutil.disk_usage(os.path.dirname(os.path.abspath(path))).free
+    if os.path.isfile(path):  # a stale .part file of another attempt, which is replaced
+        free += os.path.getsize(path)
+    if free < size:
+        raise DiskSpaceError(f"not enough disk space, {size / 1024 ** 2:.1f} MB needed, "
+                             f"{free / 1024 ** 2:.1f} MB free")
+    with open(path, "wb") as fh:
+        try:
+            os.posix_fallocate(fh.fileno(), 0, size)
+            return
+        except AttributeError:  # not on Windows or macOS, where truncate() allocates, or makes a sparse file
+            pass
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                fh.close()
+                os.remove(path)
+                raise DiskSpaceError(f"not enough disk space, {size / 1024 ** 2:.1f} MB needed") from e
+            if e.errno not in (errno.EINVAL, errno.EOPNOTSUPP):  # file systems without fallocate get a sparse file
+                raise
+        fh.truncate(size)
+
+
+_claimed_paths = set()
+_claimed_paths_lock = threading.Lock()
+
+
+class PartClaim:
+    """Exclusive claim on the .part file of a download, held from before it is preallocated or resumed until it is
+    finished or given up, so a second download of the same stream never truncates or renames a file in use.
+
+    Downloads of this process are told apart by a table of claimed paths, other processes (the daemon, spool
+    workers) by a lock file created with O_EXCL, which holds the host and pid of its owner. A lock file left
+    behind by a process that died is taken over: on this host once its pid is gone, from another host once it
+    hasn't been refreshed for LOCK_STALE_AFTER seconds.
+    """
+
+    def __init__(self, file_path: str) -> None:
+        self.file_path = file_path
+        self.lock_path = file_path + LOCK_EXTENSION
+        self._key = os.path.normcase(os.path.abspath(file_path))
+        self.held = False
+
+    def acquire(self) -> None:
+        """Takes the claim, or raises PartInUseError if another download holds it."""
+        with _claimed_paths_lock:
+            if self._key in _claimed_paths:
+                raise PartInUseError(f"{os.path.basename(self.file_path)} is being downloaded by another job")
+            _claimed_paths.add(self._key)
+        try:
+            self._create_lock_file()
+        except BaseException:
+            with _claimed_paths_lock:
+                _claimed_paths.discard(self._key)
+            raise
+        self.held = True
+
+    def _create_lock_file(self) -> None:
+        for _ in range(2):
+            try:
+                fd = os.open(self.lock_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+            except FileExistsError:
+                if not self._lock_is_stale():
+                    break
+                try:
+                    os.remove(self.lock_path)
+                except FileNotFoundError:
+                    pass
+                continue
+            with os.fdopen(fd, "w") as outfile:
+                json.dump({"host": socket.gethostname(), "pid": os.getpid()}, outfile)
+            return
+        raise PartInUseError(f"{os.path.basename(self.file_path)} is being downloaded by another process")
+
+    def _lock_is_stale(self) -> bool:
+        try:
+            with open(self.lock_path, "r") as infile:
+                owner = json.load(infile)
+            age = time.time() - os.path.getmtime(self.lock_path)
+        except FileNotFoundError:
+            return True
+        except (OSError, ValueError):  # half written by a process that is creating it right now
+            return False
+        if owner.get("host") == socket.gethostname():
+            if owner.get("pid") == os.getpid():  # this process holds no claim on it, so an earlier run left it
+                return True
+            if os.name != "nt":  # os.kill() terminates the process on Windows, which relies on the age below
+                try:
+                    os.kill(owner["pid"], 0)
+                except ProcessLookupError:
+                    return True
+                except (OSError, KeyError, TypeError):
+                    pass
+                else:
+                    return False
+        return age > LOCK_STALE_AFTER
+
+    def refresh(self) -> None:
+        """Marks the lock file as still in use, so other hosts don't take it over."""
+        try:
+            os.utime(self.lock_path)
+        except OSError:
+            pass
+
+    def release(self) -> None:
+        if not self.held:
+            return
+        self.held = False
+        try:
+            os.remove(self.lock_path)
+        except FileNotFoundError:
+            pass
+        with _claimed_paths_lock:
+            _claimed_paths.discard(self._key)
+
+    def __enter__(self) -> "PartClaim":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
+
+
+class PartialDownload:
+    """Keeps track of the finished byte ranges of a .part file and saves them to its sidecar .part.json file,
+    so an interrupted download of the same stream can be resumed.
+
+    It also combines the progress of all segments into the pytube style on_progress callback. The segments write
+    their chunks with write() through one file descriptor, open until close().
+    """
+
+    def __init__(self, stream: Stream, file_path: str, identity: dict, job_info: Optional[dict] = None,
+                 on_progress: Optional[Callable] = None, throttle: Optional[Callable[[int], None]] = None,
+                 claim: Optional[PartClaim] = None) -> None:
+        self.stream = stream
+        self.file_path = file_path
+        self.part_path = file_path + PART_EXTENSION
+        self.sidecar_path = file_path + SIDECAR_EXTENSION
+        self.identity = identity
+        self.job_info = job_info or {}
+        self.filesize = identity["filesize"]
+        self.on_progress = on_progress
+        self.throttle = throttle
+        self.claim = claim
+        self.aborted = threading.Event()
+        self.discarded = False
+        self.done = self._load_done_ranges()
+        self.fd = os.open(self.part_path, os.O_RDWR | getattr(os, "O_BINARY", 0))
+        self.bytes_remaining = self.filesize - sum(end - start + 1 for start, end in self.done)
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _load_done_ranges(self) -> list[list[int]]:
+        """Returns the finished ranges of a matching earlier attempt, or preallocates a new .part file. Raises
+        DiskSpaceError if there is no room for it."""
+        sidecar = read_sidecar(self.sidecar_path)
+        if (sidecar and all(sidecar.get(key) == value for key, value in self.identity.items())
+                and os.path.isfile(self.part_path) and os.path.getsize(self.part_path) == self.filesize):
+            return sidecar["done"]
+        preallocate(self.part_path, self.filesize)
+        return []
+
+    def missing_ranges(self) -> list[tuple[int, int]]:
+        """Returns the inclusive (start, end) byte ranges that are not downloaded yet."""
+        missing = []
+        position = 0
+        for start, end in self.done:
+            if start > position:
+                missing.append((position, start - 1))
+            position = end + 1
+        if position < self.filesize:
+            missing.append((position, self.filesize - 1))
+        return missing
+
+    def write(self, start: int, chunk: memoryview) -> None:
+        # unbuffered, so every range marked as done in the sidecar has actually been handed to the OS
+        write_at(self.fd, chunk, start)
+
+    def close(self) -> None:
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def add(self, start: int, chunk: memoryview) -> None:
+        """Marks a written chunk as done and reports the combined progress."""
+        with self._lock:
+            self._mark_done(start, start + len(chunk) - 1)
+            self.bytes_remaining -= len(chunk)
+            if time.monotonic() - self._last_flush >= SIDECAR_FLUSH_INTERVAL:
+                self._write_sidecar()
+            if self.on_progress:
+                self.on_progress(self.stream, chunk, self.bytes_remaining)
+
+    def _mark_done(self, start: int, end: int) -> None:
+        merged = []
+        for done_start, done_end in self.done:
+            if done_end + 1 < start or end + 1 < done_start:
+                merged.append([done_start, done_end])
+            else:
+                start, end = min(start, done_start), max(end, done_end)
+        merged.append([start, end])
+        self.done = sorted(merged)
+
+    def flush(self) -> None:
+        with self._lock:
+            if not self.discarded:
+                self._write_sidecar()
+
+    def discard(self) -> None:
+        """Removes the closed .part file and its sidecar, for a download that can't be resumed."""
+        with self._lock:
+            self.discarded = True
+        for path in (self.part_path, self.sidecar_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _write_sidecar(self) -> None:
+        # replaced at once, so a crash while it's written never leaves a sidecar that can't be read
+        temp_path = self.sidecar_path + ".tmp"
+        with open(temp_path, "w") as outfile:
+            json.dump({**self.job_info, **self.identity, "done": self.done}, outfile)
+        os.replace(temp_path, self.sidecar_path)
+        self._last_flush = time.monotonic()
+        if self.claim:
+            self.claim.refresh()
+
+    def finish(self) -> None:
+        """Moves the completed .part file to its final path and removes the sidecar."""
+        os.replace(self.part_path, self.file_path)
+        if os.path.exists(self.sidecar_path):
+            os.remove(self.sidecar_path)
+
+
+def read_sidecar(sidecar_path: str) -> Optional[dict]:
+    try:
+        with open(sidecar_path, "r") as infile:
+            return json.load(infile)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def discard_partial(file_path: str, with_file: bool = False) -> None:
+    """Removes the .part file and sidecar of a download that was given up on, and with_file the finished file too,
+    for temporary files like the halves of a muxed download. Files that another download claims are left alone."""
+    paths = [file_path + PART_EXTENSION, file_path + SIDECAR_EXTENSION] + ([file_path] if with_file else [])
+    try:
+        with PartClaim(file_path):
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
+    except PartInUseError:
+        pass
+
+
+def find_partial_downloads(folder: str) -> list[dict]:
+    """Returns the sidecar data of every interrupted download in a folder."""
+    partials = []
+    for sidecar_path in glob.glob(os.path.join(glob.escape(folder), "*" + SIDECAR_EXTENSION)):
+        sidecar = read_sidecar(sidecar_path)
+        if sidecar:
+            partials.append(sidecar)
+    return partials
+
+
+def split_ranges(ranges: list[tuple[int, int]], segment_count: int) -> list[tuple[int, int]]:
+    """Splits inclusive (start, end) byte ranges into about segment_count ranges of at least MIN_SEGMENT_SIZE."""
+    total = sum(end - start + 1 for start, end in ranges)
+    segment_size = max(MIN_SEGMENT_SIZE, -(-total // max(1, segment_count)))  # ceiling division
+    segments = []
+    for range_start, range_end in ranges:
+        for start in range(range_start, range_end + 1, segment_size):
+            segments.append((start, min(start + segment_size - 1, range_end)))
+    return segments
+
+
+def download_segmented(stream: Stream, output_path: str, filename: Optional[str] = None,
+                       segment_count: int = DEFAULT_SEGMENT_COUNT, on_progress: Optional[Callable] = None,
+                       video_id: Optional[str] = None, job_info: Optional[dict] = None,
+                       throttle: Optional[Callable[[int], None]] = None) -> str:
+    """Downloads a stream as parallel byte range requests written straight into a preallocated .part file.
+
+    The finished ranges are kept in a sidecar file, so a later download of the same stream (same video_id, itag
+    and filesize) resumes where this one stopped. job_info is saved in the sidecar as well, to be able to offer
+    the download for resume later. on_progress has the same signature as pytube's on_progress_callback and
+    gets the combined progress of all segments, its chunk is a view of a reused buffer, only valid during the
+    call. throttle is called with the size of every received chunk before
+    it is written, and may block to limit the download rate. Streams that can't be fetched by range fall back to
+    Stream.download(), unthrottled. Raises PartInUseError while another download writes the same file, which
+    retries turn into a wait. Returns the file path.
+    """
+    file_path = stream.get_file_path(filename=filename, output_path=output_path)
+    with PartClaim(file_path) as claim:
+        if stream.exists_at_path(file_path):  # checked under the claim, its last holder may have just finished it
+            stream.on_complete(file_path)
+            return file_path
+
+        filesize = stream.filesize
+        if stream.is_otf or not filesize:  # sequential (otf) streams can't be requested by byte range
+            return stream.download(output_path, filename=filename)
+
+        identity = {"video_id": video_id, "itag": stream.itag, "filesize": filesize}
+        partial = PartialDownload(stream, file_path, identity, job_info, on_progress, throttle, claim)
+        segments = split_ranges(partial.missing_ranges(), segment_count)
+        try:
+            if segments:
+                workers = min(len(segments), max(1, segment_count))
+                with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="segment") as pool:
+                    futures = [pool.submit(download_range, stream.url, start, end, partial)
+                               for start, end in segments]
+                    try:
+                        for future in futures:
+                            future.result()
+                    except BaseException:
+                        partial.aborted.set()
+                        raise
+        except RangeNotSupportedError:
+            partial.close()
+            partial.discard()
+            return stream.download(output_path, filename=filename)
+        finally:
+            partial.close()
+            partial.flush()
+        partial.finish()
+    stream.on_complete(file_path)
+    return file_path
+
+
+def download_range(url: str, start: int, end: int, partial: PartialDownload) -> None:
+    """Fetches the inclusive byte range start-end of url and writes it at the same offset in the .part file.
+    Reads go into one buffer, reused for the whole range, in sizes that follow the throughput."""
+    response = POOL.request("GET", url, headers={"Range": f"bytes={start}-{end}"}, timeout=REQUEST_TIMEOUT)
+    with response:
+        if response.status != 206 and start != 0:
+            raise RangeNotSupportedError(f"Server ignored range request for bytes {start}-{end}")
+        buffer = memoryview(bytearray(MAX_CHUNK_SIZE))
+        chunk_size = AdaptiveChunkSize()
+        position = start
+        while position <= end:
+            if partial.aborted.is_set():
+                return
+            read_start = time.perf_counter()
+            count = response.readinto(buffer[:min(chunk_size.size, end - position + 1)])
+            if not count:
+                raise SegmentError(f"Connection closed with {end - position + 1} bytes left in range {start}-{end}")
+            chunk_size.update(count, time.perf_counter() - read_start)
+            chunk = buffer[:count]
+            if partial.throttle:
+                partial.throttle(count)
+            partial.write(position, chunk)
+            partial.add(position, chunk)
+            position += count
+
+
+def iter_chunks(url: str, filesize: int, throttle: Optional[Callable[[int], None]] = None) -> Iterator[memoryview]:
+    """Yields the bytes of url in order as they arrive, passing the size of each chunk through throttle first.
+    Chunks are views of one reused buffer, valid until the next one is asked for, sized like download_range()'s."""
+    with POOL.request("GET", url, headers={"Range": f"bytes=0-{filesize - 1}"}, timeout=REQUEST_TIMEOUT) as response:
+        buffer = memoryview(bytearray(MAX_CHUNK_SIZE))
+        chunk_size = AdaptiveChunkSize()
+        while True:
+            read_start = time.perf_counter()
+            count = response.readinto(buffer[:chunk_size.size])
+            if not count:
+                return
+            chunk_size.update(count, time.perf_counter() - read_start)
+            if throttle:
+                throttle(count)
+            yield buffer[:count]
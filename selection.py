@@ -0,0 +1,138 @@
+from typing import Iterable, Optional
+
+from pytube import Stream
+
+from resources import MAX_PROGRESSIVE, BEST_QUALITY, RESOLUTIONS
+
+PROGRESSIVE_MODES = ("only", "prefer", "avoid")
+
+
+class Profile:
+    """Preferences for choosing a video's mp4 stream.
+
+    max_height caps the resolution, None for no cap. progressive is "only", "prefer" or "avoid" for streams with the
+    audio in them, over adaptive video-only streams that need the audio muxed in; "only" still falls back to adaptive
+    streams for videos without a progressive one. codecs lists the preferred video codecs first, e.g. ("avc1",), and
+    smallest picks the smallest file of equally good streams (same resolution and frame rate) instead of the one
+    with the highest bitrate.
+    """
+
+    def __init__(self, name: str, max_height: Optional[int] = None, progressive: str = "prefer",
+                 codecs: Iterable[str] = (), smallest: bool = False) -> None:
+        if progressive not in PROGRESSIVE_MODES:
+            raise ValueError(f"Invalid progressive mode '{progressive}' in stream profile '{name}'")
+        self.name = name
+        self.max_height = max_height
+        self.progressive = progressive
+        self.codecs = {codec: rank for rank, codec in enumerate(codecs)}  # codec -> rank, lower is preferred
+        self.smallest = smallest
+
+    def rank(self, stream: Stream, can_mux: bool = True) -> tuple:
+        """Sort key of streams of the same resolution, the preferred stream sorts first. Without can_mux, avoiding
+        progressive streams would give a video without audio, so they come first instead."""
+        progressive_first = self.progressive != "avoid" or not can_mux
+        size = stream_size(stream)
+        return (0 if stream.is_progressive == progressive_first else 1,
+                self.codecs.get(codec_name(stream), len(self.codecs)), -(getattr(stream, "fps", None) or 0),
+                (size if size is not None else stream.bitrate or 0) if self.smallest else -(stream.bitrate or 0))
+
+    def height_ladder(self, heights: list[int]) -> list[int]:
+        """Orders the resolutions (highest first) to try: the highest one within max_height first, then each lower
+        one, then the ones above max_height from the lowest up, so a missing resolution never leaves a job without a
+        stream."""
+        if self.max_height is None:
+            return heights
+        return [height for height in heights if height <= self.max_height] + \
+            [height for height in reversed(heights) if height > self.max_height]
+
+    @classmethod
+    def from_config(cls, name: str, settings: dict) -> "Profile":
+        """Builds a profile from its stream_profiles entry in the config, e.g.
+        {"max_height": 1080, "codecs": ["avc1"], "smallest": true}."""
+        return cls(name, settings.get("max_height"), settings.get("progressive", "prefer"),
+                   settings.get("codecs", ()), settings.get("smallest", False))
+
+
+class StreamIndex:
+    """A video's mp4 video streams grouped by resolution, and its mp4 audio streams, built in one pass over the
+    stream list instead of a pytube query per lookup.
+
+    select() memoizes its choice per profile, so applying the same few profiles to one video again is a dict lookup.
+    can_mux tells whether audio can be muxed into video-only streams, i.e. whether ffmpeg was found.
+    """
+
+    def __init__(self, streams: Iterable[Stream], can_mux: bool = True) -> None:
+        self.can_mux = can_mux
+        self.by_height = {}  # height -> mp4 streams with video
+        audio = []
+        for stream in streams:
+            if stream.subtype != "mp4":
+                continue
+            if stream.includes_video_track and stream.resolution:
+                self.by_height.setdefault(int(stream.resolution.rstrip("p")), []).append(stream)
+            elif stream.type == "audio":
+                audio.append(stream)
+        self.heights = sorted(self.by_height, reverse=True)
+        self.audio = max(audio, key=audio_bitrate, default=None)  # the best audio stream, for mux and mp3
+        self._selected = {}  # profile -> stream
+
+    def select(self, profile: Profile) -> Optional[Stream]:
+        """Returns the profile's stream: the preferred stream of the first resolution on its ladder that has any,
+        among the progressive streams first if the profile only wants those, or avoids them but no audio could be
+        muxed into the others. None if the video has no mp4 video."""
+        try:
+            return self._selected[profile]
+        except KeyError:
+            pass
+        stream = None
+        ladder = profile.height_ladder(self.heights)
+        if profile.progressive == "only" or (profile.progressive == "avoid" and not self.can_mux):
+            stream = self._first_on_ladder(profile, ladder, progressive_only=True)
+        stream = stream or self._first_on_ladder(profile, ladder, progressive_only=False)
+        self._selected[profile] = stream
+        return stream
+
+    def _first_on_ladder(self, profile: Profile, ladder: list[int], progressive_only: bool) -> Optional[Stream]:
+        for height in ladder:
+            candidates = [stream for stream in self.by_height[height] if stream.is_progressive or not progressive_only]
+            if candidates:
+                return min(candidates, key=lambda stream: profile.rank(stream, self.can_mux))
+        return None
+
+
+def builtin_profile(resolution: str) -> Optional[Profile]:
+    """Returns the profile of a resolution option: MAX_PROGRESSIVE, BEST_QUALITY or a resolution like 720p."""
+    if resolution == MAX_PROGRESSIVE:
+        return Profile(resolution, progressive="only")
+    if resolution == BEST_QUALITY:
+        return Profile(resolution, progressive="avoid")
+    if resolution.endswith("p") and resolution[:-1].isdigit():
+        return Profile(resolution, max_height=int(resolution[:-1]))
+    return None
+
+
+def build_profiles(settings: Optional[dict] = None) -> dict[str, Profile]:
+    """Returns the profiles of every resolution option in RESOLUTIONS, then the stream_profiles of the config."""
+    profiles = {resolution: builtin_profile(resolution) for resolution in RESOLUTIONS}
+    for name, profile_settings in (settings or {}).items():
+        profiles[name] = Profile.from_config(name, profile_settings)
+    return profiles
+
+
+def codec_name(stream: Stream) -> Optional[str]:
+    """Returns the codec family of a stream's video, e.g. avc1 for avc1.64001F."""
+    return stream.video_codec.split(".")[0] if stream.video_codec else None
+
+
+def audio_bitrate(stream: Stream) -> int:
+    return int(stream.abr.rstrip("kbps")) if stream.abr else stream.bitrate or 0
+
+
+def stream_size(stream: Stream) -> Optional[int]:
+    """Returns a stream's size in bytes from the manifest, or estimated from its bitrate, without the HEAD request
+    Stream.filesize sends when the manifest has no size."""
+    if stream._filesize:
+        return stream._filesize
+    if stream._monostate.duration and stream.bitrate:
+        return stream.filesize_approx
+    return None
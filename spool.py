@@ -0,0 +1,316 @@
+"""Job spool shared by worker processes, on one machine or on several machines with a shared folder, so downloads
+and their post-processing (hashing, muxing, transcoding) scale past what one process can do:
+
+    python cli.py --spool /shared/spool.sqlite3 URL [URL ...]
+    python spool.py /shared/spool.sqlite3 [-j 3] [-o /shared/downloads]   (on every machine, as often as wanted)
+    python spool.py /shared/spool.sqlite3 --status
+
+Workers claim jobs with a lease they renew by heartbeat while the job runs. A job whose worker died is queued again
+once its lease expires, and failed after MAX_LEASE_ATTEMPTS lost leases, so a job that crashes workers can't take
+them all down in turn.
+"""
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date
+from typing import Iterator, Optional
+
+from bandwidth import NORMAL, PRIORITIES
+from download_queue import Job, QUEUED, FAILED, CANCELLED, FINISHED_STATES
+from resources import CONFIG_JSON_PATH
+
+LEASED = "leased"
+DEFAULT_LEASE = 60  # seconds a claimed job stays with its worker without a heartbeat
+HEARTBEATS_PER_LEASE = 4  # workers renew their leases this many times per lease
+MAX_LEASE_ATTEMPTS = 3  # a job is failed after losing this many leases
+POLL_INTERVAL = 1.0  # seconds an idle worker waits before looking for new jobs again
+BUSY_TIMEOUT = 30  # seconds to wait for another process's write to the spool to finish
+JOB_COLUMNS = ("id", "url", "format", "resolution", "priority", "options", "state", "message", "worker",
+               "lease_expires", "attempts", "cancel_requested", "created", "updated")
+
+
+class JobSpool:
+    """SQLite table of download jobs that any number of processes submit to and claim from.
+
+    Claims, heartbeats and reclaims are single transactions, so two workers never hold the same job. The database
+    stays in SQLite's default rollback journal mode, as WAL needs shared memory that network filesystems don't have;
+    the spool relies on the filesystem's file locks instead (NFSv4 and SMB have them). Leases are compared against
+    each machine's clock, so the machines' clocks should agree to well within a lease.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+        with self._transaction() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    url TEXT NOT NULL,
+                    format TEXT NOT NULL,
+                    resolution TEXT NOT NULL,
+                    priority INTEGER NOT NULL,
+                    options TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    message TEXT NOT NULL,
+                    worker TEXT,
+                    lease_expires REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    cancel_requested INTEGER NOT NULL DEFAULT 0,
+                    created REAL NOT NULL,
+                    updated REAL NOT NULL
+                )""")
+            connection.execute("CREATE INDEX IF NOT EXISTS jobs_by_state ON jobs (state, priority, id)")
+            connection.execute("CREATE INDEX IF NOT EXISTS jobs_by_worker ON jobs (worker, state)")
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Runs the statements in the with block as one transaction, holding the database's write lock from the
+        start, so reads in it can't go stale before the writes."""
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._connection
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+    def submit(self, url: str, format_type: str, resolution: str, priority: str = NORMAL, **batch_filters) -> int:
+        """Queues a url, returning its job id. batch_filters are passed to Engine.submit(), dates as ISO strings:
+        skip_downloaded for any url, the others for playlist and channel urls."""
+        if priority not in PRIORITIES:
+            raise ValueError(f"Invalid priority '{priority}'")
+        now = time.time()
+        with self._transaction() as connection:
+            return connection.execute(
+                "INSERT INTO jobs (url, format, resolution, priority, options, state, message, created, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (url, format_type, resolution, PRIORITIES.index(priority), json.dumps(batch_filters), QUEUED,
+                 "Queued", now, now)).lastrowid
+
+    def claim(self, worker: str, lease: float = DEFAULT_LEASE) -> Optional[dict]:
+        """Leases the next queued job to worker, highest priority first, after reclaiming expired leases. Returns the
+        job, or None if there is none."""
+        now = time.time()
+        with self._transaction() as connection:
+            self._reclaim_expired(connection, now)
+            row = connection.execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE state = ? "
+                                     f"ORDER BY priority, id LIMIT 1", (QUEUED,)).fetchone()
+            if row is None:
+                return None
+            connection.execute("UPDATE jobs SET state = ?, message = ?, worker = ?, lease_expires = ?, "
+                               "attempts = attempts + 1, updated = ? WHERE id = ?",
+                               (LEASED, f"Running on {worker}", worker, now + lease, now, row[0]))
+            row = connection.execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE id = ?", (row[0],)).fetchone()
+        return job_dict(row)
+
+    @staticmethod
+    def _reclaim_expired(connection: sqlite3.Connection, now: float) -> None:
+        """Queues the jobs whose worker stopped renewing its lease again, cancels them if that was asked for, and
+        fails them after MAX_LEASE_ATTEMPTS."""
+        expired = "state = ? AND lease_expires < ?"
+        connection.execute(f"UPDATE jobs SET state = ?, message = ?, worker = NULL, updated = ? "
+                           f"WHERE {expired} AND cancel_requested", (CANCELLED, "Cancelled", now, LEASED, now))
+        connection.execute(f"UPDATE jobs SET state = ?, message = 'Worker lost ' || attempts || ' times', "
+                           f"worker = NULL, updated = ? WHERE {expired} AND attempts >= ?",
+                           (FAILED, now, LEASED, now, MAX_LEASE_ATTEMPTS))
+        connection.execute(f"UPDATE jobs SET state = ?, message = ?, worker = NULL, updated = ? WHERE {expired}",
+                           (QUEUED, "Worker lost, queued again", now, LEASED, now))
+
+    def heartbeat(self, worker: str, lease: float = DEFAULT_LEASE) -> set[int]:
+        """Renews the leases of all of worker's jobs. Returns the ids of the jobs it still holds and should keep
+        running: not the ones whose lease expired and went to another worker, nor the ones asked to cancel."""
+        now = time.time()
+        with self._transaction() as connection:
+            connection.execute("UPDATE jobs SET lease_expires = ? WHERE worker = ? AND state = ?",
+                               (now + lease, worker, LEASED))
+            rows = connection.execute("SELECT id FROM jobs WHERE worker = ? AND state = ? AND NOT cancel_requested",
+                                      (worker, LEASED)).fetchall()
+        return {job_id for job_id, in rows}
+
+    def finish(self, job_id: int, worker: str, state: str, message: str) -> bool:
+        """Records the outcome of a job, if worker still holds its lease. Returns whether it did."""
+        now = time.time()
+        with self._transaction() as connection:
+            return connection.execute("UPDATE jobs SET state = ?, message = ?, lease_expires = NULL, updated = ? "
+                                      "WHERE id = ? AND worker = ? AND state = ?",
+                                      (state, message, now, job_id, worker, LEASED)).rowcount > 0
+
+    def release(self, job_id: int, worker: str) -> None:
+        """Gives a job back to the queue without counting the lease as lost, e.g. when its worker shuts down."""
+        with self._transaction() as connection:
+            connection.execute("UPDATE jobs SET state = ?, message = ?, worker = NULL, lease_expires = NULL, "
+                               "attempts = attempts - 1, updated = ? WHERE id = ? AND worker = ? AND state = ?",
+                               (QUEUED, "Queued", time.time(), job_id, worker, LEASED))
+
+    def cancel(self, job_id: int) -> None:
+        """Cancels a queued job, or asks the worker of a running one to cancel it at its next heartbeat."""
+        now = time.time()
+        with self._transaction() as connection:
+            connection.execute("UPDATE jobs SET state = ?, message = ?, updated = ? WHERE id = ? AND state = ?",
+                               (CANCELLED, "Cancelled", now, job_id, QUEUED))
+            connection.execute("UPDATE jobs SET cancel_requested = 1, updated = ? WHERE id = ? AND state = ?",
+                               (now, job_id, LEASED))
+
+    def get(self, job_id: int) -> Optional[dict]:
+        with self._lock:
+            row = self._connection.execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE id = ?",
+                                           (job_id,)).fetchone()
+        return job_dict(row) if row else None
+
+    def counts(self) -> dict:
+        """Returns the number of jobs in each state."""
+        with self._lock:
+            return dict(self._connection.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+def job_dict(row: tuple) -> dict:
+    job = dict(zip(JOB_COLUMNS, row))
+    job["priority"] = PRIORITIES[job["priority"]]
+    job["options"] = json.loads(job["options"])
+    return job
+
+
+class SpoolWorker:
+    """Claims jobs from a spool and runs them on an engine, as many at a time as the engine has workers.
+
+    Pass the worker as the engine's on_change. A heartbeat thread renews the leases of the running jobs, and cancels
+    the ones that were asked to cancel or whose lease was lost. Playlists and channels are listed by the worker that
+    claims them, queueing their videos on the spool for every worker to share.
+    """
+
+    def __init__(self, spool: JobSpool, worker_id: Optional[str] = None, lease: float = DEFAULT_LEASE) -> None:
+        self.spool = spool
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.lease = lease
+        self.engine = None
+        self._lock = threading.RLock()  # queue.submit() calls on_change on the submitting thread
+        self._claimed = {}  # engine job id -> spool job id
+        self._slot_free = threading.Event()
+        self._stopping = threading.Event()
+
+    def __call__(self, job: Job) -> None:
+        if job.state not in FINISHED_STATES:
+            return
+        with self._lock:
+            spool_id = self._claimed.pop(job.id, None)
+        if spool_id is None:
+            return
+        self.spool.finish(spool_id, self.worker_id, job.state, job.message)
+        self.engine.queue.forget(job.id)
+        self._slot_free.set()
+
+    def run(self, engine, until_idle: bool = False) -> None:
+        """Runs claimed jobs on engine until stop() is called, or if until_idle, until every job of the spool has
+        finished, including the jobs of other workers, which might lose their lease. Jobs still running when it stops
+        are given back to the spool."""
+        self.engine = engine
+        heartbeat = threading.Thread(target=self._heartbeat, name="spool-heartbeat", daemon=True)
+        heartbeat.start()
+        try:
+            while not self._stopping.is_set():
+                with self._lock:
+                    running = len(self._claimed)
+                if running >= engine.worker_count:
+                    self._slot_free.wait(POLL_INTERVAL)
+                    self._slot_free.clear()
+                    continue
+                spool_job = self.spool.claim(self.worker_id, self.lease)
+                if spool_job is None:
+                    if until_idle and not running and not self.spool.counts().get(LEASED):
+                        break  # no other worker's job is left to be reclaimed either
+                    self._slot_free.wait(POLL_INTERVAL)
+                    self._slot_free.clear()
+                    continue
+                self._start(spool_job)
+        finally:
+            self._stopping.set()
+            heartbeat.join()
+            with self._lock:
+                claimed, self._claimed = self._claimed, {}
+            for job_id, spool_id in claimed.items():
+                engine.pause(job_id)  # keeps the partial download, for whichever worker claims the job next
+                self.spool.release(spool_id, self.worker_id)
+
+    def stop(self) -> None:
+        self._stopping.set()
+        self._slot_free.set()
+
+    def _start(self, spool_job: dict) -> None:
+        spool = self.spool
+        options = spool_job["options"]
+
+        def submit_video(url: str) -> None:
+            spool.submit(url, spool_job["format"], spool_job["resolution"], spool_job["priority"],
+                         skip_downloaded=options.get("skip_downloaded", True))
+
+        with self._lock:
+            job = self.engine.submit(spool_job["url"], spool_job["format"], spool_job["resolution"],
+                                     spool_job["priority"], max_count=options.get("max_count"),
+                                     after=options.get("after") and date.fromisoformat(options["after"]),
+                                     before=options.get("before") and date.fromisoformat(options["before"]),
+                                     skip_downloaded=options.get("skip_downloaded", True), submit_video=submit_video)
+            self._claimed[job.id] = spool_job["id"]
+
+    def _heartbeat(self) -> None:
+        while not self._stopping.wait(self.lease / HEARTBEATS_PER_LEASE):
+            try:
+                held = self.spool.heartbeat(self.worker_id, self.lease)
+            except sqlite3.Error as e:
+                print(f"Heartbeat failed, {e}", file=sys.stderr)  # retried at the next one, before the lease ends
+                continue
+            with self._lock:
+                lost = [job_id for job_id, spool_id in self._claimed.items() if spool_id not in held]
+            for job_id in lost:
+                self.engine.cancel(job_id)
+
+
+def main(argv: list[str] = None) -> int:
+    from config import Config
+    parser = argparse.ArgumentParser(description="Run downloads queued on a job spool, alongside any other workers "
+                                                 "of the same spool.")
+    parser.add_argument("spool", help="spool database, e.g. on a folder shared by every machine")
+    parser.add_argument("-j", "--jobs", type=int, help="number of concurrent downloads (default: worker_count)")
+    parser.add_argument("-o", "--output", help="download folder (default: download_path in the config)")
+    parser.add_argument("--lease", type=float, default=DEFAULT_LEASE,
+                        help=f"seconds before the jobs of a worker that stopped answering are queued again "
+                             f"(default: {DEFAULT_LEASE})")
+    parser.add_argument("--until-idle", action="store_true", help="exit once every job of the spool has finished")
+    parser.add_argument("--status", action="store_true", help="print the number of jobs in each state and exit")
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+    spool = JobSpool(args.spool)
+    if args.status:
+        print(", ".join(f"{count} {state}" for state, count in sorted(spool.counts().items())) or "No jobs")
+        return 0
+    config = Config(CONFIG_JSON_PATH)
+    if not (args.output or config.get("download_path")):
+        print("No download folder, use --output or set one in the GUI", file=sys.stderr)
+        return 2
+    from engine import Engine
+    worker = SpoolWorker(spool, lease=args.lease)
+    engine = Engine(config, on_change=worker, download_path=args.output, worker_count=args.jobs)
+    print(f"Worker {worker.worker_id} running {engine.worker_count} jobs at a time from {args.spool}",
+          file=sys.stderr)
+    try:
+        worker.run(engine, until_idle=args.until_idle)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        spool.close()
+        config.flush()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,20 @@
+import pytest
+
+
+class FakeClock:
+    """A time function that stands still until a test moves it forward by adding to now."""
+
+    def __init__(self, now: float = 1_700_000_000.0) -> None:
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(request, monkeypatch) -> FakeClock:
+    """A FakeClock patched over the time function the test module names in CLOCK_TARGET, e.g.
+    "retry.time.monotonic"."""
+    clock = FakeClock()
+    monkeypatch.setattr(request.module.CLOCK_TARGET, clock)
+    return clock
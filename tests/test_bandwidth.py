@@ -0,0 +1,98 @@
+import threading
+import time
+
+import pytest
+
+from bandwidth import BandwidthScheduler, TokenBucket, HIGH, LOW, NORMAL, MIN_BURST, parse_rate
+
+CLOCK_TARGET = "bandwidth.time.monotonic"
+
+
+def test_token_bucket_refills_at_its_rate_up_to_its_burst(clock):
+    bucket = TokenBucket(4 * MIN_BURST)  # a burst of a quarter second is MIN_BURST
+    clock.now += 0.1
+    assert bucket.refill() == pytest.approx(0.4 * MIN_BURST)
+    clock.now += 10
+    assert bucket.refill() == MIN_BURST
+
+
+def test_token_bucket_goes_into_debt_by_one_chunk(clock):
+    bucket = TokenBucket(1000)
+    assert bucket.wait_time() == 0
+    bucket.take(500)
+    assert bucket.wait_time() == pytest.approx(0.5)
+    clock.now += 0.5
+    bucket.refill()
+    assert bucket.wait_time() == 0
+
+
+def test_scheduler_without_cap_does_not_wait():
+    scheduler = BandwidthScheduler()
+    share = scheduler.register(1)
+    start = time.perf_counter()
+    for _ in range(100):
+        scheduler.acquire(share, 10 * 1024 * 1024)
+    assert time.perf_counter() - start < 0.1
+
+
+def test_scheduler_lets_waiting_chunks_through_by_priority():
+    rate = 4 * MIN_BURST
+    scheduler = BandwidthScheduler(rate)
+    scheduler.bucket.refill()
+    scheduler.bucket.take(rate * 0.3)  # every acquire below has to wait for this debt
+    order = []
+
+    def download(job_id: int) -> None:
+        scheduler.acquire(scheduler._shares[job_id], MIN_BURST)
+        order.append(job_id)
+
+    threads = []
+    for job_id, priority in ((1, LOW), (2, NORMAL), (3, HIGH)):
+        scheduler.register(job_id, priority)
+        threads.append(threading.Thread(target=download, args=(job_id,)))
+        threads[-1].start()
+        time.sleep(0.02)  # queued in arrival order low, normal, high
+    for thread in threads:
+        thread.join(5)
+    assert order == [3, 2, 1]
+
+
+def test_scheduler_caps_a_job_at_its_own_rate():
+    rate = 4 * MIN_BURST
+    scheduler = BandwidthScheduler()
+    share = scheduler.register(1, NORMAL, rate)
+    start = time.perf_counter()
+    for _ in range(4):
+        scheduler.acquire(share, MIN_BURST)
+    assert 0.75 <= time.perf_counter() - start < 1.5  # four chunks of a quarter second each
+
+
+def test_waiting_chunks_stop_when_the_job_is_cancelled():
+    class Cancelled(Exception):
+        pass
+
+    def check_cancelled():
+        if cancelled.is_set():
+            raise Cancelled()
+
+    cancelled = threading.Event()
+    scheduler = BandwidthScheduler(MIN_BURST)
+    share = scheduler.register(1, check_cancelled=check_cancelled)
+    scheduler.bucket.refill()
+    scheduler.bucket.take(MIN_BURST * 10)  # ten seconds of debt
+    threading.Timer(0.1, cancelled.set).start()
+    start = time.perf_counter()
+    with pytest.raises(Cancelled):
+        scheduler.acquire(share, MIN_BURST)
+    assert time.perf_counter() - start < 1
+
+
+@pytest.mark.parametrize("rate, expected", [("500K", 500 * 1024), ("2M", 2 * 1024 ** 2),
+                                            ("2.5MB/s", int(2.5 * 1024 ** 2)), ("", None), (None, None), (1000, 1000)])
+def test_parse_rate(rate, expected):
+    assert parse_rate(rate) == expected
+
+
+def test_parse_rate_rejects_garbage():
+    with pytest.raises(ValueError):
+        parse_rate("fast")
@@ -0,0 +1,95 @@
+import os
+import sqlite3
+
+import pytest
+
+import download_index
+from download_index import DownloadIndex, file_checksum
+
+VIDEO_ID = "aaaaaaaaaaa"
+
+
+def write_file(path, content: bytes) -> str:
+    with open(path, "wb") as outfile:
+        outfile.write(content)
+    return str(path)
+
+
+@pytest.fixture
+def index(tmp_path) -> DownloadIndex:
+    return DownloadIndex(str(tmp_path / "index.sqlite3"))
+
+
+def test_index_of_the_old_schema_is_migrated_with_an_empty_quality(tmp_path):
+    index_path = str(tmp_path / "index.sqlite3")
+    file_path = write_file(tmp_path / "video.mp3", b"audio")
+    connection = sqlite3.connect(index_path)
+    with connection:
+        connection.execute("""
+            CREATE TABLE downloads (
+                video_id TEXT NOT NULL,
+                format TEXT NOT NULL,
+                itag INTEGER,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                checksum TEXT NOT NULL,
+                completed_at REAL NOT NULL,
+                PRIMARY KEY (video_id, format)
+            )""")
+        connection.execute("INSERT INTO downloads VALUES (?, 'mp3', 140, ?, 5, 0, 'checksum', 0)",
+                           (VIDEO_ID, file_path))
+    connection.close()
+
+    index = DownloadIndex(index_path)
+    assert index.get(VIDEO_ID, "mp3", "")["path"] == file_path
+    assert (VIDEO_ID, "mp3", "") in index
+    index.add(VIDEO_ID, "mp3", "720p", file_path, 251)  # the quality is part of the key now
+    assert index.get(VIDEO_ID, "mp3", "")["itag"] == 140
+    assert index.get(VIDEO_ID, "mp3", "720p")["itag"] == 251
+    tables = [row[0] for row in index._connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+    assert tables == ["downloads"]
+    index._connection.close()
+    assert DownloadIndex(index_path).get(VIDEO_ID, "mp3", "") is not None  # opening it again changes nothing
+
+
+def test_index_keeps_each_quality_of_a_video_apart(tmp_path, index):
+    low = write_file(tmp_path / "low.mp4", b"360p")
+    high = write_file(tmp_path / "high.mp4", b"1080p")
+    index.add(VIDEO_ID, "mp4", "360p", low, 18)
+    index.add(VIDEO_ID, "mp4", "1080p", high, 137)
+    assert index.get(VIDEO_ID, "mp4", "360p")["path"] == low
+    assert index.get(VIDEO_ID, "mp4", "1080p")["path"] == high
+    assert (VIDEO_ID, "mp4", "720p") not in index
+    os.remove(high)
+    assert (VIDEO_ID, "mp4", "1080p") not in index
+
+
+def test_rescan_hashes_only_changed_files(tmp_path, index, monkeypatch):
+    unchanged = write_file(tmp_path / "unchanged.mp4", b"unchanged")
+    updated = write_file(tmp_path / "updated.mp4", b"before")
+    index.add(VIDEO_ID, "mp4", "720p", unchanged)
+    index.add("bbbbbbbbbbb", "mp4", "720p", updated)
+    write_file(updated, b"after the edit")
+    hashed = []
+    monkeypatch.setattr(download_index, "file_checksum", lambda path: hashed.append(path) or file_checksum(path))
+
+    assert index.rescan(str(tmp_path)) == {"unchanged": 1, "updated": 1, "moved": 0, "removed": 0}
+    assert hashed == [updated]
+    entry = index.get("bbbbbbbbbbb", "mp4", "720p")
+    assert (entry["size"], entry["checksum"]) == (len(b"after the edit"), file_checksum(updated))
+
+
+def test_rescan_follows_moved_files_by_checksum_and_drops_missing_ones(tmp_path, index):
+    moved = write_file(tmp_path / "moved.mp4", b"moved video")
+    removed = write_file(tmp_path / "removed.mp4", b"removed video")
+    index.add(VIDEO_ID, "mp4", "720p", moved)
+    index.add("bbbbbbbbbbb", "mp4", "720p", removed)
+    write_file(tmp_path / "same size.mp4", b"other video")  # only a size match, its checksum differs
+    os.replace(moved, tmp_path / "renamed.mp4")
+    os.remove(removed)
+
+    assert index.rescan(str(tmp_path)) == {"unchanged": 0, "updated": 0, "moved": 1, "removed": 1}
+    assert index.get(VIDEO_ID, "mp4", "720p")["path"] == str(tmp_path / "renamed.mp4")
+    assert index.get("bbbbbbbbbbb", "mp4", "720p") is None
+    assert index.rescan(str(tmp_path)) == {"unchanged": 1, "updated": 0, "moved": 0, "removed": 0}
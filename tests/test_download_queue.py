@@ -0,0 +1,177 @@
+import collections
+import queue
+import threading
+import time
+
+import pytest
+
+from bandwidth import HIGH, LOW, NORMAL
+from download_queue import DownloadQueue, Job, JobPaused, CANCELLED, DONE, DOWNLOADING, PAUSED, QUEUED
+
+URL = "https://youtu.be/aaaaaaaaaaa"
+
+
+class FakeDownloads:
+    """Queue handler whose jobs run until they are let through, passing a cancellation checkpoint every few ms."""
+
+    def __init__(self) -> None:
+        self.runs = []
+        self.started = queue.Queue()
+        self._gates = collections.defaultdict(threading.Event)
+
+    def let_through(self, *jobs: Job) -> None:
+        for job in jobs:
+            self._gates[job.id].set()
+
+    def wait_started(self) -> int:
+        return self.started.get(timeout=5)
+
+    def __call__(self, job: Job) -> None:
+        self.runs.append(job.id)
+        job.state = DOWNLOADING
+        self.started.put(job.id)
+        while not self._gates[job.id].wait(0.005):
+            job.check_cancelled()
+
+
+def wait_for_state(job: Job, state: str) -> None:
+    deadline = time.monotonic() + 5
+    while job.state != state:
+        assert time.monotonic() < deadline, f"job {job.id} is {job.state}, not {state}"
+        time.sleep(0.005)
+
+
+@pytest.fixture
+def downloads() -> FakeDownloads:
+    return FakeDownloads()
+
+
+def test_jobs_start_by_priority_and_stale_entries_are_skipped(downloads):
+    download_queue = DownloadQueue(downloads, worker_count=1)
+    first = download_queue.submit(URL, "mp4", "720p")
+    downloads.wait_started()
+    lowered = download_queue.submit(URL, "mp4", "720p", NORMAL)
+    low = download_queue.submit(URL, "mp4", "720p", LOW)
+    normal = download_queue.submit(URL, "mp4", "720p", NORMAL)
+    raised = download_queue.submit(URL, "mp4", "720p", NORMAL)
+    download_queue.set_priority(raised.id, HIGH)
+    download_queue.set_priority(lowered.id, LOW)
+    assert download_queue.pending == 6  # the old entries of reprioritized jobs stay until a worker skips them
+    downloads.let_through(first, lowered, low, normal, raised)
+    download_queue.join()
+    assert downloads.runs == [first.id, raised.id, normal.id, low.id, lowered.id]
+    assert download_queue.pending == 0
+
+
+def test_cancelled_queued_job_never_runs_and_running_one_stops(downloads):
+    download_queue = DownloadQueue(downloads, worker_count=1)
+    running = download_queue.submit(URL, "mp4", "720p")
+    downloads.wait_started()
+    queued = download_queue.submit(URL, "mp4", "720p")
+    download_queue.cancel(queued.id)
+    assert queued.state == CANCELLED
+    download_queue.cancel(running.id)
+    download_queue.join()
+    assert running.state == CANCELLED
+    assert downloads.runs == [running.id]
+
+
+def test_paused_jobs_keep_their_place_until_resumed(downloads):
+    download_queue = DownloadQueue(downloads, worker_count=1)
+    running = download_queue.submit(URL, "mp4", "720p")
+    downloads.wait_started()
+    queued = download_queue.submit(URL, "mp4", "720p")
+    download_queue.pause(queued.id)
+    assert queued.state == PAUSED
+    download_queue.pause(running.id)
+    wait_for_state(running, PAUSED)  # at its next checkpoint, and the paused queued job isn't started meanwhile
+    assert downloads.runs == [running.id]
+
+    download_queue.resume(running.id)
+    assert downloads.wait_started() == running.id
+    download_queue.resume(queued.id)
+    assert queued.state == QUEUED
+    downloads.let_through(running, queued)
+    download_queue.join()
+    assert downloads.runs == [running.id, running.id, queued.id]
+    assert (running.state, queued.state) == (DONE, DONE)
+
+
+def test_only_submitted_jobs_can_be_paused(downloads):
+    download_queue = DownloadQueue(downloads, worker_count=1)
+    created = download_queue.create(URL, "mp4", "720p")
+    download_queue.pause(created.id)
+    assert created.state == QUEUED and not created.paused
+
+
+def test_job_paused_and_resumed_before_its_checkpoint_keeps_running():
+    runs = []
+    started, checkpoint = threading.Event(), threading.Event()
+
+    def handler(job: Job) -> None:
+        runs.append(job.id)
+        job.state = DOWNLOADING
+        started.set()
+        checkpoint.wait(5)
+        job.check_cancelled()
+
+    download_queue = DownloadQueue(handler, worker_count=1)
+    job = download_queue.submit(URL, "mp4", "720p")
+    assert started.wait(5)
+    download_queue.pause(job.id)
+    download_queue.resume(job.id)
+    checkpoint.set()
+    download_queue.join()
+    assert job.state == DONE
+    assert runs == [job.id]
+
+
+def test_job_resumed_while_it_stops_for_a_pause_is_queued_again():
+    runs = []
+    started, paused = threading.Event(), threading.Event()
+
+    def handler(job: Job) -> None:
+        runs.append(job.id)
+        if len(runs) == 1:
+            started.set()
+            paused.wait(5)
+            try:
+                job.check_cancelled()
+            except JobPaused:
+                download_queue.resume(job.id)  # after the checkpoint, before _run() sees the pause
+                raise
+
+    download_queue = DownloadQueue(handler, worker_count=1)
+    job = download_queue.submit(URL, "mp4", "720p")
+    assert started.wait(5)
+    download_queue.pause(job.id)
+    paused.set()
+    download_queue.join()
+    assert runs == [job.id, job.id]
+    assert job.state == DONE
+
+
+def test_pending_counts_the_jobs_waiting_for_a_worker_and_join_waits_for_all(downloads):
+    download_queue = DownloadQueue(downloads, worker_count=2)
+    jobs = [download_queue.submit(URL, "mp4", "720p") for _ in range(5)]
+    downloads.wait_started()
+    downloads.wait_started()
+    assert download_queue.pending == 3
+    joined = threading.Event()
+    threading.Thread(target=lambda: (download_queue.join(), joined.set()), daemon=True).start()
+    downloads.let_through(*jobs[:4])
+    assert not joined.wait(0.2)
+    downloads.let_through(jobs[4])
+    assert joined.wait(5)
+    assert download_queue.pending == 0
+    assert [job.state for job in jobs] == [DONE] * 5
+
+
+def test_invalid_priority_is_rejected_before_the_job_is_created(downloads):
+    download_queue = DownloadQueue(downloads, worker_count=1)
+    with pytest.raises(ValueError):
+        download_queue.submit(URL, "mp4", "720p", "urgent")
+    assert download_queue.jobs == []
+    job = download_queue.create(URL, "mp4", "720p")
+    with pytest.raises(ValueError):
+        download_queue.set_priority(job.id, "urgent")
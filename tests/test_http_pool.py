@@ -0,0 +1,129 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from http_pool import ConnectionPool
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def do_GET(self) -> None:
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        parts = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+        if parts.path == "/body":
+            self.send_body(b"x" * int(query.get("size", 10)))
+        elif parts.path == "/status":
+            self.send_body(b"error", int(query["code"]))
+        elif parts.path == "/redirect":
+            self.send_response(int(query.get("code", 302)))
+            self.send_header("Location", "/body?size=5")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        elif parts.path == "/hang-up":  # answers as if the connection stays open, then closes it
+            self.send_body(b"bye")
+            self.close_connection = True
+
+    do_POST = do_GET
+
+    def send_body(self, body: bytes, status: int = 200) -> None:
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("X-Method", self.command)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def pool():
+    pool = ConnectionPool(max_per_host=2)
+    pool.proxies = {}  # straight to the local server, whatever proxy the environment has
+    yield pool
+    pool.close()
+
+
+def test_connection_is_reused_once_the_body_is_read(server, pool):
+    for _ in range(3):
+        with pool.request("GET", server + "/body?size=1000") as response:
+            assert response.read() == b"x" * 1000
+    stats = pool.stats()
+    assert (stats["requests"], stats["reused"], stats["open"], stats["idle"]) == (3, 2, 1, 1)
+
+
+def test_response_closed_early_discards_its_connection(server, pool):
+    response = pool.request("GET", server + "/body?size=100000")
+    assert len(response.read(10)) == 10
+    response.close()
+    assert (pool.stats()["open"], pool.stats()["idle"]) == (0, 0)
+    with pool.request("GET", server + "/body") as response:
+        response.read()
+    assert pool.stats()["reused"] == 0  # the unread rest of the body never reaches the next request
+
+
+def test_requests_over_the_per_host_limit_wait_for_a_connection(server, pool):
+    held = [pool.request("GET", server + "/body") for _ in range(pool.max_per_host)]
+    done = threading.Event()
+
+    def request():
+        with pool.request("GET", server + "/body") as response:
+            response.read()
+        done.set()
+
+    threading.Thread(target=request, daemon=True).start()
+    assert not done.wait(0.2)
+    assert pool.stats()["waits"] == 1
+    held[0].read()  # gives the connection back
+    assert done.wait(5)
+    held[1].close()
+    assert pool.stats()["open"] == 1
+
+
+@pytest.mark.parametrize("code", [404, 503])
+def test_error_status_raises_http_error_and_keeps_the_connection(server, pool, code):
+    with pytest.raises(HTTPError) as error:
+        pool.request("GET", server + f"/status?code={code}")
+    assert error.value.code == code
+    assert error.value.read() == b"error"
+    assert (pool.stats()["open"], pool.stats()["idle"]) == (1, 1)
+
+
+def test_redirects_are_followed(server, pool):
+    with pool.request("GET", server + "/redirect") as response:
+        assert response.geturl() == server + "/body?size=5"
+        assert response.read() == b"x" * 5
+
+
+@pytest.mark.parametrize("code, method", [(303, "GET"), (307, "POST")])
+def test_redirect_of_a_post_keeps_it_only_for_307_and_308(server, pool, code, method):
+    with pool.request("POST", server + f"/redirect?code={code}", body=b"{}") as response:
+        response.read()
+        assert response.headers["X-Method"] == method
+
+
+def test_request_on_a_connection_the_server_closed_is_sent_again(server, pool):
+    with pool.request("GET", server + "/hang-up") as response:
+        assert response.read() == b"bye"
+    assert pool.stats()["idle"] == 1  # nothing said it would close
+    time.sleep(0.1)  # for the server to close its end
+    with pool.request("GET", server + "/body") as response:
+        assert response.read() == b"x" * 10
+    stats = pool.stats()
+    assert (stats["requests"], stats["reused"], stats["open"]) == (2, 0, 1)
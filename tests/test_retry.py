@@ -0,0 +1,110 @@
+import http.client
+import socket
+from email.message import Message
+from urllib.error import HTTPError, URLError
+
+import pytest
+from pytube import exceptions
+
+from retry import CircuitBreaker, RetryPolicy, classify_error, EXPIRED, PERMANENT, RETRYABLE
+from segmented import DiskSpaceError, PartInUseError, RangeNotSupportedError, SegmentError
+
+CLOCK_TARGET = "retry.time.monotonic"
+
+
+def http_error(code: int, retry_after: str = None) -> HTTPError:
+    headers = Message()
+    if retry_after is not None:
+        headers["Retry-After"] = retry_after
+    return HTTPError("https://example.com/videoplayback", code, "error", headers, None)
+
+
+@pytest.mark.parametrize("error, kind", [
+    (http_error(429), RETRYABLE),
+    (http_error(503), RETRYABLE),
+    (http_error(500), RETRYABLE),
+    (http_error(403), EXPIRED),
+    (http_error(410), EXPIRED),
+    (http_error(404), PERMANENT),
+    (http_error(400), PERMANENT),
+    (URLError("connection refused"), RETRYABLE),
+    (ConnectionResetError(), RETRYABLE),
+    (socket.timeout(), RETRYABLE),
+    (http.client.IncompleteRead(b""), RETRYABLE),
+    (SegmentError("Connection closed with 10 bytes left"), RETRYABLE),
+    (PartInUseError("video.mp4 is being downloaded by another job"), RETRYABLE),
+    (RangeNotSupportedError("Server ignored range request"), PERMANENT),
+    (DiskSpaceError("not enough disk space"), PERMANENT),
+    (exceptions.VideoUnavailable("aaaaaaaaaaa"), PERMANENT),
+    (exceptions.AgeRestrictedError("aaaaaaaaaaa"), PERMANENT),
+    (exceptions.VideoPrivate("aaaaaaaaaaa"), PERMANENT),
+    (exceptions.RegexMatchError("video_id", "pattern"), PERMANENT),
+    (exceptions.HTMLParseError("unexpected page"), EXPIRED),
+    (ValueError("bug"), PERMANENT),
+])
+def test_classify_error(error, kind):
+    assert classify_error(error) == kind
+
+
+def test_retry_delay_backs_off_with_jitter():
+    policy = RetryPolicy(base_delay=1, max_delay=10)
+    for retry_number, cap in ((1, 1), (2, 2), (3, 4), (5, 10), (9, 10)):
+        delays = [policy.delay(retry_number) for _ in range(200)]
+        assert all(0 <= delay <= cap for delay in delays)
+        assert max(delays) > cap / 2
+
+
+def test_retry_delay_honours_retry_after():
+    policy = RetryPolicy(base_delay=1, max_delay=60)
+    assert policy.delay(1, http_error(429, "30")) >= 30
+    assert policy.delay(1, http_error(429, "600")) == 60
+
+
+def test_circuit_opens_after_threshold_rate_limited_responses(clock):
+    breaker = CircuitBreaker(threshold=3, cooldown=5)
+    breaker.record("host", 429)
+    breaker.record("host", 503)
+    assert breaker.retry_in("host") == 0
+    breaker.record("host", 429)
+    assert breaker.retry_in("host") == pytest.approx(5)
+    assert breaker.retry_in("other host") == 0
+
+
+def test_circuit_lets_one_probe_through_after_the_cooldown(clock):
+    breaker = CircuitBreaker(threshold=3, cooldown=5)
+    for _ in range(3):
+        breaker.record("host", 429)
+    clock.now += 5
+    assert breaker.retry_in("host") == 0  # the probe
+    assert breaker.retry_in("host") > 0  # everyone else waits for it
+
+
+def test_successful_probe_closes_the_circuit(clock):
+    breaker = CircuitBreaker(threshold=3, cooldown=5)
+    for _ in range(3):
+        breaker.record("host", 429)
+    clock.now += 5
+    assert breaker.retry_in("host") == 0
+    breaker.record("host", 200)
+    assert breaker.retry_in("host") == 0
+    breaker.record("host", 429)  # the count starts over
+    assert breaker.retry_in("host") == 0
+
+
+def test_failed_probe_reopens_the_circuit_for_twice_as_long(clock):
+    breaker = CircuitBreaker(threshold=3, cooldown=5)
+    for _ in range(3):
+        breaker.record("host", 429)
+    clock.now += 5
+    assert breaker.retry_in("host") == 0
+    breaker.record("host", 429)
+    assert breaker.retry_in("host") == pytest.approx(10)
+
+
+def test_rate_limited_responses_while_open_do_not_extend_it(clock):
+    breaker = CircuitBreaker(threshold=3, cooldown=5)
+    for _ in range(3):
+        breaker.record("host", 429)
+    clock.now += 2
+    breaker.record("host", 429)  # a request that was already under way
+    assert breaker.retry_in("host") == pytest.approx(3)
@@ -0,0 +1,157 @@
+import json
+import os
+import socket
+import time
+
+import pytest
+
+from segmented import PartClaim, PartialDownload, PartInUseError, LOCK_STALE_AFTER, MIN_SEGMENT_SIZE, discard_partial, \
+    split_ranges
+
+FILESIZE = 1000
+IDENTITY = {"video_id": "aaaaaaaaaaa", "itag": 18, "filesize": FILESIZE}
+
+
+def make_partial(tmp_path, done=None) -> PartialDownload:
+    file_path = str(tmp_path / "video.mp4")
+    if done is not None:
+        with open(file_path + ".part", "wb") as outfile:
+            outfile.truncate(FILESIZE)
+        with open(file_path + ".part.json", "w") as outfile:
+            json.dump({**IDENTITY, "done": done}, outfile)
+    return PartialDownload(None, file_path, IDENTITY)
+
+
+def test_new_download_is_preallocated_and_missing_everything(tmp_path):
+    partial = make_partial(tmp_path)
+    partial.close()
+    assert os.path.getsize(partial.part_path) == FILESIZE
+    assert partial.missing_ranges() == [(0, FILESIZE - 1)]
+
+
+def test_mark_done_merges_overlapping_and_adjacent_ranges(tmp_path):
+    partial = make_partial(tmp_path)
+    partial.close()
+    partial._mark_done(100, 199)
+    partial._mark_done(300, 399)
+    assert partial.done == [[100, 199], [300, 399]]
+    partial._mark_done(200, 249)  # adjacent to the first range
+    assert partial.done == [[100, 249], [300, 399]]
+    partial._mark_done(240, 310)  # overlaps both
+    assert partial.done == [[100, 399]]
+    partial._mark_done(0, 9)
+    assert partial.done == [[0, 9], [100, 399]]
+
+
+def test_missing_ranges_are_the_gaps_between_done_ranges(tmp_path):
+    partial = make_partial(tmp_path, done=[[0, 99], [200, 299]])
+    partial.close()
+    assert partial.missing_ranges() == [(100, 199), (300, FILESIZE - 1)]
+    partial._mark_done(300, FILESIZE - 1)
+    assert partial.missing_ranges() == [(100, 199)]
+    partial._mark_done(100, 199)
+    assert partial.missing_ranges() == []
+
+
+def test_sidecar_of_another_stream_is_not_resumed(tmp_path):
+    file_path = str(tmp_path / "video.mp4")
+    with open(file_path + ".part.json", "w") as outfile:
+        json.dump({**IDENTITY, "itag": 22, "done": [[0, 99]]}, outfile)
+    with open(file_path + ".part", "wb") as outfile:
+        outfile.truncate(FILESIZE)
+    partial = PartialDownload(None, file_path, IDENTITY)
+    partial.close()
+    assert partial.missing_ranges() == [(0, FILESIZE - 1)]
+
+
+def test_flush_replaces_the_sidecar_without_leaving_a_temp_file(tmp_path):
+    partial = make_partial(tmp_path, done=[[0, 99]])
+    partial.close()
+    partial._mark_done(100, 199)
+    partial.flush()
+    with open(partial.sidecar_path) as infile:
+        assert json.load(infile)["done"] == [[0, 199]]
+    assert sorted(os.listdir(tmp_path)) == ["video.mp4.part", "video.mp4.part.json"]
+
+
+def test_discarded_download_leaves_no_files(tmp_path):
+    partial = make_partial(tmp_path, done=[[0, 99]])
+    partial.close()
+    partial.discard()
+    partial.flush()
+    assert not os.path.exists(partial.part_path)
+    assert not os.path.exists(partial.sidecar_path)
+
+
+def test_discard_partial_leaves_files_another_download_claims(tmp_path):
+    partial = make_partial(tmp_path, done=[[0, 99]])
+    partial.close()
+    with open(partial.file_path, "wb"):
+        pass
+    with PartClaim(partial.file_path):
+        discard_partial(partial.file_path, with_file=True)
+        assert os.path.exists(partial.part_path)
+    discard_partial(partial.file_path)
+    assert not os.path.exists(partial.part_path)
+    assert not os.path.exists(partial.sidecar_path)
+    assert os.path.exists(partial.file_path)  # a finished download is only removed with_file
+    discard_partial(partial.file_path, with_file=True)
+    assert not os.path.exists(partial.file_path)
+
+
+def test_split_ranges_splits_evenly_into_segment_count():
+    size = 8 * MIN_SEGMENT_SIZE
+    assert split_ranges([(0, size - 1)], 4) == [(start, start + 2 * MIN_SEGMENT_SIZE - 1)
+                                                 for start in range(0, size, 2 * MIN_SEGMENT_SIZE)]
+
+
+def test_split_ranges_keeps_segments_at_least_min_segment_size():
+    assert split_ranges([(0, MIN_SEGMENT_SIZE - 1)], 4) == [(0, MIN_SEGMENT_SIZE - 1)]
+
+
+def test_split_ranges_never_crosses_a_gap():
+    ranges = [(0, 3 * MIN_SEGMENT_SIZE - 1), (5 * MIN_SEGMENT_SIZE, 6 * MIN_SEGMENT_SIZE - 1)]
+    segments = split_ranges(ranges, 4)
+    assert segments == [(0, MIN_SEGMENT_SIZE - 1), (MIN_SEGMENT_SIZE, 2 * MIN_SEGMENT_SIZE - 1),
+                        (2 * MIN_SEGMENT_SIZE, 3 * MIN_SEGMENT_SIZE - 1),
+                        (5 * MIN_SEGMENT_SIZE, 6 * MIN_SEGMENT_SIZE - 1)]
+    assert sum(end - start + 1 for start, end in segments) == 4 * MIN_SEGMENT_SIZE
+
+
+def test_part_claim_is_exclusive_until_released(tmp_path):
+    file_path = str(tmp_path / "video.mp4")
+    with PartClaim(file_path) as claim:
+        assert os.path.isfile(claim.lock_path)
+        with pytest.raises(PartInUseError):
+            PartClaim(file_path).acquire()
+    assert not os.path.exists(claim.lock_path)
+    with PartClaim(file_path):
+        pass
+
+
+def write_lock(file_path: str, host: str, pid: int, age: float = 0) -> None:
+    with open(file_path + ".part.lock", "w") as outfile:
+        json.dump({"host": host, "pid": pid}, outfile)
+    modified = time.time() - age
+    os.utime(file_path + ".part.lock", (modified, modified))
+
+
+def test_part_claim_waits_for_a_live_process(tmp_path):
+    file_path = str(tmp_path / "video.mp4")
+    write_lock(file_path, socket.gethostname(), os.getppid(), age=LOCK_STALE_AFTER * 2)
+    with pytest.raises(PartInUseError):
+        PartClaim(file_path).acquire()
+    write_lock(file_path, "other-host", 1)
+    with pytest.raises(PartInUseError):
+        PartClaim(file_path).acquire()
+
+
+def test_part_claim_takes_over_the_lock_of_a_lost_process(tmp_path):
+    file_path = str(tmp_path / "video.mp4")
+    write_lock(file_path, "other-host", 1, age=LOCK_STALE_AFTER + 1)
+    with PartClaim(file_path):
+        pass
+    if os.name != "nt":
+        write_lock(file_path, socket.gethostname(), 2 ** 22 + 1)  # above the default pid_max, so never running
+        with PartClaim(file_path):
+            pass
@@ -0,0 +1,35 @@
+from types import SimpleNamespace
+
+from resources import BEST_QUALITY, MAX_PROGRESSIVE
+from selection import StreamIndex, builtin_profile
+
+
+def make_stream(itag: int, resolution: str, progressive: bool, bitrate: int) -> SimpleNamespace:
+    return SimpleNamespace(itag=itag, subtype="mp4", type="video", resolution=resolution, includes_video_track=True,
+                           includes_audio_track=progressive, is_progressive=progressive, video_codec="avc1.64001F",
+                           fps=30, bitrate=bitrate, abr=None, _filesize=None, _monostate=SimpleNamespace(duration=None))
+
+
+STREAMS = [make_stream(22, "720p", True, 2_000_000), make_stream(136, "720p", False, 3_000_000),
+           make_stream(137, "1080p", False, 5_000_000), make_stream(18, "360p", True, 500_000)]
+
+
+def test_best_quality_picks_video_only_stream_with_ffmpeg():
+    assert StreamIndex(STREAMS, can_mux=True).select(builtin_profile(BEST_QUALITY)).itag == 137
+
+
+def test_best_quality_picks_stream_with_audio_without_ffmpeg():
+    assert StreamIndex(STREAMS, can_mux=False).select(builtin_profile(BEST_QUALITY)).itag == 22
+
+
+def test_best_quality_falls_back_to_video_only_stream_without_progressive_one():
+    streams = [stream for stream in STREAMS if not stream.is_progressive]
+    assert StreamIndex(streams, can_mux=False).select(builtin_profile(BEST_QUALITY)).itag == 137
+
+
+def test_max_progressive_falls_back_to_lower_progressive_stream():
+    assert StreamIndex(STREAMS).select(builtin_profile(MAX_PROGRESSIVE)).itag == 22
+
+
+def test_resolution_falls_back_to_next_lower_one():
+    assert StreamIndex(STREAMS).select(builtin_profile("480p")).itag == 18
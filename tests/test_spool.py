@@ -0,0 +1,99 @@
+import pytest
+
+from bandwidth import HIGH, LOW
+from download_queue import CANCELLED, DONE, FAILED, QUEUED
+from spool import JobSpool, LEASED, MAX_LEASE_ATTEMPTS
+
+CLOCK_TARGET = "spool.time.time"
+
+
+@pytest.fixture
+def spool(tmp_path, clock) -> JobSpool:
+    spool = JobSpool(str(tmp_path / "spool.sqlite3"))
+    yield spool
+    spool.close()
+
+
+def test_claim_leases_the_highest_priority_job_first(spool, clock):
+    low = spool.submit("https://youtu.be/aaaaaaaaaaa", "mp4", "720p", LOW)
+    high = spool.submit("https://youtu.be/bbbbbbbbbbb", "mp4", "720p", HIGH, skip_downloaded=False)
+    job = spool.claim("worker-1", lease=60)
+    assert job["id"] == high
+    assert job["state"] == LEASED
+    assert job["worker"] == "worker-1"
+    assert job["lease_expires"] == clock.now + 60
+    assert job["attempts"] == 1
+    assert job["options"] == {"skip_downloaded": False}
+    assert spool.claim("worker-2")["id"] == low
+    assert spool.claim("worker-3") is None
+
+
+def test_heartbeat_renews_the_leases_the_worker_still_holds(spool, clock):
+    first = spool.submit("https://youtu.be/aaaaaaaaaaa", "mp4", "720p")
+    second = spool.submit("https://youtu.be/bbbbbbbbbbb", "mp4", "720p")
+    spool.claim("worker-1", lease=60)
+    spool.claim("worker-1", lease=60)
+    spool.cancel(second)
+    clock.now += 50
+    assert spool.heartbeat("worker-1", lease=60) == {first}  # the cancelled one should stop
+    assert spool.get(first)["lease_expires"] == clock.now + 60
+    clock.now += 50
+    assert spool.claim("worker-2") is None  # renewed, so not expired yet
+    assert spool.heartbeat("worker-2") == set()
+
+
+def test_expired_lease_is_reclaimed_by_the_next_claim(spool, clock):
+    job_id = spool.submit("https://youtu.be/aaaaaaaaaaa", "mp4", "720p")
+    spool.claim("worker-1", lease=60)
+    clock.now += 61
+    job = spool.claim("worker-2", lease=60)
+    assert job["id"] == job_id
+    assert job["worker"] == "worker-2"
+    assert job["attempts"] == 2
+    assert spool.heartbeat("worker-1") == set()  # worker-1 learns it lost the job
+
+
+def test_job_fails_after_losing_max_lease_attempts(spool, clock):
+    job_id = spool.submit("https://youtu.be/aaaaaaaaaaa", "mp4", "720p")
+    for attempt in range(MAX_LEASE_ATTEMPTS):
+        assert spool.claim(f"worker-{attempt}", lease=60)["id"] == job_id
+        clock.now += 61
+    assert spool.claim("worker-last") is None
+    job = spool.get(job_id)
+    assert job["state"] == FAILED
+    assert job["message"] == f"Worker lost {MAX_LEASE_ATTEMPTS} times"
+
+
+def test_finish_after_a_lost_lease_is_not_recorded(spool, clock):
+    job_id = spool.submit("https://youtu.be/aaaaaaaaaaa", "mp4", "720p")
+    spool.claim("worker-1", lease=60)
+    clock.now += 61
+    spool.claim("worker-2", lease=60)
+    assert not spool.finish(job_id, "worker-1", DONE, "Downloaded")
+    assert spool.get(job_id)["state"] == LEASED
+    assert spool.finish(job_id, "worker-2", DONE, "Downloaded")
+    job = spool.get(job_id)
+    assert (job["state"], job["message"], job["lease_expires"]) == (DONE, "Downloaded", None)
+    assert not spool.finish(job_id, "worker-2", FAILED, "Finished twice")
+
+
+def test_release_queues_the_job_again_without_counting_the_attempt(spool, clock):
+    job_id = spool.submit("https://youtu.be/aaaaaaaaaaa", "mp4", "720p")
+    spool.claim("worker-1")
+    spool.release(job_id, "worker-1")
+    job = spool.get(job_id)
+    assert (job["state"], job["worker"], job["attempts"]) == (QUEUED, None, 0)
+
+
+def test_cancel_of_a_queued_job_and_of_an_expired_running_one(spool, clock):
+    queued = spool.submit("https://youtu.be/aaaaaaaaaaa", "mp4", "720p")
+    running = spool.submit("https://youtu.be/bbbbbbbbbbb", "mp4", "720p", HIGH)
+    spool.claim("worker-1", lease=60)
+    spool.cancel(queued)
+    spool.cancel(running)
+    assert spool.get(queued)["state"] == CANCELLED
+    assert spool.get(running)["state"] == LEASED  # until its worker sees the request, or its lease expires
+    clock.now += 61
+    assert spool.claim("worker-2") is None
+    assert spool.get(running)["state"] == CANCELLED
+    assert spool.counts() == {CANCELLED: 2}
@@ -0,0 +1,73 @@
+import os
+import subprocess
+import tempfile
+import threading
+from typing import Callable, Optional
+
+from pytube import Stream
+
+from segmented import iter_chunks, PartClaim
+
+DEFAULT_MP3_BITRATE = "192k"
+# ffmpeg is a process of its own, so this bounds the number of encoder processes to the number of cores
+TRANSCODE_SLOTS = threading.BoundedSemaphore(os.cpu_count() or 1)
+
+
+class TranscodeError(Exception):
+    """Raised when ffmpeg fails to encode a stream."""
+
+
+def mp3_arguments(bitrate: Optional[str] = DEFAULT_MP3_BITRATE, quality: Optional[int] = None) -> list[str]:
+    """Returns the ffmpeg mp3 encoder arguments, variable bitrate if a quality (0 best - 9 worst) is given."""
+    if quality is not None:
+        return ["-codec:a", "libmp3lame", "-q:a", str(quality)]
+    return ["-codec:a", "libmp3lame", "-b:a", bitrate or DEFAULT_MP3_BITRATE]
+
+
+def transcode_to_mp3(stream: Stream, output_path: str, ffmpeg: str, bitrate: Optional[str] = DEFAULT_MP3_BITRATE,
+                     quality: Optional[int] = None, on_progress: Optional[Callable] = None,
+                     throttle: Optional[Callable[[int], None]] = None) -> str:
+    """Downloads an audio stream and encodes it to mp3 while it downloads, by piping the downloaded bytes straight
+    into ffmpeg instead of saving the whole file and reading it back. Returns the mp3 file path.
+
+    The bytes only pass through memory, so there is no partial download to resume: a retry, or a job that was
+    paused, downloads and encodes the stream again from the start.
+
+    on_progress has the same signature as pytube's on_progress_callback, throttle is passed to iter_chunks().
+    Raises PartInUseError while another download writes the same file.
+    """
+    file_path = os.path.join(output_path, os.path.splitext(stream.default_filename)[0] + ".mp3")
+    temp_path = file_path + ".part"
+    with PartClaim(file_path):
+        if os.path.isfile(file_path):  # encoded by the download that held the claim before
+            return file_path
+        with TRANSCODE_SLOTS, tempfile.TemporaryFile() as errors:
+            command = [ffmpeg, "-y", "-loglevel", "error", "-i", "pipe:0", "-vn",
+                       *mp3_arguments(bitrate, quality), "-f", "mp3", temp_path]
+            process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=errors)
+            try:
+                try:
+                    bytes_remaining = stream.filesize
+                    for chunk in iter_chunks(stream.url, bytes_remaining, throttle):
+                        process.stdin.write(chunk)
+                        bytes_remaining -= len(chunk)
+                        if on_progress:
+                            on_progress(stream, chunk, bytes_remaining)
+                    process.stdin.close()
+                except BrokenPipeError:
+                    pass  # ffmpeg exited early, its error is raised below
+                return_code = process.wait()
+            except BaseException:
+                process.kill()
+                process.wait()
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+            if return_code != 0:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                errors.seek(0)
+                message = errors.read().decode(errors="replace").strip()
+                raise TranscodeError(message or f"ffmpeg exited with code {return_code}")
+        os.replace(temp_path, file_path)
+    return file_path